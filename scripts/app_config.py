@@ -0,0 +1,126 @@
+import os
+import json
+import configparser
+
+# 設定ファイル・環境変数による設定項目の上書き
+# 各スクリプトの「設定項目」（モジュール先頭の大文字の定数）は、コードを書き換えずに次の順で上書きできる（上ほど優先）
+#
+#   1. 環境変数 CSVREAD_<モジュール名>__<設定名>   例: CSVREAD_INSERT_TO_POSTGRES__DB_PASSWORD
+#   2. 環境変数 CSVREAD_<設定名>                   例: CSVREAD_APP_ROOT_DIR（同じ名前の設定を持つ全スクリプトに効く）
+#   3. 設定ファイルの [<モジュール名>] セクション   例: [insert_to_postgres] の DB_HOST
+#   4. 設定ファイルの [csvread] セクション         （同じ名前の設定を持つ全スクリプトに効く）
+#
+# 設定ファイルは環境変数 CSVREAD_CONFIG のパス、無ければ scripts フォルダの1つ上の csvread.ini（無くてもよい）
+# 値は元の定数の型に合わせて変換する（True/False は true/false/yes/no/1/0、リストなどは JSON で書く）
+#
+# APP_ROOT_DIR は他のパスの元になるため get() で読み込み、その他の設定項目は設定項目の最後で apply(globals()) して上書きする
+# このモジュールは csvread.py の起動時にも読み込まれるため、標準ライブラリの軽いモジュールだけを使う
+
+# 設定項目
+ENV_PREFIX = 'CSVREAD_'
+CONFIG_FILE_ENV = 'CSVREAD_CONFIG'
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'csvread.ini')
+GLOBAL_SECTION = 'csvread'
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+FALSE_VALUES = {'0', 'false', 'no', 'off'}
+
+_config = None
+_config_path = None
+
+
+def config_file_path():
+    """使う設定ファイルのパス（環境変数 CSVREAD_CONFIG があればそのパス）"""
+    return os.environ.get(CONFIG_FILE_ENV) or DEFAULT_CONFIG_FILE
+
+
+def load_config():
+    """設定ファイルを読み込む（パスが変わらない限り1回だけ読む）。ファイルが無い場合は空の設定"""
+    global _config, _config_path
+    path = config_file_path()
+    if _config is None or _config_path != path:
+        config = configparser.ConfigParser(interpolation=None)
+        if os.environ.get(CONFIG_FILE_ENV) and not os.path.exists(path):
+            raise FileNotFoundError(f"設定ファイルが見つかりません: {path}")
+        config.read(path, encoding='utf-8-sig')
+        _config, _config_path = config, path
+    return _config
+
+
+def module_name(module_file):
+    """モジュールの __file__ からモジュール名を返す（直接実行された場合の __main__ ではなくファイル名）"""
+    return os.path.splitext(os.path.basename(module_file))[0]
+
+
+def lookup(name, module=None):
+    """設定名 name の上書き値（文字列）と、その出どころを返す。上書きされていなければ (None, None)"""
+    if module:
+        env_name = f'{ENV_PREFIX}{module.upper()}__{name}'
+        if env_name in os.environ:
+            return os.environ[env_name], env_name
+    if ENV_PREFIX + name in os.environ:
+        return os.environ[ENV_PREFIX + name], ENV_PREFIX + name
+
+    config = load_config()
+    for section in ([module] if module else []) + [GLOBAL_SECTION]:
+        if config.has_option(section, name):
+            return config.get(section, name), f'{_config_path} [{section}]'
+    return None, None
+
+
+def convert(value, default, name):
+    """文字列の設定値を default の型に変換する"""
+    if isinstance(default, bool):
+        if value.strip().lower() in TRUE_VALUES:
+            return True
+        if value.strip().lower() in FALSE_VALUES:
+            return False
+        raise ValueError(f"設定 {name} には true / false を指定してください: {value!r}")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, str):
+        return value
+    if default is None:
+        # 未設定（None）が既定値の項目は、数値などは JSON として、それ以外は文字列として扱う
+        if value.strip().lower() in ('', 'none', 'null'):
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    if isinstance(default, (list, tuple, dict)):
+        converted = json.loads(value)
+        return tuple(converted) if isinstance(default, tuple) else converted
+    raise ValueError(f"設定 {name} は設定ファイル・環境変数からは変更できません")
+
+
+def get(name, default, module_file=None):
+    """設定名 name の値を返す。上書きされていなければ default"""
+    value, _ = lookup(name, module_name(module_file) if module_file else None)
+    return default if value is None else convert(value, default, name)
+
+
+def apply(module_globals):
+    """
+    モジュールの設定項目（大文字の名前の定数）のうち、設定ファイル・環境変数で指定されたものを上書きする
+    各スクリプトの設定項目の最後で apply(globals()) として呼ぶ
+    """
+    module = module_name(module_globals['__file__'])
+    for name, default in list(module_globals.items()):
+        if not name.isupper() or name.startswith('_'):
+            continue
+        value, _ = lookup(name, module)
+        if value is not None:
+            module_globals[name] = convert(value, default, name)
+
+
+def overrides():
+    """上書きされている設定の一覧（出どころ, 設定名）。設定ファイルのセクション名・環境変数名のまま返す"""
+    items = [(name, name[len(ENV_PREFIX):]) for name in sorted(os.environ)
+             if name.startswith(ENV_PREFIX) and name != CONFIG_FILE_ENV]
+    config = load_config()
+    for section in config.sections():
+        items.extend((f'{_config_path} [{section}]', option.upper()) for option in config.options(section))
+    return items
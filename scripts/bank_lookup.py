@@ -0,0 +1,206 @@
+import os
+import unicodedata
+
+import pandas as pd
+
+import app_config
+
+# 銀行・支店名の引き当て
+# bank_master.csv（銀行コード・銀行名・支店コード・支店名）を読み込み、正規化した銀行名（と略称）の前方一致の木（トライ）を作る。
+# 「広島信用金庫五日市中央支店」「みずほ市ヶ谷」のように銀行名と支店名が1つの値になっている場合も、
+# 先頭から最も長く一致した銀行名までを銀行、残りを支店として分ける
+# 引き当ては列の重複を除いた値ごとに1回だけ行う（銀行名の種類は行数に比べてごく少ない）
+#
+# bank_master.csv の形式（UTF-8、ヘッダーあり。全銀協の金融機関・店舗コードなどから作る）:
+#   銀行コード,銀行名,支店コード,支店名,別名
+#   0001,みずほ銀行,,,
+#   0001,みずほ銀行,001,東京営業部,
+#   0167,山陰合同銀行,,,ごうぎん
+# - 支店の行が無い銀行は、銀行の行（支店コード・支店名が空）だけでもよい
+# - 別名は「/」区切り。「銀行」「信用金庫」などを除いた略称（みずほ・山陰合同 など）は自動で登録する
+
+# 設定項目
+BANK_CODE_COLUMN = '銀行コード'
+BANK_NAME_COLUMN = '銀行名'
+BRANCH_CODE_COLUMN = '支店コード'
+BRANCH_NAME_COLUMN = '支店名'
+ALIAS_COLUMN = '別名'
+ALIAS_SEPARATOR = '/'
+
+# 略称を自動で登録する際に除く、金融機関の種類の語（同じ略称になる金融機関がある場合は、この並びで先の種類を優先する）
+BANK_TYPE_SUFFIXES = ['銀行', '信用金庫', '信用組合', '労働金庫', '農業協同組合', '信用農業協同組合連合会']
+# 銀行名・支店名の表記ゆれ（NFKC 正規化・空白の除去の後に置き換える）
+NAME_REPLACEMENTS = [
+    ('信金', '信用金庫'),
+    ('信組', '信用組合'),
+    ('労金', '労働金庫'),
+    ('ヶ', 'ケ'),
+    ('ヵ', 'カ'),
+]
+# 銀行名と支店名の間の区切り（支店名の前後から除く）
+BRANCH_SEPARATORS = '・/,、()-_'
+# 支店名の末尾の「支店」は引き当ての際に無視する（「蒲田」と「蒲田支店」を同じ支店とみなす）
+BRANCH_SUFFIX = '支店'
+
+app_config.apply(globals())
+
+# トライの節点で、そこまでの文字列が銀行名（または略称）であることを表すキー
+_BANK_END = ''
+
+
+def normalize_bank_name(name):
+    """
+    銀行名・支店名を引き当て用のキーに正規化する
+    全角英数・記号は半角に、半角カナは全角にし（NFKC）、空白を除去して英字を大文字にし、NAME_REPLACEMENTS の表記を揃える
+    """
+    if not isinstance(name, str):
+        return ''
+    key = ''.join(unicodedata.normalize('NFKC', name).split()).upper()
+    for variant, replacement in NAME_REPLACEMENTS:
+        key = key.replace(variant, replacement)
+    return key
+
+
+def branch_key(name):
+    """支店名の引き当て用のキー（末尾の「支店」を除く）"""
+    key = normalize_bank_name(name).strip(BRANCH_SEPARATORS)
+    if key.endswith(BRANCH_SUFFIX) and len(key) > len(BRANCH_SUFFIX):
+        key = key[:-len(BRANCH_SUFFIX)]
+    return key
+
+
+def short_names(bank_key):
+    """銀行名のキーから、金融機関の種類の語を除いた略称と、その種類の優先順位を返す"""
+    for priority, suffix in enumerate(BANK_TYPE_SUFFIXES):
+        if bank_key.endswith(suffix) and len(bank_key) - len(suffix) >= 2:
+            yield bank_key[:-len(suffix)], priority
+
+
+def add_to_trie(trie, key, bank_code):
+    node = trie
+    for char in key:
+        node = node.setdefault(char, {})
+    node[_BANK_END] = bank_code
+
+
+def build_bank_master(master_df):
+    """
+    bank_master.csv の DataFrame から、引き当て用の dict を作る
+    trie: 銀行名・別名・略称の前方一致の木 / names: 銀行コード → 銀行名 / branches: 銀行コード → {支店名のキー: (支店コード, 支店名)}
+    """
+    names = {}
+    branches = {}
+    keys = {}
+    for row in master_df.itertuples(index=False):
+        bank_code, bank_name = row.bank_code, row.bank_name
+        if not bank_code or not bank_name:
+            continue
+        # 同じ銀行コードの行が複数ある場合は、VLOOKUP と同じく先頭の行の銀行名を使う
+        names.setdefault(bank_code, bank_name)
+        keys.setdefault(normalize_bank_name(bank_name), bank_code)
+        for alias in row.aliases.split(ALIAS_SEPARATOR):
+            if normalize_bank_name(alias):
+                keys.setdefault(normalize_bank_name(alias), bank_code)
+        if row.branch_name:
+            branches.setdefault(bank_code, {}).setdefault(branch_key(row.branch_name), (row.branch_code, row.branch_name))
+
+    # 略称は正式名称・別名と重ならず、同じ種類の金融機関で1つに決まる場合だけ登録する（「中国」→ 中国銀行 など）
+    candidates = {}
+    for key, bank_code in list(keys.items()):
+        for short_name, priority in short_names(key):
+            candidates.setdefault(short_name, {}).setdefault(priority, set()).add(bank_code)
+    for short_name, by_priority in candidates.items():
+        bank_codes = by_priority[min(by_priority)]
+        if short_name not in keys and len(bank_codes) == 1:
+            keys[short_name] = next(iter(bank_codes))
+
+    trie = {}
+    for key, bank_code in keys.items():
+        add_to_trie(trie, key, bank_code)
+    return {'trie': trie, 'names': names, 'branches': branches}
+
+
+def load_bank_master(file_path):
+    """bank_master.csv を読み込み、build_bank_master() の dict を返す。ファイルが無い場合は None（銀行コードは引き当てない）"""
+    if not os.path.exists(file_path):
+        return None
+    master_df = pd.read_csv(file_path, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+    master_df.columns = master_df.columns.str.strip()
+    columns = {BANK_CODE_COLUMN: 'bank_code', BANK_NAME_COLUMN: 'bank_name', BRANCH_CODE_COLUMN: 'branch_code',
+               BRANCH_NAME_COLUMN: 'branch_name', ALIAS_COLUMN: 'aliases'}
+    missing = [col for col in (BANK_CODE_COLUMN, BANK_NAME_COLUMN) if col not in master_df.columns]
+    if missing:
+        raise ValueError(f"{os.path.basename(file_path)} に {missing} のカラムがありません")
+    master_df = master_df.reindex(columns=list(columns), fill_value='').rename(columns=columns)
+    return build_bank_master(master_df.apply(lambda col: col.str.strip()))
+
+
+def split_bank_name(banks, text):
+    """
+    銀行名（支店名を含んでもよい）の先頭から最も長く一致する銀行名を探し、(銀行コード, 残りの支店名の部分) を返す
+    残りの支店名の部分は、正規化する前の元の文字列から切り出す（半角カナなどの表記はそのまま）
+    一致しない場合は (None, '')
+    """
+    key = normalize_bank_name(text)
+    node = banks['trie']
+    bank_code, end = None, 0
+    for position, char in enumerate(key):
+        node = node.get(char)
+        if node is None:
+            break
+        if _BANK_END in node:
+            bank_code, end = node[_BANK_END], position + 1
+    # 残りが「銀行」「信用金庫」などで始まる場合は、略称だけが一致したマスタに無い金融機関（広島 + 銀行 など）とみなす
+    if bank_code is None or key[end:].startswith(tuple(BANK_TYPE_SUFFIXES)):
+        return None, ''
+    return bank_code, original_rest(text, end)
+
+
+def original_rest(text, end):
+    """
+    正規化したキーの先頭 end 文字に当たる部分を元の文字列 text から除き、残りを返す
+    正規化で文字数が変わる（空白の除去・「信金」→「信用金庫」など）ため、正規化した長さが end に達する最短の先頭部分を探す
+    前後の空白・区切り（全角の区切りを含む）は除く
+    """
+    cut = next((position for position in range(1, len(text) + 1) if len(normalize_bank_name(text[:position])) >= end),
+               len(text))
+    separators = ''.join(char for char in set(text[cut:])
+                         if char.isspace() or unicodedata.normalize('NFKC', char) in tuple(BRANCH_SEPARATORS))
+    return text[cut:].strip(separators)
+
+
+def resolve_bank(banks, bank_text, branch_text):
+    """1つの (銀行名, 支店名) を (銀行コード, 銀行名, 支店コード, 支店名) にする。引き当てられない項目は元の値・空のコード"""
+    bank_code, rest = split_bank_name(banks, bank_text)
+    if bank_code is None:
+        return '', bank_text, '', branch_text
+    # 支店名のカラムが空の場合は、銀行名から分けた残りを支店名とする
+    branch_text = branch_text or rest
+    branch_code, branch_name = banks['branches'].get(bank_code, {}).get(branch_key(branch_text), ('', branch_text))
+    return bank_code, banks['names'][bank_code], branch_code, branch_name
+
+
+def resolve_bank_names(banks, bank_names, branch_names=None):
+    """
+    銀行名の列（と支店名の列）から、bank_code / bank_name / branch_code / branch_name の DataFrame を返す
+    引き当ては (銀行名, 支店名) の重複を除いた組み合わせごとに1回だけ行い、元の並びに展開する
+    banks が None（bank_master.csv が無い）の場合は、銀行名・支店名は元の値、コードは空
+    """
+    if branch_names is None:
+        branch_names = pd.Series('', index=bank_names.index, dtype=object)
+    bank_names = bank_names.fillna('').astype(str)
+    branch_names = branch_names.fillna('').astype(str)
+    if banks is None:
+        return pd.DataFrame({'bank_code': '', 'bank_name': bank_names, 'branch_code': '', 'branch_name': branch_names},
+                            index=bank_names.index)
+
+    # 銀行名・支店名をそれぞれ番号にし、番号の組み合わせで重複を除く（文字列の組を作るより速い）
+    bank_codes, bank_uniques = pd.factorize(bank_names)
+    branch_codes, branch_uniques = pd.factorize(branch_names)
+    codes, pairs = pd.factorize(bank_codes.astype('int64') * max(len(branch_uniques), 1) + branch_codes)
+    bank_positions, branch_positions = divmod(pairs, max(len(branch_uniques), 1))
+    resolved = pd.DataFrame([resolve_bank(banks, bank_uniques[bank_position], branch_uniques[branch_position])
+                             for bank_position, branch_position in zip(bank_positions, branch_positions)],
+                            columns=['bank_code', 'bank_name', 'branch_code', 'branch_name'], dtype=object)
+    return pd.DataFrame({col: resolved[col].to_numpy(dtype=object)[codes] for col in resolved.columns},
+                        index=bank_names.index)
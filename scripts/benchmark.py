@@ -0,0 +1,240 @@
+import os
+import sys
+import json
+import shutil
+import time
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+import app_config
+import generate_sample_data
+import run_metrics
+
+# 検索 → 加工 → 結合 → DB登録 の各段階の処理時間を計測するベンチマーク
+# generate_sample_data.py で生成したダミーデータを使い、段階ごとに別プロセスで実行して
+# 処理時間・行数/秒・ピークメモリ（RSS）を記録する。結果は JSON で保存し、前回の結果と比較できる
+#
+# 使い方:
+#   python benchmark.py --rows 10000                     # 検索〜結合まで
+#   python benchmark.py --rows 100000 --with-load        # DB登録も計測（notes_receivable を作り直すので検証用DBで実行する）
+#   python benchmark.py --rows 10000 --compare 前回の結果.json   # 結果は 作業フォルダ\results に保存される
+
+# 設定項目
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
+# ベンチマーク用の作業フォルダ（ダミーデータ・各段階の出力・キャッシュを置く）
+BENCHMARK_WORK_DIR = os.path.join(APP_ROOT_DIR, 'benchmark')
+# マスタデータ（作業フォルダにコピーして使い、本番のマスタは変更しない）
+MASTER_DATA_DIR = os.path.join(APP_ROOT_DIR, 'master_data')
+
+STAGES = ['filter', 'transform', 'merge', 'load']
+# 前回の結果と比較したとき、この割合以上遅くなった段階を「悪化」として表示する
+REGRESSION_THRESHOLD = 0.10
+
+app_config.apply(globals())
+
+
+def work_paths(work_dir):
+    """作業フォルダ内の各段階の入出力パス"""
+    return {
+        'source': os.path.join(work_dir, 'source'),
+        'filtered': os.path.join(work_dir, 'filtered_originals'),
+        'processed': os.path.join(work_dir, 'processed_output'),
+        'merged': os.path.join(work_dir, 'merged_output'),
+        'master': os.path.join(work_dir, 'master_data'),
+        'cache': os.path.join(work_dir, 'cache'),
+    }
+
+
+def run_filter_stage(paths):
+    import filter_and_copy_csv
+    filter_and_copy_csv.INPUT_BASE_DIR = paths['source']
+    filter_and_copy_csv.SEARCH_RESULT_OUTPUT_BASE_DIR = paths['filtered']
+    filter_and_copy_csv.CACHE_FILE = os.path.join(paths['cache'], 'filter_cache.json')
+    filter_and_copy_csv.INDEX_FILE = os.path.join(paths['cache'], 'filter_index.json')
+    filter_and_copy_csv.copy_filtered_csv_files()
+
+
+def run_transform_stage(paths):
+    import process_data
+    process_data.FILTERED_ORIGINALS_DIR = paths['filtered']
+    process_data.PROCESSED_OUTPUT_BASE_DIR = paths['processed']
+    process_data.MASTER_DATA_DIR = paths['master']
+    process_data.CACHE_FILE = os.path.join(paths['cache'], 'process_cache.json')
+    process_data.process_csv_files()
+
+
+def run_merge_stage(paths):
+    import merge_processed_csv
+    merge_processed_csv.PROCESSED_OUTPUT_BASE_DIR = paths['processed']
+    merge_processed_csv.MERGED_OUTPUT_BASE_DIR = paths['merged']
+    merge_processed_csv.CACHE_FILE = os.path.join(paths['cache'], 'merge_cache.json')
+    merge_processed_csv.MERGE_CHUNK_DIR = os.path.join(paths['cache'], 'merged_chunks')
+    merge_processed_csv.merge_processed_csv_files()
+
+
+def run_load_stage(paths):
+    import insert_to_postgres
+    insert_to_postgres.MERGED_OUTPUT_DIR = paths['merged']
+    insert_to_postgres.save_csvs_to_postgres(mode='full')
+
+
+STAGE_FUNCTIONS = {
+    'filter': run_filter_stage,
+    'transform': run_transform_stage,
+    'merge': run_merge_stage,
+    'load': run_load_stage,
+}
+
+
+def stage_process_main(stage, paths, result_queue, quiet):
+    """段階を1つ実行し、(処理時間, ピークメモリ, 段階内の計測結果, エラー) を親プロセスに返す（別プロセスで実行される）"""
+    if quiet:
+        sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+        run_metrics.QUIET = True
+    run_metrics.start_run(stage)
+    start = time.perf_counter()
+    error = None
+    try:
+        STAGE_FUNCTIONS[stage](paths)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        error = str(e)
+    result_queue.put({'seconds': time.perf_counter() - start, 'peak_rss_mb': run_metrics.peak_rss_mb(),
+                      'metrics': run_metrics.snapshot(), 'error': error})
+
+
+def run_stage(stage, paths, quiet=True):
+    """
+    段階ごとに新しいプロセスで実行する（前の段階のメモリやインポート済みモジュールの影響を受けないようにする）
+    ピークメモリはその段階のプロセスの値（プロセスプールのワーカー分は含まない）
+    """
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=stage_process_main, args=(stage, paths, result_queue, quiet))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def reset_work_dir(paths):
+    """前回の計測の出力・キャッシュを削除し、マスタデータを作業フォルダにコピーし直す（毎回同じ条件で計測する）"""
+    for key in ['filtered', 'processed', 'merged', 'master', 'cache']:
+        shutil.rmtree(paths[key], ignore_errors=True)
+    os.makedirs(paths['master'], exist_ok=True)
+    for filename in ['master.csv', 'jgroupid_master.csv', 'bank_master.csv']:
+        src = os.path.join(MASTER_DATA_DIR, filename)
+        if os.path.exists(src):
+            shutil.copy2(src, paths['master'])
+    # ocr_result_id は空の対応表から採番する（実行ごとに同じ番号になる）
+    with open(os.path.join(paths['master'], 'ocr_id_mapping.json'), 'w', encoding='utf-8') as f:
+        json.dump({}, f)
+
+
+def git_revision():
+    """計測したコードのコミット（取得できなければ None）"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(current, previous):
+    """前回の結果と段階ごとに比較して表示し、悪化した段階の名前のリストを返す"""
+    previous_stages = {stage['stage']: stage for stage in previous.get('stages', [])}
+    regressions = []
+    print(f"\n--- 前回の結果との比較 (前回: {previous.get('revision')} / {previous.get('started_at')}) ---")
+    for stage in current['stages']:
+        before = previous_stages.get(stage['stage'])
+        if not before or not before.get('seconds') or stage.get('error'):
+            continue
+        change = (stage['seconds'] - before['seconds']) / before['seconds']
+        mark = '⚠️ 悪化' if change >= REGRESSION_THRESHOLD else ('✅ 改善' if change <= -REGRESSION_THRESHOLD else '  ')
+        print(f"  {mark} {stage['stage']:<10} {before['seconds']:8.2f} 秒 → {stage['seconds']:8.2f} 秒 ({change:+.1%})")
+        if change >= REGRESSION_THRESHOLD:
+            regressions.append(stage['stage'])
+    return regressions
+
+
+def run_benchmark(total_rows, rows_per_file, stages, work_dir=BENCHMARK_WORK_DIR, seed=0, quiet=True):
+    """ダミーデータを生成し、指定した段階を順に計測して結果（dict）を返す"""
+    paths = work_paths(work_dir)
+    print(f"  ⏳ ダミーデータを準備中... ({total_rows} 行)")
+    sample = generate_sample_data.generate_sample_data(paths['source'], total_rows, rows_per_file, seed)
+    print(f"  ✅ ファイル数: {sample['files']} / 明細行数: {sample['rows']} / {sample['bytes'] / 1024 / 1024:.1f} MB")
+
+    reset_work_dir(paths)
+    results = {
+        'revision': git_revision(),
+        'started_at': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': sample['params'],
+        'files': sample['files'],
+        'rows': sample['rows'],
+        'stages': [],
+    }
+
+    for stage in stages:
+        print(f"  ⏳ {stage} を計測中...")
+        result = run_stage(stage, paths, quiet)
+        stage_result = {
+            'stage': stage,
+            'seconds': round(result['seconds'], 3),
+            'rows_per_sec': round(sample['rows'] / result['seconds'], 1) if result['seconds'] > 0 else None,
+            'files_per_sec': round(sample['files'] / result['seconds'], 1) if result['seconds'] > 0 else None,
+            'peak_rss_mb': result['peak_rss_mb'],
+            'error': result['error'],
+            # 段階内の処理（parse / transform / copy など）ごとの時間・件数（run_metrics.py）
+            'metrics': result['metrics'],
+        }
+        results['stages'].append(stage_result)
+        if result['error']:
+            print(f"  ❌ エラー: {stage} の実行中に問題が発生しました。エラー: {result['error']}")
+            break
+        print(f"  ✅ {stage:<10} {stage_result['seconds']:8.2f} 秒 / {stage_result['rows_per_sec']:>10} 行/秒 / ピークメモリ {stage_result['peak_rss_mb']} MB")
+    return results
+
+
+# --- メイン処理 ---
+def main(argv=None, prog=None):
+    """コマンドライン引数（省略時は sys.argv）で計測を実行し、終了コード（失敗・悪化があれば 1）を返す"""
+    parser = argparse.ArgumentParser(prog=prog, description='検索〜DB登録の各段階の処理時間を計測する')
+    parser.add_argument('--rows', type=int, default=generate_sample_data.DEFAULT_TOTAL_ROWS, help='ダミーデータの明細行数（10000〜1000000 程度）')
+    parser.add_argument('--rows-per-file', type=int, default=generate_sample_data.DEFAULT_ROWS_PER_FILE, help='1ファイルあたりの明細行数の目安')
+    parser.add_argument('--seed', type=int, default=0, help='ダミーデータの乱数シード')
+    parser.add_argument('--work-dir', default=BENCHMARK_WORK_DIR, help='作業フォルダ')
+    parser.add_argument('--with-load', action='store_true', help='DB登録も計測する（insert_to_postgres.py の接続先の notes_receivable を作り直す）')
+    parser.add_argument('--compare', help='比較する前回の結果 JSON')
+    parser.add_argument('--verbose', action='store_true', help='各段階のスクリプトの出力も表示する')
+    args = parser.parse_args(argv)
+
+    stages = STAGES if args.with_load else [stage for stage in STAGES if stage != 'load']
+    print(f"--- ベンチマーク開始 ({datetime.now()}) ---")
+    results = run_benchmark(args.rows, args.rows_per_file, stages, args.work_dir, args.seed, quiet=not args.verbose)
+
+    results_dir = os.path.join(args.work_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{results['revision'] or 'unknown'}_{args.rows}.json")
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    print(f"\n✅ 計測結果を保存しました → {results_path}")
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare_results(results, json.load(f))
+
+    failed = any(stage['error'] for stage in results['stages'])
+    print(f"\n🎉 ベンチマークが完了しました！ ({datetime.now()}) 🎉")
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import struct
+import itertools
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+
+# PostgreSQL の COPY バイナリ形式（COPY ... FROM STDIN WITH (FORMAT binary)）へのエンコード
+# 数値・日時をカラムの型のバイナリ表現で送るため、DB 側で文字列から解釈し直す処理が不要になる
+# 形式は PostgreSQL のドキュメント「COPY → Binary Format」を参照（ヘッダー → 行ごとのフィールド → トレーラー）
+
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)  # 署名 + フラグ + ヘッダー拡張の長さ
+COPY_TRAILER = struct.pack('!h', -1)
+NULL_FIELD = struct.pack('!i', -1)
+
+# NUMERIC の内部表現（1万進数の桁の配列 + 重み・符号・表示桁数）
+NUMERIC_POSITIVE = 0x0000
+NUMERIC_NEGATIVE = 0x4000
+NUMERIC_NAN = 0xC000
+NUMERIC_BASE_DIGITS = 4
+
+# TIMESTAMP は 2000-01-01 からのマイクロ秒
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+
+# 隣り合う列をまとめてエンコードするときの、値の組み合わせの上限（merge_segments() を参照）
+SEGMENT_MAX_VALUES = 65536
+
+
+def encode_numeric(value):
+    """
+    NUMERIC の値（文字列・int・float）をバイナリ表現にする
+    float は repr() の桁数（元の値を再現できる最短の桁数）で送り、整数値の float は整数として送る（1000.0 → 1000）
+    """
+    if isinstance(value, float):
+        value = int(value) if value.is_integer() else repr(value)
+    number = Decimal(value) if isinstance(value, str) else Decimal(int(value))
+    if number.is_nan():
+        return struct.pack('!hhHh', 0, 0, NUMERIC_NAN, 0)
+
+    sign, digits, exponent = number.as_tuple()
+    digit_text = ''.join(map(str, digits))
+    scale = max(0, -exponent)
+    if exponent >= 0:
+        integer_part, fraction_part = digit_text + '0' * exponent, ''
+    else:
+        digit_text = digit_text.rjust(scale + 1, '0')
+        integer_part, fraction_part = digit_text[:-scale], digit_text[-scale:]
+
+    # 小数点を境に4桁ずつに区切る（整数部は左、小数部は右を0で埋める）
+    integer_part = integer_part.rjust(-(-len(integer_part) // NUMERIC_BASE_DIGITS) * NUMERIC_BASE_DIGITS, '0')
+    fraction_part = fraction_part.ljust(-(-len(fraction_part) // NUMERIC_BASE_DIGITS) * NUMERIC_BASE_DIGITS, '0')
+    groups = [int(integer_part[i:i + NUMERIC_BASE_DIGITS]) for i in range(0, len(integer_part), NUMERIC_BASE_DIGITS)]
+    weight = len(groups) - 1
+    groups += [int(fraction_part[i:i + NUMERIC_BASE_DIGITS]) for i in range(0, len(fraction_part), NUMERIC_BASE_DIGITS)]
+
+    # 先頭・末尾の 0 の桁は送らない（PostgreSQL 側の正規化と同じ）
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight, sign = 0, 0
+    return struct.pack(f'!hhHh{len(groups)}h', len(groups), weight,
+                       NUMERIC_NEGATIVE if sign else NUMERIC_POSITIVE, scale, *groups)
+
+
+def encode_timestamp(value):
+    """TIMESTAMP（タイムゾーンなし）の値（ISO 形式の文字列・datetime）をバイナリ表現にする"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    value = value.replace(tzinfo=None)
+    return struct.pack('!q', (value - POSTGRES_EPOCH) // timedelta(microseconds=1))
+
+
+def encode_text(value):
+    return str(value).encode('utf-8')
+
+
+# カラムの型（DDL の型名、括弧より前）→ 値をバイナリ表現にする関数
+ENCODERS = {
+    'SMALLINT': lambda value: struct.pack('!h', int(value)),
+    'INTEGER': lambda value: struct.pack('!i', int(value)),
+    'BIGINT': lambda value: struct.pack('!q', int(value)),
+    'NUMERIC': encode_numeric,
+    'TIMESTAMP': encode_timestamp,
+    'TEXT': encode_text,
+    'VARCHAR': encode_text,
+    'CHAR': encode_text,
+}
+
+
+def base_type_name(sql_type):
+    """'VARCHAR(7),' → 'VARCHAR'"""
+    return sql_type.rstrip(',').split('(')[0].upper()
+
+
+def encode_values(values, sql_type):
+    """
+    値の配列を (コード, フィールドのリスト) にする。values[i] のフィールド（長さ + バイナリ表現）は fields[codes[i]]
+    空文字・None・NaN は NULL。同じ値の多い列（conf_* / coord_* / 銀行名など）が多いため、エンコードはユニーク値ごとに1回だけ行う
+    """
+    encoder = ENCODERS[base_type_name(sql_type)]
+    codes, uniques = pd.factorize(values)
+    fields = []
+    for value in uniques:
+        if isinstance(value, str) and value == '':
+            fields.append(NULL_FIELD)
+            continue
+        data = encoder(value)
+        fields.append(struct.pack('!i', len(data)) + data)
+    fields.append(NULL_FIELD)  # factorize で -1 になる None / NaN
+    return np.where(codes < 0, len(fields) - 1, codes), fields
+
+
+def merge_segments(columns):
+    """
+    隣り合う列の (コード, フィールド) を、組み合わせの数が SEGMENT_MAX_VALUES 以下に収まる限り1つにまとめる
+    conf_* / coord_* のように値の種類が少ない列が続く部分は、行ごとに連結するバイト列が1つになる
+    """
+    segments = []
+    for codes, fields in columns:
+        if segments and len(segments[-1][1]) * len(fields) <= SEGMENT_MAX_VALUES:
+            previous_codes, previous_fields = segments[-1]
+            combined, codes = np.unique(previous_codes * len(fields) + codes, return_inverse=True)
+            fields = [previous_fields[value // len(fields)] + fields[value % len(fields)] for value in combined.tolist()]
+            segments[-1] = (codes.ravel(), fields)
+        else:
+            segments.append((codes, fields))
+    return segments
+
+
+def encode_rows(rows, sql_types):
+    """
+    行 × カラム（テーブルのカラム順）の2次元配列を COPY バイナリ形式のバイト列（ヘッダー・トレーラー付き、
+    1回の COPY でそのまま送れる）にする。sql_types はそれぞれのカラムの DDL の型名
+    列ごとにエンコードすると行数の少ないチャンクでは呼び出し回数が多くなるため、同じ型の列をまとめて1本の配列にしてから行う
+    """
+    rows = np.asarray(rows, dtype=object).reshape(len(rows), len(sql_types))
+    row_count = len(rows)
+    type_names = [base_type_name(sql_type) for sql_type in sql_types]
+    encoded_columns = [None] * len(type_names)
+    for type_name in set(type_names):
+        indexes = [index for index, name in enumerate(type_names) if name == type_name]
+        codes, fields = encode_values(rows[:, indexes].T.ravel(), type_name)
+        for position, index in enumerate(indexes):
+            # 型ごとのコードを列ごとのコードに振り直す（列の値の種類が少ないほど merge_segments() でまとめやすい）
+            column_values, column_codes = np.unique(codes[position * row_count:(position + 1) * row_count], return_inverse=True)
+            encoded_columns[index] = (column_codes.ravel(), [fields[value] for value in column_values.tolist()])
+
+    # 各行の先頭のフィールド数も1つの列として扱う
+    tuple_header = (np.zeros(row_count, dtype=np.int64), [struct.pack('!h', len(type_names))])
+    segments = merge_segments([tuple_header] + encoded_columns)
+    segment_values = [np.array(fields, dtype=object)[codes].tolist() for codes, fields in segments]
+    return b''.join(itertools.chain((COPY_HEADER,), itertools.chain.from_iterable(zip(*segment_values)), (COPY_TRAILER,)))
+
+
+def encode_frame(df, columns, sql_types):
+    """DataFrame の columns（テーブルのカラム順）を COPY バイナリ形式のバイト列にする"""
+    return encode_rows(df[columns].to_numpy(dtype=object), sql_types)
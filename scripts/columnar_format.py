@@ -0,0 +1,174 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import notes_schema
+
+# processed_output / merged_output の列指向（Parquet）形式での読み書き
+# 数値カラムは数値型のまま保存するため、読み込み時に文字列として解釈し直す・数値チェックをやり直す必要がない
+# pyarrow がインストールされている場合のみ使える（無い場合は呼び出し側で CSV 形式に切り替える）
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# 設定項目
+CSV_FORMAT = 'csv'
+PARQUET_FORMAT = 'parquet'
+FILE_EXTENSIONS = {CSV_FORMAT: '.csv', PARQUET_FORMAT: '.parquet'}
+# Parquet の書き込みオプション（zstd は pyarrow に同梱されている）
+# 列の統計情報・Arrow のスキーマは読み込み時に使わないため保存しない（1ページ分の小さなファイルではフッターの方が大きくなる）
+PARQUET_WRITE_OPTIONS = {'compression': 'zstd', 'write_statistics': False, 'store_schema': False}
+# 1回に読み込む行数（Parquet の読み込み・COPY 用テキストへの変換はこの行数ずつ行う）
+PARQUET_BATCH_ROWS = 50000
+
+# DB側の型（notes_schema.py の型名） → Arrow の型
+# INTEGER / SMALLINT は整数型、NUMERIC は float64、それ以外は文字列
+ARROW_TYPE_NAMES = {'SMALLINT': 'int16', 'INTEGER': 'int32', 'BIGINT': 'int64', 'NUMERIC': 'float64'}
+
+
+def is_available():
+    """pyarrow が使えるか"""
+    return pa is not None
+
+
+def resolve_format(file_format):
+    """
+    設定された形式を返す。pyarrow が無い環境で Parquet が指定されている場合は警告を出して CSV にする
+    """
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"形式は {list(FILE_EXTENSIONS)} のいずれかを指定してください: {file_format}")
+    if file_format == PARQUET_FORMAT and not is_available():
+        print("⚠️ 警告: pyarrow がインストールされていないため、Parquet ではなく CSV で保存します。")
+        return CSV_FORMAT
+    return file_format
+
+
+def require_pyarrow():
+    if not is_available():
+        raise RuntimeError("Parquet 形式のファイルを読み込むには pyarrow が必要です（pip install pyarrow）")
+
+
+def is_parquet_file(file_path):
+    return file_path.lower().endswith(FILE_EXTENSIONS[PARQUET_FORMAT])
+
+
+def column_type(col):
+    """カラム名から Arrow の型を返す（notes_schema.py の DB側の型に合わせる）"""
+    return pa.type_for_alias(ARROW_TYPE_NAMES.get(notes_schema.COLUMN_BASE_TYPES[col], 'string'))
+
+
+def arrow_schema(columns):
+    return pa.schema([(col, column_type(col)) for col in columns])
+
+
+def to_arrow_table(df, columns):
+    """
+    DataFrame（数値チェック済み）を型付きの Arrow テーブルにする
+    文字列（category を含む）の列は空文字を NULL にしてから変換し、整数型（Int32 など）の列は NA を NULL にする
+    （CSV を COPY した場合と同じく、DB には NULL として入る）
+    列ごとに変換すると小さなファイルでは呼び出し回数が多くなるため、同じ型の列をまとめて1本の配列にしてから変換する
+    """
+    schema = arrow_schema(columns)
+    row_count = len(df)
+    arrays = {}
+    for arrow_type in set(schema.types):
+        type_cols = [field.name for field in schema if field.type == arrow_type]
+        typed_cols = [col for col in type_cols if pd.api.types.is_numeric_dtype(df[col])]
+        text_cols = [col for col in type_cols if col not in typed_cols]
+        for cols, is_typed in ((typed_cols, True), (text_cols, False)):
+            if not cols:
+                continue
+            if is_typed:
+                values = pa.array(df[cols].to_numpy(dtype='float64', na_value=np.nan).T.ravel(), from_pandas=True)
+            else:
+                values = pa.array(df[cols].to_numpy(dtype=object).T.ravel(), type=pa.string(), from_pandas=True)
+                values = pc.if_else(pc.equal(values, ''), pa.scalar(None, pa.string()), values)
+            if values.type != arrow_type:
+                values = pc.cast(values, arrow_type)
+            for index, col in enumerate(cols):
+                arrays[col] = values.slice(index * row_count, row_count)
+    return pa.Table.from_arrays([arrays[col] for col in columns], schema=schema)
+
+
+def write_table(table, file_path):
+    pq.write_table(table, file_path, **PARQUET_WRITE_OPTIONS)
+
+
+def write_parquet(df, file_path, columns):
+    """DataFrame を型付きの Parquet ファイルとして保存する"""
+    write_table(to_arrow_table(df, columns), file_path)
+
+
+def open_parquet_writer(file_path, columns):
+    """
+    テーブルを順に追記していく Parquet ファイルを開く（with 文で使う）
+    write_table() 1回ごとに行グループが1つできるため、小さなテーブルはまとめてから書き込む
+    """
+    return pq.ParquetWriter(file_path, arrow_schema(columns), **PARQUET_WRITE_OPTIONS)
+
+
+def read_table(file_path, columns):
+    """Parquet ファイル全体を columns の順・型に揃えたテーブルとして読み込む"""
+    require_pyarrow()
+    return pq.read_table(file_path, columns=columns).cast(arrow_schema(columns))
+
+
+def concat_tables(tables):
+    return pa.concat_tables(tables)
+
+
+def read_column_names(file_path):
+    """Parquet ファイルのカラム名を（データを読まずに）返す"""
+    require_pyarrow()
+    return pq.read_schema(file_path).names
+
+
+def count_rows(file_path):
+    """Parquet ファイルの行数を（データを読まずに）返す"""
+    require_pyarrow()
+    return pq.ParquetFile(file_path).metadata.num_rows
+
+
+def iter_parquet_tables(file_path, columns, batch_rows=PARQUET_BATCH_ROWS):
+    """Parquet ファイルを batch_rows 行ずつ、columns の順・型に揃えたテーブルとして返す"""
+    require_pyarrow()
+    schema = arrow_schema(columns)
+    parquet_file = pq.ParquetFile(file_path)
+    for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+        yield pa.Table.from_batches([batch]).select(columns).cast(schema)
+
+
+def table_to_copy_text(table):
+    """
+    Arrow テーブルを COPY ... WITH CSV 用のヘッダーなしCSVテキストにする
+    NULL は引用符なしの空欄、文字列は引用符で囲む（COPY では pandas の to_csv で書き出した CSV と同じ値になる）
+    NUMERIC（float64）の列は、値が全て整数なら整数として書き出す（5e+11 ではなく 500000000000 にする）
+    """
+    for index, field in enumerate(table.schema):
+        column = table.column(index)
+        if pa.types.is_floating(field.type) and pc.all(pc.equal(pc.floor(column), column)).as_py() is not False:
+            table = table.set_column(index, field.name, pc.cast(column, pa.int64()))
+    buffer = pa.BufferOutputStream()
+    pa_csv.write_csv(table, buffer, pa_csv.WriteOptions(include_header=False, quoting_style='needed'))
+    return buffer.getvalue().to_pybytes().decode('utf-8')
+
+
+def remove_other_format_files(dir_path, suffix, file_format):
+    """
+    dir_path 内の「*{suffix}.<file_format 以外の拡張子>」のファイルを削除して件数を返す
+    保存形式を切り替えたときに古い形式のファイルが残り、同じデータが二重に読み込まれるのを防ぐ
+    """
+    removed_count = 0
+    for other_format, extension in FILE_EXTENSIONS.items():
+        if other_format == file_format:
+            continue
+        for filename in os.listdir(dir_path):
+            if filename.endswith(suffix + extension):
+                os.remove(os.path.join(dir_path, filename))
+                removed_count += 1
+    return removed_count
@@ -0,0 +1,218 @@
+import io
+import os
+import gzip
+
+import numpy as np
+import pandas as pd
+
+import app_config
+import columnar_format
+
+# COPY ... FROM STDIN WITH CSV 用のヘッダーなしCSVへのエンコード（DataFrame.to_csv の代わり）
+# to_csv は値を1つずつ文字列にして csv.writer に渡すため、80 カラムの DataFrame では結合の中で最も遅い処理の1つで、
+# 出力全体を StringIO に溜めてから取り出すとメモリ使用量も倍になる。ここでは
+# - カラムごとに値の重複を除き（pd.factorize）、ユニーク値だけを文字列にして引用符で囲む（同じ値が並ぶカラムが大半のため）
+#   行数の少ない DataFrame（1ページ分など）ではカラムごとの呼び出しの回数が多くなるため、文字列のカラムをまとめて1本の配列にしてから行う
+# - BLOCK_ROWS 行ずつ行の文字列を組み立てて UTF-8 のバイト列にする（BOM は付けない）
+# 出力は to_csv（index=False, header=False）と同じ（引用符は csv.QUOTE_MINIMAL の規則、NaN・NA は空欄）
+# COPY では引用符の無い空欄は NULL になる（空文字も to_csv と同じく空欄になり、NULL として入る）
+#
+# 結合済みファイルは gzip（標準ライブラリ）・zstd（pyarrow に同梱）で圧縮して保存・読み込みできる（open_output() / open_input()）
+
+# 設定項目
+BLOCK_ROWS = 10000  # 1回に組み立てる行数（組み立て中の文字列のメモリ使用量は、この行数分で頭打ちになる）
+COLUMNWISE_MIN_ROWS = 1000  # これより行数の少ない DataFrame は、文字列のカラムをまとめて変換する（format_frame()）
+
+app_config.apply(globals())
+
+CSV_EXTENSION = '.csv'
+# 圧縮形式 → .csv の後に付ける拡張子
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+CSV_EXTENSIONS = [CSV_EXTENSION] + [CSV_EXTENSION + extension for extension in COMPRESSION_EXTENSIONS.values()]
+# 値に含まれていたら引用符で囲む文字（区切り・引用符・改行）
+QUOTE_CHARS = (',', '"', '\r', '\n')
+# 圧縮したファイルを読み飛ばすときに一度に展開するバイト数
+SKIP_READ_SIZE = 1024 * 1024
+
+
+def escape_value(text):
+    """文字列を CSV の値にする（区切り・引用符・改行を含む場合だけ引用符で囲み、中の引用符は2つ重ねる）"""
+    if any(char in text for char in QUOTE_CHARS):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def format_values(values):
+    """
+    値の配列（Series / ndarray）を CSV の値の配列（object）にする。NaN・NA は空欄
+    文字列にするのはユニーク値ごとに1回だけで、各値はユニーク値の番号から引く（category のカラムは番号をそのまま使う）
+    """
+    codes, uniques = pd.factorize(values)
+    texts = [escape_value(value if isinstance(value, str) else str(value)) for value in uniques]
+    # 番号 -1（NaN・NA）は末尾の空欄を指す
+    return np.array(texts + [''], dtype=object)[codes]
+
+
+def is_text_dtype(dtype):
+    return dtype == object or isinstance(dtype, (pd.StringDtype, pd.CategoricalDtype))
+
+
+def format_frame(df):
+    """
+    DataFrame を CSV の値の2次元配列（object、行 × カラム）にする（行数の少ない DataFrame 用）
+    文字列（category を含む）のカラムはまとめて1本の配列にして format_values() する。整数などのカラムは、
+    型の違う等しい値（1 と 1.0）が1つのユニーク値にまとめられないよう、カラムごとに行う
+    """
+    text_positions = [position for position, dtype in enumerate(df.dtypes) if is_text_dtype(dtype)]
+    if len(text_positions) == df.shape[1]:
+        values = df.to_numpy(dtype=object)
+        return format_values(values.ravel()).reshape(values.shape)
+    cells = np.empty(df.shape, dtype=object)
+    if text_positions:
+        values = df.iloc[:, text_positions].to_numpy(dtype=object)
+        cells[:, text_positions] = format_values(values.ravel()).reshape(values.shape)
+    for position in sorted(set(range(df.shape[1])) - set(text_positions)):
+        cells[:, position] = format_values(df.iloc[:, position])
+    return cells
+
+
+def iter_frame_blocks(df, columns=None, line_terminator='\n', block_rows=None):
+    """
+    DataFrame の columns（省略時は全カラム）をヘッダーなしCSVにし、block_rows 行（省略時は BLOCK_ROWS）ずつ UTF-8 のバイト列で返す
+    line_terminator は COPY では '\\n'、ファイルに保存する場合は to_csv と同じ os.linesep にする
+    """
+    if columns is not None:
+        df = df[columns]
+    block_rows = block_rows or BLOCK_ROWS
+    starts = range(0, len(df), block_rows)
+    if len(df) < COLUMNWISE_MIN_ROWS:
+        cells = format_frame(df)
+        row_blocks = (cells[start:start + block_rows].tolist() for start in starts)
+    else:
+        formatted = [format_values(df[col]) for col in df.columns]
+        row_blocks = (zip(*(column[start:start + block_rows].tolist() for column in formatted)) for start in starts)
+    for rows in row_blocks:
+        yield (line_terminator.join(map(','.join, rows)) + line_terminator).encode('utf-8')
+
+
+def encode_frame(df, columns=None, line_terminator='\n'):
+    """
+    iter_frame_blocks() のブロックのリストを返す（COPY 用のチャンク）
+    1つのバイト列には連結せず、CopyStream で順に送る（連結するとその間はメモリ使用量が倍になる）
+    """
+    return list(iter_frame_blocks(df, columns, line_terminator))
+
+
+class CopyStream(io.RawIOBase):
+    """
+    バイト列のブロックのイテラブル（encode_frame() のリスト・iter_frame_blocks() のジェネレータなど）を読み込み用のファイルとして扱う
+    cursor.copy_expert() に渡すと、ブロックを連結せずに（ジェネレータなら作りながら）COPY に送る
+    """
+
+    def __init__(self, blocks):
+        self._blocks = iter(blocks)
+        self._block = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._block = memoryview(block)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+
+def require_zstd():
+    if not columnar_format.is_available():
+        raise RuntimeError("zstd で圧縮したファイルを読み書きするには pyarrow が必要です（pip install pyarrow）")
+
+
+def resolve_compression(compression):
+    """
+    設定された圧縮形式を返す（None・空: 圧縮しない）
+    pyarrow が無い環境で zstd が指定されている場合は警告を出して gzip にする
+    """
+    if not compression:
+        return None
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(f"圧縮形式は None か {list(COMPRESSION_EXTENSIONS)} のいずれかを指定してください: {compression}")
+    if compression == 'zstd' and not columnar_format.is_available():
+        print("⚠️ 警告: pyarrow がインストールされていないため、zstd ではなく gzip で圧縮します。")
+        return 'gzip'
+    return compression
+
+
+def csv_extension(compression=None):
+    """圧縮形式に応じた CSV の拡張子（'.csv' / '.csv.gz' / '.csv.zst'）"""
+    return CSV_EXTENSION + COMPRESSION_EXTENSIONS[compression] if compression else CSV_EXTENSION
+
+
+def file_compression(file_path):
+    """ファイル名の拡張子から圧縮形式を返す（圧縮していなければ None）"""
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if file_path.lower().endswith(CSV_EXTENSION + extension):
+            return compression
+    return None
+
+
+def open_output(file_path, compression=None):
+    """書き込み用のバイナリファイルを開く（compression を指定した場合はその形式で圧縮する）"""
+    if compression == 'gzip':
+        return gzip.open(file_path, 'wb')
+    if compression == 'zstd':
+        require_zstd()
+        return columnar_format.pa.output_stream(file_path, compression='zstd')
+    return open(file_path, 'wb')
+
+
+def open_input(file_path, start_offset=0):
+    """
+    読み込み用のバイナリファイルを開き、start_offset（展開後のバイト位置）まで進める。圧縮形式は拡張子から判定する
+    圧縮したファイルは途中から展開できないため、先頭から展開して読み飛ばす
+    """
+    compression = file_compression(file_path)
+    if compression == 'zstd':
+        require_zstd()
+        f = io.BufferedReader(columnar_format.pa.input_stream(file_path, compression='zstd'))
+        remaining = start_offset
+        while remaining > 0:
+            skipped = len(f.read(min(remaining, SKIP_READ_SIZE)))
+            if not skipped:
+                break
+            remaining -= skipped
+        return f
+    f = gzip.open(file_path, 'rb') if compression == 'gzip' else open(file_path, 'rb')
+    f.seek(start_offset)
+    return f
+
+
+def open_text_output(file_path, compression=None, bom=False):
+    """書き込み用のテキストファイル（UTF-8、改行は変換しない）を開く。bom=True なら先頭に BOM を付ける"""
+    return io.TextIOWrapper(open_output(file_path, compression), encoding='utf-8-sig' if bom else 'utf-8', newline='')
+
+
+def open_text_input(file_path):
+    """読み込み用のテキストファイル（UTF-8。先頭に BOM があれば除く。改行は変換しない）を開く"""
+    return io.TextIOWrapper(open_input(file_path), encoding='utf-8-sig', newline='')
+
+
+def remove_other_csv_files(dir_path, suffix, keep_extension=None):
+    """
+    dir_path 内の「*{suffix}.csv」「*{suffix}.csv.gz」「*{suffix}.csv.zst」のうち、拡張子が keep_extension 以外のファイルを削除して件数を返す
+    圧縮形式を切り替えたときに古いファイルが残り、同じデータが二重に読み込まれるのを防ぐ
+    """
+    removed_count = 0
+    for extension in CSV_EXTENSIONS:
+        if extension == keep_extension:
+            continue
+        for filename in os.listdir(dir_path):
+            if filename.endswith(suffix + extension):
+                os.remove(os.path.join(dir_path, filename))
+                removed_count += 1
+    return removed_count
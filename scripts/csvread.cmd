@@ -0,0 +1,3 @@
+@echo off
+rem usage: csvread {filter,process,merge,load,run,watch,bench,status} ...  (see csvread.py)
+python "%~dp0csvread.py" %*
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import argparse
+import importlib
+
+import app_config
+
+# 検索 → 加工 → 結合 → DB登録 の各スクリプトを1つのコマンドから呼び出す（スケジューラからの定期実行用）
+# 設定は設定ファイル（csvread.ini）・環境変数・--set で上書きする（優先順位は app_config.py を参照）
+#
+# 使い方:
+#   python csvread.py filter                 # 検索＆コピー（filter_and_copy_csv.py）
+#   python csvread.py process                # 加工（process_data.py）
+#   python csvread.py merge                  # 結合（merge_processed_csv.py）
+#   python csvread.py load --mode full       # DB登録（insert_to_postgres.py）
+#   python csvread.py run                    # 検索〜DB登録の一括実行（run_pipeline.py）
+#   python csvread.py watch                  # 検索元フォルダの監視（watch_pipeline.py）
+#   python csvread.py bench --rows 100000    # ベンチマーク（benchmark.py。以降の引数はそのまま渡す）
+#   python csvread.py status                 # 設定ファイル・上書き中の設定・各スクリプトの前回の実行結果
+#   python csvread.py -c D:\csvRead\csvread.ini --set DB_HOST=dbserver --set process_data.PROCESS_WORKERS=2 load
+#
+# 各スクリプトはサブコマンドを実行するときに初めて import する（pandas・psycopg2 の読み込みだけで 0.5 秒ほどかかるため）
+# status・filter はどちらも読み込まないので、Python 本体の起動とほぼ同じ時間で始まる
+
+# 設定項目
+# サブコマンド → (スクリプトのモジュール名, 説明)
+COMMANDS = {
+    'filter': ('filter_and_copy_csv', '検索元フォルダから B*020.csv を絞り込んでコピーする'),
+    'process': ('process_data', '絞り込んだファイルを加工する'),
+    'merge': ('merge_processed_csv', '加工済みファイルをファイルグループごとに結合する'),
+    'load': ('insert_to_postgres', '結合済みファイルを notes_receivable に登録する'),
+    'run': ('run_pipeline', '検索〜DB登録を中間ファイルを作らずに一括実行する'),
+    'watch': ('watch_pipeline', '検索元フォルダを監視し、追加・変更されたファイルを随時登録する（Ctrl+C で終了）'),
+    'bench': ('benchmark', '各段階の処理時間を計測する（以降の引数は benchmark.py に渡す）'),
+}
+# status で前回の実行結果を表示するカウンター
+STATUS_COUNTERS = ['scanned_files', 'source_files', 'source_rows', 'merge_chunk_rows', 'copy_rows', 'rejected_rows', 'resumed_chunks']
+
+
+def set_override(name, value):
+    """
+    設定を上書きする（環境変数に入れるため、プロセスプールのワーカーなど子プロセスにも引き継がれる）
+    name は 設定名（同じ名前の設定を持つ全スクリプト）か モジュール名.設定名（そのスクリプトだけ）
+    """
+    module, _, setting = name.rpartition('.')
+    setting = setting.strip().upper()
+    if not setting:
+        raise ValueError(f"設定名が空です: {name}")
+    env_name = f'{app_config.ENV_PREFIX}{module.strip().upper()}__{setting}' if module else app_config.ENV_PREFIX + setting
+    os.environ[env_name] = value
+
+
+def latest_reports(report_dir):
+    """レポートフォルダから、スクリプトごとに最新の実行レポートのパスを返す（ファイル名は 日時_スクリプト名.json）"""
+    latest = {}
+    if not os.path.isdir(report_dir):
+        return latest
+    for file_name in sorted(os.listdir(report_dir)):
+        if file_name.endswith('.json') and file_name.count('_') >= 2:
+            latest[file_name[:-len('.json')].split('_', 2)[2]] = os.path.join(report_dir, file_name)
+    return latest
+
+
+def show_status():
+    """設定ファイル・上書き中の設定名・各スクリプトの前回の実行結果を表示する（pandas・psycopg2 は読み込まない）"""
+    import run_metrics
+
+    config_path = app_config.config_file_path()
+    print(f"設定ファイル: {config_path}{'' if os.path.exists(config_path) else '（なし）'}")
+    # 値にはパスワードが含まれることがあるため、設定名と出どころだけを表示する
+    for source, name in app_config.overrides():
+        print(f"  上書き: {name} ← {source}")
+    print(f"APP_ROOT_DIR: {run_metrics.APP_ROOT_DIR}")
+    print(f"レポート: {run_metrics.REPORT_DIR}")
+
+    reports = latest_reports(run_metrics.REPORT_DIR)
+    for command, (module_name, _) in COMMANDS.items():
+        if command == 'bench':
+            continue  # ベンチマークの結果は benchmark\results に保存される
+        if module_name not in reports:
+            print(f"  {command:<8} 実行レポートなし")
+            continue
+        try:
+            with open(reports[module_name], 'r', encoding='utf-8') as f:
+                report = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  {command:<8} ⚠️ 実行レポートを読み込めません: {reports[module_name]} ({e})")
+            continue
+        counters = ' '.join(f"{name}={report['counters'][name]}" for name in STATUS_COUNTERS if name in report.get('counters', {}))
+        print(f"  {command:<8} {report.get('finished_at', report.get('started_at'))}  {report.get('seconds')} 秒  {counters}")
+    return 0
+
+
+def run_command(command, extra_args):
+    """サブコマンドのスクリプトを import して実行し、終了コードを返す"""
+    module = importlib.import_module(COMMANDS[command][0])
+    if command == 'bench':
+        return module.main(extra_args, prog='csvread bench')
+    module.main()
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='csvread', description='AIRead の CSV を加工して notes_receivable に登録する')
+    parser.add_argument('-c', '--config', help=f'設定ファイル（省略時は環境変数 {app_config.CONFIG_FILE_ENV}、無ければ {app_config.DEFAULT_CONFIG_FILE}）')
+    parser.add_argument('--set', action='append', default=[], metavar='[モジュール名.]設定名=値',
+                        help='設定を上書きする（複数指定可）。例: --set DB_HOST=dbserver --set process_data.PROCESS_WORKERS=2')
+    parser.add_argument('-q', '--quiet', action='store_true', help='ファイルごとのメッセージを表示しない（件数は実行レポートに残す）')
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='{' + ','.join([*COMMANDS, 'status']) + '}')
+    for command, (_, description) in COMMANDS.items():
+        subparser = subparsers.add_parser(command, help=description, description=description, add_help=command != 'bench')
+        if command == 'load':
+            subparser.add_argument('--mode', choices=['incremental', 'full'], help='ロード方式（省略時は LOAD_MODE）')
+            subparser.add_argument('--format', choices=['binary', 'csv'], help='COPY の形式（省略時は COPY_FORMAT）')
+    subparsers.add_parser('status', help='設定と各スクリプトの前回の実行結果を表示する')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra_args = parser.parse_known_args(argv)
+    if extra_args and args.command != 'bench':
+        parser.error(f"認識できない引数です: {' '.join(extra_args)}")
+
+    # 各スクリプトは import 時に設定を読み込むため、import より前に環境変数へ入れておく
+    if args.config:
+        os.environ[app_config.CONFIG_FILE_ENV] = os.path.abspath(args.config)
+    for item in args.set:
+        name, separator, value = item.partition('=')
+        if not separator:
+            parser.error(f"--set は 設定名=値 の形式で指定してください: {item}")
+        set_override(name, value)
+    if args.quiet:
+        set_override('run_metrics.QUIET', 'true')
+    if getattr(args, 'mode', None):
+        set_override('insert_to_postgres.LOAD_MODE', args.mode)
+    if getattr(args, 'format', None):
+        set_override('insert_to_postgres.COPY_FORMAT', args.format)
+
+    if args.command == 'status':
+        return show_status()
+    return run_command(args.command, extra_args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
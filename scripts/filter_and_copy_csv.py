@@ -1,9 +1,20 @@
 import os
 import shutil
 import re
+import hashlib
 import datetime
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import app_config
+import source_cache
+import source_index
+import run_metrics
 
 # 設定項目
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
 # 検索元フォルダ
 INPUT_BASE_DIR = r'G:\共有ドライブ\VLM-OCR\20_教師データ\30_output_csv'
 # コピー先フォルダ
@@ -15,6 +26,87 @@ SEARCH_RESULT_OUTPUT_BASE_DIR = r'G:\共有ドライブ\商工中金\202412_勘
 # \.: ドット(.)をリテラルとして扱う
 SEARCH_PATTERN = r'^B.*020\.csv$'
 
+# 前回コピーしたファイルのキャッシュ（変更のないファイルはコピーをスキップする）
+CACHE_FILE = os.path.join(APP_ROOT_DIR, 'cache', 'filter_cache.json')
+# コピーしたファイルの ファイル名 → (元ファイル, 内容ハッシュ) の索引（ファイル名の衝突・重複の判定に使う。source_index.py）
+INDEX_FILE = os.path.join(APP_ROOT_DIR, 'cache', 'filter_index.json')
+
+# 別のフォルダに同じ名前で内容の異なるファイルがある場合（コピー先では同じファイルになる）
+# 'skip': 先にコピーしたファイルを残し、後から見つかったファイルはコピーしない（警告を出す）
+# 'overwrite': 後から見つかったファイルで上書きする（以前の動作）
+FILENAME_COLLISION_POLICY = 'skip'
+# 既にコピーしたファイルと内容が同じファイル（別のフォルダ・別のファイル名）はコピーしない
+SKIP_DUPLICATE_FILES = True
+# 既にコピーしたファイルと同じ内容の行を除いてコピーする（行の値は全角半角・前後の空白を揃えて比べる）
+# 別の手形がたまたま全ての項目で同じ値になる場合も除かれるため、ページの一部が重複して出力される場合だけ有効にする
+DEDUP_ROWS = False
+
+# 並列数の設定
+# 共有ドライブ上ではフォルダの一覧取得・コピーともにネットワーク待ちが大半のため、スレッドで待ち時間を重ねる
+SCAN_WORKERS = 8        # フォルダ探索のスレッド数
+COPY_WORKERS = 4        # コピーのスレッド数
+COPY_QUEUE_SIZE = 200   # 探索済みでコピー待ちのファイルを溜めておく上限（これを超えると探索側が待つ）
+
+app_config.apply(globals())
+
+def scan_directory(dir_path, regex, with_stat=False):
+    """
+    1つのフォルダを os.scandir で読み、(サブフォルダ一覧, 合致したファイル一覧, ファイル数) を返す
+    with_stat=True の場合、合致したファイルは (パス, (サイズ, 更新日時)) として返す
+    （Windows では一覧の取得時にサイズ・更新日時も返るため、ファイルごとの os.stat は不要）
+    読めないフォルダは警告を出して空の結果を返す
+    """
+    start = time.perf_counter()
+    subdirs = []
+    matched_files = []
+    file_count = 0
+    try:
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    file_count += 1
+                    # ファイル名が検索パターンに合致するかチェック
+                    if regex.match(entry.name):
+                        if not with_stat:
+                            matched_files.append(entry.path)
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue  # 一覧の取得後に削除された
+                        matched_files.append((entry.path, (stat.st_size, stat.st_mtime_ns)))
+    except OSError as e:
+        print(f"⚠️ 警告: フォルダ {dir_path} を読み込めませんでした。エラー: {e}")
+    run_metrics.record_file('scan', dir_path, time.perf_counter() - start)
+    run_metrics.count('scanned_files', file_count)
+    return subdirs, matched_files, file_count
+
+def find_target_csv_files(input_base_dir=INPUT_BASE_DIR, counter=None, workers=SCAN_WORKERS, with_stat=False):
+    """
+    検索元フォルダ配下をスレッドプールで並列に探索し、検索パターンに合致するファイルのパスを見つかった順に返す
+    （順序はフォルダの読み込みが終わった順になるため、必要なら呼び出し側でソートする）
+    counter (dict) を渡した場合、探索したファイル総数を counter['checked'] に加算する
+    with_stat=True の場合は (パス, (サイズ, 更新日時)) を返す
+    """
+    # 検索パターンを正規表現オブジェクトとしてコンパイル
+    regex = re.compile(SEARCH_PATTERN, re.IGNORECASE)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(scan_directory, input_base_dir, regex, with_stat)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, matched_files, file_count = future.result()
+                # 見つかったサブフォルダはすぐに探索を投入し、一覧取得の待ち時間を重ねる
+                for subdir in subdirs:
+                    pending.add(executor.submit(scan_directory, subdir, regex, with_stat))
+                if counter is not None:
+                    counter['checked'] = counter.get('checked', 0) + file_count
+                yield from matched_files
+
+@run_metrics.stage('scan_copy')
 def copy_filtered_csv_files():
     """
     検索元フォルダから特定のパターンに合致するCSVファイルを検索し、出力フォルダにコピーする
@@ -28,43 +120,168 @@ def copy_filtered_csv_files():
     # コピー先フォルダが存在しない場合は作成
     os.makedirs(SEARCH_RESULT_OUTPUT_BASE_DIR, exist_ok=True)
 
-    copied_count = 0
-    skipped_count = 0
-    total_files_checked = 0
+    unchanged_count = 0
+    counter = {'checked': 0}
+    cache = source_cache.load_cache(CACHE_FILE)
+    index = source_index.load_index(INDEX_FILE)
+    found_files = []
+    # コピーのスレッドと共有する集計値・索引（lock で保護する）
+    stats = {'copied': 0, 'copied_bytes': 0, 'skipped': 0, 'collision': 0, 'duplicate': 0, 'dropped_rows': 0}
+    lock = threading.Lock()
+    copy_queue = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+    start_time = time.perf_counter()
 
-    # 検索パターンを正規表現オブジェクトとしてコンパイル
-    regex = re.compile(SEARCH_PATTERN, re.IGNORECASE)
+    def copy_worker():
+        """キューからファイルを取り出してコピーする（None を受け取ったら終了）"""
+        while True:
+            item = copy_queue.get()
+            if item is None:
+                break
+            src_filepath, dest_filepath = item
+            copy_start = time.perf_counter()
+            try:
+                # 元ファイルは1回だけ読み、内容ハッシュの計算とコピーに使う（共有ドライブからの読み込みを減らす）
+                with open(src_filepath, 'rb') as f:
+                    data = f.read()
+                sha256 = hashlib.sha256(data).hexdigest()
+                if not index_file(src_filepath, sha256):
+                    continue
+                rows = None
+                if DEDUP_ROWS:
+                    has_bom, header, rows = source_index.parse_rows(data)
+                    with lock:
+                        # 判定と記録を同じ lock の中で行い、同時にコピーしている2つのファイルが互いの行を残し合わないようにする
+                        kept_rows, row_digests = source_index.select_rows(index, src_filepath, rows)
+                        source_index.record_file(index, src_filepath, sha256, row_digests)
+                        stats['dropped_rows'] += len(rows) - len(kept_rows)
+                    rows = kept_rows if len(kept_rows) < len(rows) else None
+                if rows is None:
+                    with open(dest_filepath, 'wb') as f:
+                        f.write(data)
+                else:
+                    # 重複した行を除いた場合は、「〃」を埋め戻した値で書き出す
+                    source_index.write_rows(dest_filepath, has_bom, header, rows)
+                # shutil.copystat: 更新日時などのメタデータもコピー（shutil.copy2 と同じ）
+                shutil.copystat(src_filepath, dest_filepath)
+                copied_bytes = os.path.getsize(dest_filepath)
+                # キャッシュの更新はキーごとの代入なので、スレッド間で lock は不要
+                source_cache.record_file(cache, src_filepath, dest_filepath, sha256=sha256)
+                with lock:
+                    stats['copied'] += 1
+                    stats['copied_bytes'] += copied_bytes
+                run_metrics.record_file('copy_file', src_filepath, time.perf_counter() - copy_start)
+                run_metrics.count('copied_bytes', copied_bytes)
+                # print(f"  コピーしました: {filename}") # 大量に出力される場合はコメントアウト
+            except Exception as e:
+                print(f"❌ エラー: {os.path.basename(src_filepath)} のコピー中に問題が発生しました。エラー: {e}")
+                with lock:
+                    stats['skipped'] += 1
+
+    def index_file(src_filepath, sha256):
+        """
+        ファイル名の衝突・内容の重複を判定し、コピーする場合は索引に記録して True を返す
+        判定と記録は lock の中で行う（同じ名前のファイルを2つのスレッドが同時にコピーしないようにする）
+        """
+        with lock:
+            reason, owner = source_index.check_file(index, src_filepath, sha256)
+            if reason == 'collision' and FILENAME_COLLISION_POLICY == 'skip' or reason == 'duplicate' and SKIP_DUPLICATE_FILES:
+                source_index.record_skipped(index, src_filepath, sha256, reason, owner)
+                report_skipped(src_filepath, reason, owner)
+                return False
+            source_index.record_file(index, src_filepath, sha256)
+            return True
+
+    def report_skipped(src_filepath, reason, owner):
+        stats[reason] += 1
+        owner_source = index['files'][owner]['source']
+        if reason == 'collision':
+            run_metrics.file_message('filename_collision', f"⚠️ 警告: {src_filepath} は別のフォルダの同じ名前のファイル（{owner_source}）と内容が異なるため、コピーしません。")
+        else:
+            run_metrics.file_message('duplicate_file', f"ℹ️ {src_filepath} は {owner_source} と内容が同じため、コピーしません。")
+
+    copy_threads = [threading.Thread(target=copy_worker, daemon=True) for _ in range(COPY_WORKERS)]
+    for thread in copy_threads:
+        thread.start()
+
+    try:
+        # 探索しながら、見つかったファイルを順次コピーのスレッドに渡す
+        for src_filepath in find_target_csv_files(INPUT_BASE_DIR, counter):
+            found_files.append(src_filepath)
+            filename = os.path.basename(src_filepath)
+            dest_filepath = os.path.join(SEARCH_RESULT_OUTPUT_BASE_DIR, filename)
 
-    for root, dirs, files in os.walk(INPUT_BASE_DIR):
-        for filename in files:
-            total_files_checked += 1
-            # ファイル名が検索パターンに合致するかチェック
-            if regex.match(filename):
-                src_filepath = os.path.join(root, filename)
-                dest_filepath = os.path.join(SEARCH_RESULT_OUTPUT_BASE_DIR, filename)
-
-                try:
-                    # ファイルをコピー
-                    # shutil.copy2: メタデータもコピー
-                    shutil.copy2(src_filepath, dest_filepath)
-                    copied_count += 1
-                    # print(f"  コピーしました: {filename}") # 大量に出力される場合はコメントアウト
-                except Exception as e:
-                    print(f"❌ エラー: {filename} のコピー中に問題が発生しました。エラー: {e}")
-                    skipped_count += 1
-            # else:
-            # print(f"  スキップしました (パターン不一致): {filename}") # デバッグ用
+            try:
+                # 前回コピー時から変更がなければスキップ
+                unchanged = source_cache.is_unchanged(cache, src_filepath) and source_cache.cached_output(cache, src_filepath) == dest_filepath
+            except Exception as e:
+                print(f"❌ エラー: {filename} の確認中に問題が発生しました。エラー: {e}")
+                with lock:
+                    stats['skipped'] += 1
+                continue
+            if unchanged:
+                unchanged_count += 1
+                with lock:
+                    # 索引を作る前にコピーしたファイルは、キャッシュの内容ハッシュで索引に加える（ファイルは読まない）
+                    if source_index.name_key(src_filepath) not in index['files']:
+                        source_index.record_file(index, src_filepath, source_cache.cached_hash(cache, src_filepath))
+                continue
+            with lock:
+                # 前回、衝突・重複でコピーしなかったファイルは、変更が無ければ読み直さずにスキップする
+                reason, owner = source_index.skipped_reason(index, src_filepath)
+                if reason is not None:
+                    report_skipped(src_filepath, reason, owner)
+                    continue
+            copy_queue.put((src_filepath, dest_filepath))
+    finally:
+        for _ in copy_threads:
+            copy_queue.put(None)
+        for thread in copy_threads:
+            thread.join()
+
+    elapsed = time.perf_counter() - start_time
+
+    # 検索元から削除されたファイルは、キャッシュとコピー先のファイルからも削除する
+    evicted_count = source_cache.evict_missing(cache, found_files)
+    source_cache.save_cache(CACHE_FILE, cache)
+    source_index.evict_missing(index, found_files)
+    source_index.save_index(INDEX_FILE, index)
+
+    copied_count = stats['copied']
+    skipped_count = stats['skipped']
+    total_files_checked = counter['checked']
 
     print(f"\n--- ファイルコピー処理完了 ({datetime.datetime.now()}) ---")
     print(f"✅ 検索元フォルダ内の合計ファイル数: {total_files_checked}")
     print(f"✅ コピーされたファイル数: {copied_count}")
+    print(f"⏭️ 変更がないためスキップしたファイル数: {unchanged_count}")
+    print(f"🧹 検索元から削除されたため除去したファイル数: {evicted_count}")
     print(f"⚠️ コピーをスキップしたファイル数 (エラー): {skipped_count}")
+    if stats['collision']:
+        print(f"⚠️ 別のフォルダの同じ名前のファイルと内容が異なるためスキップしたファイル数: {stats['collision']}")
+    if stats['duplicate']:
+        print(f"⏭️ コピー済みのファイルと内容が同じためスキップしたファイル数: {stats['duplicate']}")
+    if stats['dropped_rows']:
+        print(f"⏭️ コピー済みのファイルと内容が同じため除いた行数: {stats['dropped_rows']}")
+    run_metrics.count('duplicate_files', stats['duplicate'])
+    run_metrics.count('collision_files', stats['collision'])
+    run_metrics.count('dropped_rows', stats['dropped_rows'])
+    if elapsed > 0:
+        print(f"⏱️ 処理時間: {elapsed:.2f} 秒 / 探索 {total_files_checked / elapsed:.1f} ファイル/秒"
+              f" / コピー {copied_count / elapsed:.1f} ファイル/秒, {stats['copied_bytes'] / elapsed / 1024 / 1024:.2f} MB/秒"
+              f" (合計 {stats['copied_bytes'] / 1024 / 1024:.2f} MB)")
 
     if copied_count > 0:
         print(f"🎉 {copied_count} 個のファイルが正常にコピーされました！🎉")
+    elif unchanged_count > 0:
+        print(f"✅ 新しく追加・変更されたファイルはありませんでした。")
     else:
         print(f"⚠️ 合致するファイルが見つからなかったか、コピーに失敗しました。")
 
-if __name__ == "__main__":
+def main():
+    run_metrics.start_run('filter_and_copy_csv')
     copy_filtered_csv_files()
+    run_metrics.finish_run()
+
+if __name__ == "__main__":
+    main()
     
\ No newline at end of file
@@ -0,0 +1,204 @@
+import os
+import csv
+import json
+import random
+import argparse
+from datetime import datetime
+
+import app_config
+
+# ベンチマーク用のダミー元データ（B*_020.csv）を生成するスクリプト
+# 実データ（filtered_originals）と同じ 8 カラムのヘッダー・和暦の日付・「〃」「同上」・小計/合計行を含むファイルを、
+# 共有ドライブと同じようにサブフォルダに分けて出力する
+
+# 設定項目
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
+# 生成先フォルダ
+SAMPLE_DATA_DIR = os.path.join(APP_ROOT_DIR, 'benchmark', 'source')
+# 生成した条件を記録するファイル（生成先フォルダに保存）
+SAMPLE_MANIFEST_FILE_NAME = 'sample_manifest.json'
+
+DEFAULT_TOTAL_ROWS = 10000       # 生成する明細行の合計（小計・合計行は含まない）
+DEFAULT_ROWS_PER_FILE = 20       # 1ファイル（1ページ）あたりの明細行数の目安
+GROUPS_PER_FOLDER = 100          # 1フォルダに入れるファイルグループ数
+NOISE_FILES_PER_FOLDER = 5       # 検索パターンに合致しないファイル（.jpg など）の数
+
+app_config.apply(globals())
+
+# 実データで使われているヘッダーの揺れ（銀行名・支店名が1カラムの形式を含む）
+SOURCE_HEADERS = [
+    ['振出人', '振出年月日', '支払期日', '支払銀行名称', '支払銀行支店名', '金額', '割引銀行名及び支店名等', '摘要'],
+    ['振出人', '振出年月日', '支払期日', '支払銀行名支店名', '金額', '割引銀行名及び支店名等', '摘要'],
+]
+SPLIT_BANK_HEADER_WEIGHT = 0.9   # 銀行名・支店名が別カラムのヘッダーを使う割合
+QUOTE_ALL_WEIGHT = 0.6           # 全項目を "" で囲んだファイルの割合
+
+MAKER_NAMES = [
+    '(株)双文社印刷', '(株)太平印刷社', '(株)リーブルテック', '日本ハイコム(株)', '(株)DNPテクノパーク',
+    '(株)アイスジャパン', '梅田(株)', '株式会社ハウジング高橋', '東洋計器(株)', '(有)山田商店',
+    '北海道物産(株)', '(株)ミナミ工業', '中央建設(株)', '(株)サンライズ', '株式会社丸井製作所',
+]
+BANK_BRANCHES = [
+    ('みずほ銀行', '市ヶ谷支店'), ('北洋銀行', '末広町支店'), ('北洋銀行', '豊平支店'), ('室蘭信用金庫', '東室蘭支店'),
+    ('千葉銀行', '初石支店'), ('中国銀行', '川之江支店'), ('山口銀行', '萩支店'), ('伊予銀行', '川之江支店'),
+    ('りそな銀行', '大阪営業部支店'), ('広島銀行', '音戸支店'), ('秋田銀行', '宮の沢支店'), ('電子手形', ''),
+]
+DISCOUNT_BANKS = ['', '', '', '北海道信用金庫発寒支店', '苫小牧信金札幌支店', '秋田銀行宮の沢支店']
+DESCRIPTIONS = ['', '', '', '', '売掛金回収', '工事代金', '電子記録債権']
+
+# 和暦の日付の書き方（実データに出てくる形式）
+DATE_FORMATS = [
+    '{era_num}.{month}.{day}',
+    'R{era_num}・{month}・{day}',
+    'R{era_num}.{month}.{day}',
+    'R {era_num}・{month:>2}・{day:>2}',
+    '令{era_num}.{month}.{day}',
+    '令{era_num}・{month}・{day}',
+    '令和{era_num}.{month}.{day}',
+    '{era_num}.{month:02d}.{day:02d}',
+]
+DITTO_RATE = 0.08        # 振出人・銀行名を「〃」「同上」にする割合
+BLANK_ISSUE_DATE_RATE = 0.5
+SUBTOTAL_RATE = 0.3      # ページ末尾に小計行を入れる割合（グループ最終ページには必ず合計行を入れる）
+
+
+def format_wareki_date(date, rng):
+    """日付を実データと同じような和暦（令和）の文字列にする"""
+    date_format = rng.choice(DATE_FORMATS)
+    return date_format.format(era_num=date.year - 2018, month=date.month, day=date.day)
+
+
+def random_date(rng, start_year=2021, end_year=2024):
+    """start_year〜end_year のランダムな日付を返す（日付の妥当性のため日は 28 日まで）"""
+    return datetime(rng.randint(start_year, end_year), rng.randint(1, 12), rng.randint(1, 28))
+
+
+def generate_rows(row_count, combined_bank, rng):
+    """1ページ分の明細行を生成する（集計行は含まない）"""
+    rows = []
+    for index in range(row_count):
+        issue_date = random_date(rng)
+        due_date = issue_date.replace(year=min(issue_date.year + rng.randint(0, 1), 2024), month=rng.randint(1, 12))
+        bank_name, branch_name = rng.choice(BANK_BRANCHES)
+        maker_name = rng.choice(MAKER_NAMES)
+        if index > 0 and rng.random() < DITTO_RATE:
+            maker_name = rng.choice(['〃', '同上'])
+        if index > 0 and rng.random() < DITTO_RATE:
+            bank_name, branch_name = '〃', ('〃' if branch_name else '')
+        row = [
+            maker_name,
+            '' if rng.random() < BLANK_ISSUE_DATE_RATE else format_wareki_date(issue_date, rng),
+            format_wareki_date(due_date, rng),
+        ]
+        if combined_bank:
+            row.append(f"{bank_name}{branch_name}" if bank_name != '〃' else '〃')
+        else:
+            row.extend([bank_name, branch_name])
+        row.extend([str(rng.randint(10000, 9999999)), rng.choice(DISCOUNT_BANKS), rng.choice(DESCRIPTIONS)])
+        rows.append(row)
+    return rows
+
+
+def total_row(label, amount, column_count):
+    """小計・合計行（金額以外は空欄）を作る"""
+    row = [''] * column_count
+    row[0] = label
+    row[column_count - 3] = str(amount)
+    return row
+
+
+def write_source_file(file_path, header, rows, quote_all):
+    """実データと同じく BOM 付き UTF-8 で書き出す"""
+    with open(file_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL if quote_all else csv.QUOTE_MINIMAL, lineterminator='\r\n')
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def page_counts_for_groups(file_count, rng):
+    """ファイル数をグループに振り分ける（実データと同じく 1 ページのグループが多く、まれに 10 ページ超）"""
+    page_counts = []
+    remaining = file_count
+    while remaining > 0:
+        pages = rng.choices([1, 2, 3, 4, 5, 7, 12], weights=[60, 18, 8, 5, 4, 3, 2])[0]
+        pages = min(pages, remaining)
+        page_counts.append(pages)
+        remaining -= pages
+    return page_counts
+
+
+def generate_sample_data(output_dir=SAMPLE_DATA_DIR, total_rows=DEFAULT_TOTAL_ROWS, rows_per_file=DEFAULT_ROWS_PER_FILE, seed=0):
+    """
+    ダミーの元データを output_dir 配下に生成し、生成条件と件数（dict）を返す
+    同じ引数で生成済みの場合は作り直さずに前回の結果を返す
+    """
+    manifest_path = os.path.join(output_dir, SAMPLE_MANIFEST_FILE_NAME)
+    params = {'total_rows': total_rows, 'rows_per_file': rows_per_file, 'seed': seed}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('params') == params:
+            return manifest
+
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    file_count = max(1, -(-total_rows // rows_per_file))
+    page_counts = page_counts_for_groups(file_count, rng)
+
+    stats = {'files': 0, 'rows': 0, 'total_rows': 0, 'bytes': 0}
+    remaining_rows = total_rows
+    for group_index, pages in enumerate(page_counts):
+        group_no = group_index + 1
+        folder = os.path.join(output_dir, f'{(group_index // GROUPS_PER_FOLDER) * GROUPS_PER_FOLDER + 1:06d}')
+        os.makedirs(folder, exist_ok=True)
+        combined_bank = rng.random() > SPLIT_BANK_HEADER_WEIGHT
+        header = SOURCE_HEADERS[1 if combined_bank else 0]
+        quote_all = rng.random() < QUOTE_ALL_WEIGHT
+        group_amount = 0
+
+        for page in range(1, pages + 1):
+            row_count = min(remaining_rows, max(1, rows_per_file + rng.randint(-rows_per_file // 4, rows_per_file // 4)))
+            if group_index == len(page_counts) - 1 and page == pages:
+                row_count = remaining_rows  # 最後のファイルで行数を合わせる
+            remaining_rows -= row_count
+            rows = generate_rows(row_count, combined_bank, rng)
+            page_amount = sum(int(row[len(header) - 3]) for row in rows)
+            group_amount += page_amount
+            if rng.random() < SUBTOTAL_RATE:
+                rows.append(total_row('小計(受取手形)', page_amount, len(header)))
+            if page == pages:
+                rows.append(total_row(rng.choice(['計', '合計']), group_amount, len(header)))
+            stats['total_rows'] += len(rows) - row_count
+            stats['rows'] += row_count
+
+            file_path = os.path.join(folder, f'B{group_no:06d}_{page}.jpg_020.csv')
+            write_source_file(file_path, header, rows, quote_all)
+            stats['files'] += 1
+            stats['bytes'] += os.path.getsize(file_path)
+
+        if group_index % GROUPS_PER_FOLDER == 0:
+            # 共有ドライブと同じく、対象外のファイルも混ぜておく
+            for noise_index in range(NOISE_FILES_PER_FOLDER):
+                with open(os.path.join(folder, f'B{group_no:06d}_{noise_index + 1}.jpg_010.csv'), 'w', encoding='utf-8') as f:
+                    f.write('dummy\n')
+
+    manifest = {'params': params, 'groups': len(page_counts), **stats, 'generated_at': datetime.now().isoformat()}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    return manifest
+
+
+# --- メイン処理 ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ベンチマーク用のダミー元データ（B*_020.csv）を生成する')
+    parser.add_argument('--output-dir', default=SAMPLE_DATA_DIR, help='生成先フォルダ')
+    parser.add_argument('--rows', type=int, default=DEFAULT_TOTAL_ROWS, help='明細行の合計')
+    parser.add_argument('--rows-per-file', type=int, default=DEFAULT_ROWS_PER_FILE, help='1ファイルあたりの明細行数の目安')
+    parser.add_argument('--seed', type=int, default=0, help='乱数のシード（同じ値なら同じデータになる）')
+    args = parser.parse_args()
+
+    print(f"--- ダミーデータ生成開始 ({datetime.now()}) ---")
+    result = generate_sample_data(args.output_dir, args.rows, args.rows_per_file, args.seed)
+    print(f"✅ 生成先: {args.output_dir}")
+    print(f"✅ ファイルグループ数: {result['groups']} / ファイル数: {result['files']} / 明細行数: {result['rows']} / 集計行数: {result['total_rows']}")
+    print(f"🎉 ダミーデータの生成が完了しました！ ({datetime.now()}) 🎉")
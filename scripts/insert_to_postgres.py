@@ -1,171 +1,876 @@
 import os
+import io
+import hashlib
+import itertools
+import threading
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import psycopg2
+import psycopg2.extras
 import glob
+import csv
 
-APP_ROOT_DIR = r'C:\Users\User26\yoko\dev\csvRead'
+import app_config
+import columnar_format
+import binary_copy
+import csv_copy
+import notes_schema
+import notes_partitions
+import master_lookup
+import run_metrics
+
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
 MERGED_OUTPUT_DIR = os.path.join(APP_ROOT_DIR, 'merged_output')
-LOG_FILE = os.path.join(APP_ROOT_DIR, 'scripts', 'imported_notes_files.log')
+# 結合済みファイルの拡張子（CSV は圧縮したもの（.csv.gz / .csv.zst）を含む）
+MERGED_FILE_EXTENSIONS = csv_copy.CSV_EXTENSIONS + [columnar_format.FILE_EXTENSIONS[columnar_format.PARQUET_FORMAT]]
+# 全グループをまとめたファイル（グループごとのファイルと同じ行を含む）
+ALL_MERGED_FILE_NAMES = [f'all_merged{extension}' for extension in MERGED_FILE_EXTENSIONS]
+# グループごとの結合済みファイル名の末尾（例: B000001_merged.csv.gz → ファイルグループ B000001）
+MERGED_FILE_SUFFIXES = [f'_merged{extension}' for extension in MERGED_FILE_EXTENSIONS]
 
 DB_HOST = "localhost"
 DB_NAME = "nagashin"
 DB_USER = "postgres"
-DB_PASSWORD = "x5WU7Xb3"  # ← 本番では .env に移してね🐻
+DB_PASSWORD = "x5WU7Xb3"  # ← 本番では環境変数 CSVREAD_DB_PASSWORD か設定ファイル（csvread.ini）で指定してね🐻
+
+# 一括ロードの設定
+LOAD_WORKERS = 4            # COPY に使う接続数（並列数）
+COPY_CHUNK_LINES = 50000    # 1回の COPY で送る行数
+# COPY の形式
+# 'binary': 数値・日時を型ごとのバイナリ表現で送る（DB 側で文字列から解釈し直さないため、DB サーバーの CPU 負荷が小さい）
+# 'csv': ヘッダーなしCSVのテキストをそのまま送る（従来の形式）
+COPY_FORMAT = 'binary'
+COPY_READ_SIZE = 1024 * 1024  # COPY 中にバッファから一度に送るバイト数
+STAGING_TABLE = 'notes_receivable_staging'
+
+# ロード方式
+# 'incremental': 新規・変更されたファイルのみステージング経由で UPSERT する（通常運用）
+# 'full': notes_receivable を作り直して全ファイルをロードする
+LOAD_MODE = 'incremental'
+
+# notes_receivable のパーティション分割（分割方法は notes_partitions.py を参照）
+# None: 分割しない（従来どおり1つのテーブル）
+# 'cif_hash': cif_number のハッシュで PARTITION_COUNT 個に分割する
+# 'cif_range' / 'settlement_at': cif_number / settlement_at（YYYYMM）の範囲で分割する（境界は PARTITION_BOUNDS。例: ["202401", "202501"]）
+# 分割する場合、full のロードはパーティションごとに別のテーブルへ LOAD_WORKERS 本の接続で並列に移して主キー・インデックスを作成し、
+# 最後に1トランザクションで古いパーティションを外して（DETACH）新しいテーブルを付け替える（ATTACH）。
+# 付け替えまでは古いデータを読めるため、読み出し側から空のテーブルや作りかけのテーブルが見えることは無い
+# 分割方法を変えた場合は、次回の full のロードでテーブルを作り直す（incremental のロードはエラーになる）
+PARTITION_BY = None
+PARTITION_COUNT = 8
+PARTITION_BOUNDS = []
+
+# 取り込み済みファイルの管理テーブル（ファイル名ごとの内容ハッシュを保持する）
+MANIFEST_TABLE = 'notes_import_manifest'
+
+# 途中で止まったロードの再開（save_csvs_to_postgres）
+# ステージングへ COPY したチャンクごとに、範囲（ファイル・位置・行）をチェックポイントとして同じトランザクションで記録する
+# 次回の実行で対象ファイルが同じなら、ステージングを残したままコミット済みのチャンクを読み飛ばして続きから再開する
+CHECKPOINT_TABLE = 'notes_load_checkpoint'
+# 値の問題で取り込めなかった行の記録先（ファイル全体は失敗させず、その行だけを除いて取り込む）
+REJECT_TABLE = 'notes_load_reject'
+REJECT_MAX_ROWS = 1000        # 1チャンクでこれを超える行を取り込めない場合は、ファイルの形式の問題としてロードを止める
+LOAD_RETRY_COUNT = 3          # 接続が切れた場合に接続し直してやり直す回数
+LOAD_RETRY_WAIT_SECONDS = 5   # 接続し直すまでの待ち時間（やり直すたびに2倍にする）
+
+app_config.apply(globals())
 
-def load_imported_files():
-    if not os.path.exists(LOG_FILE):
-        return set()
-    with open(LOG_FILE, 'r', encoding='utf-8') as f:
-        return set(line.strip() for line in f if line.strip())
+# 行の値の問題（エンコードできない値・型や長さが合わない値・NOT NULL 違反など）として、行単位で除外するエラー
+REJECTABLE_ERRORS = (ValueError, ArithmeticError, struct.error, psycopg2.DataError, psycopg2.IntegrityError)
+# 接続の問題として、接続し直してやり直すエラー
+RETRY_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
 
-def save_imported_file(filename):
-    with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write(f"{filename}\n")
+# カラム構成・型は notes_schema.py で定義する（加工・結合と共通）
+NOTES_COLUMNS_DDL = notes_schema.columns_ddl()
+NOTES_COLUMNS = notes_schema.COLUMN_NAMES
+NOTES_COLUMN_TYPES = notes_schema.COLUMN_SQL_TYPES
+NOTES_KEY_COLUMNS = ['ocr_result_id', 'page_no', 'id']
+
+MANIFEST_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+    file_name TEXT PRIMARY KEY,
+    content_hash CHAR(64) NOT NULL,
+    file_size BIGINT NOT NULL,
+    imported_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
+
+# 位置（*_offset）は CSV ではバイト、Parquet では行で数える。first_row はロード全体での行番号（0 始まり）
+CHECKPOINT_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+    load_key CHAR(64) NOT NULL,
+    chunk_no INTEGER NOT NULL,
+    start_file TEXT NOT NULL,
+    start_offset BIGINT NOT NULL,
+    end_file TEXT NOT NULL,
+    end_offset BIGINT NOT NULL,
+    first_row BIGINT NOT NULL,
+    row_count INTEGER NOT NULL,
+    loaded_rows INTEGER NOT NULL,
+    rejected_rows INTEGER NOT NULL,
+    committed_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (load_key, chunk_no)
+);
+"""
+
+REJECT_TABLE_DDL = f"""
+CREATE TABLE IF NOT EXISTS {REJECT_TABLE} (
+    load_key CHAR(64) NOT NULL,
+    chunk_no INTEGER NOT NULL,
+    row_no BIGINT NOT NULL,
+    file_name TEXT NOT NULL,
+    file_offset BIGINT NOT NULL,
+    raw_row TEXT NOT NULL,
+    error TEXT NOT NULL,
+    rejected_at TIMESTAMP NOT NULL DEFAULT now()
+);
+"""
 
-def clear_imported_files_log():
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, 'w', encoding='utf-8') as f:
-            f.write('')  # ファイル中身を空にする
+def notes_key_columns():
+    """notes_receivable の主キーのカラム（パーティション分割する場合は、パーティションのキーのカラムを含む）"""
+    return notes_partitions.key_columns(NOTES_KEY_COLUMNS, PARTITION_BY)
 
-def save_csvs_to_postgres():
-    conn = psycopg2.connect(
+def notes_primary_key():
+    return f"PRIMARY KEY ({', '.join(notes_key_columns())})"
+
+def notes_partition_specs():
+    """PARTITION_BY の設定によるパーティションの (接尾辞, FOR VALUES 句, CHECK 制約の条件) のリスト（分割しない場合は空）"""
+    if not PARTITION_BY:
+        return []
+    return notes_partitions.partition_specs(PARTITION_BY, PARTITION_COUNT, PARTITION_BOUNDS)
+
+def notes_table_ddl(table_name='notes_receivable', unlogged=False, with_primary_key=True, partitioned=False):
+    """
+    notes_receivable と同じカラム構成のテーブルを作成する CREATE TABLE 文を返す
+    partitioned=True の場合は PARTITION_BY で分割する親テーブル（パーティションは create_partitions() で作成する）
+    """
+    columns = NOTES_COLUMNS_DDL.strip('\n')
+    if with_primary_key:
+        columns += f",\n    {notes_primary_key()}"
+    partition_clause = f" PARTITION BY {notes_partitions.key_definition(PARTITION_BY)}" if partitioned else ''
+    return f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {table_name} (\n{columns}\n){partition_clause};"
+
+def create_partitions(cur, table_name, unlogged=False):
+    """PARTITION_BY で分割した親テーブル table_name に、全てのパーティション（table_name_p0 など）を作成する"""
+    for suffix, bound, _ in notes_partition_specs():
+        cur.execute(f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {table_name}_{suffix} PARTITION OF {table_name} {bound};")
+
+def get_connection():
+    return psycopg2.connect(
         host=DB_HOST,
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD
     )
-    cur = conn.cursor()
 
-    print("🧹 テーブルとインデックスを初期化中...")
+@run_metrics.stage('encode')
+def frame_to_binary_chunk(df):
+    """notes_receivable のカラム順の DataFrame を COPY バイナリ形式のバイト列にする（空文字・NaN は NULL）"""
+    return binary_copy.encode_frame(df, NOTES_COLUMNS, NOTES_COLUMN_TYPES)
+
+@run_metrics.stage('encode')
+def rows_to_binary_chunk(rows):
+    """行 × カラム（notes_receivable のカラム順）の値を COPY バイナリ形式のバイト列にする"""
+    return binary_copy.encode_rows(rows, NOTES_COLUMN_TYPES)
+
+def frame_to_copy_chunk(df, copy_format=None):
+    """
+    DataFrame を COPY_FORMAT（省略時）の形式のチャンクにする
+    binary: bytes / csv: csv_copy.encode_frame() のバイト列のブロックのリスト（UTF-8 のヘッダーなしCSV）
+    """
+    if (copy_format or COPY_FORMAT) == 'binary':
+        return frame_to_binary_chunk(df)
+    return csv_copy.encode_frame(df)
+
+def rows_to_copy_text(rows):
+    """行 × カラムの文字列をヘッダーなしCSVのテキストにする（空文字は引用符なしの空欄になり、COPY では NULL になる）"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue()
+
+def parquet_tables_to_chunk(tables, copy_format=None):
+    """Arrow テーブルのリストを1つの COPY 用のチャンク（binary: bytes / csv: str）にする"""
+    table = columnar_format.concat_tables(tables)
+    if (copy_format or COPY_FORMAT) == 'binary':
+        return frame_to_binary_chunk(table.to_pandas())
+    return columnar_format.table_to_copy_text(table)
+
+# チャンクの元データ（payload）は、CSV の場合は行（文字列のリスト）のリスト、Parquet の場合は Arrow テーブル
+def payload_to_chunk(payload, copy_format=None):
+    """チャンクの元データを COPY_FORMAT（省略時）の形式のチャンク（binary: bytes / csv: str）にする"""
+    if not isinstance(payload, list):
+        return parquet_tables_to_chunk([payload], copy_format)
+    if (copy_format or COPY_FORMAT) == 'binary':
+        return rows_to_binary_chunk(payload)
+    return rows_to_copy_text(payload)
+
+def payload_length(payload):
+    return len(payload) if isinstance(payload, list) else payload.num_rows
+
+def slice_payload(payload, start, stop):
+    return payload[start:stop] if isinstance(payload, list) else payload.slice(start, stop - start)
+
+def payload_row_text(payload, index):
+    """チャンクの元データの1行を、CSV の1行のテキストにする（取り込めなかった行の記録用）"""
+    if isinstance(payload, list):
+        return rows_to_copy_text(payload[index:index + 1]).rstrip('\n')
+    return columnar_format.table_to_copy_text(payload.slice(index, 1)).rstrip('\n')
+
+def iter_csv_records(csv_file, start_offset=0):
+    """
+    ヘッダーなしCSVファイルを start_offset（バイト）から1行ずつ読み、(値のリスト, 行の開始位置, 行の終了位置) を返す
+    引用符で囲まれた値の中の改行は1行として扱う。位置はバイト単位（圧縮したファイルは展開後のバイト）で、再開するときに使える
+    """
+    position = start_offset
+
+    def lines(f):
+        nonlocal position
+        for line in f:
+            text = line.decode('utf-8')
+            if position == 0:
+                text = text.lstrip('\ufeff')
+            position += len(line)
+            yield text
+
+    with csv_copy.open_input(csv_file, start_offset) as f:
+        record_start = start_offset
+        # csv.reader は1行分の値がそろった時点で返すため、その時点の position が行の終了位置になる
+        for row in csv.reader(lines(f)):
+            if row:
+                yield row, record_start, position
+            record_start = position
+
+def iter_parquet_records(parquet_file, start_offset=0, batch_rows=COPY_CHUNK_LINES):
+    """Parquet ファイルを start_offset（行）から batch_rows 行ずつ読み、(Arrow テーブル, 開始行, 終了行) を返す"""
+    position = 0
+    for table in columnar_format.iter_parquet_tables(parquet_file, NOTES_COLUMNS, batch_rows):
+        if position + table.num_rows > start_offset:
+            skip = max(0, start_offset - position)
+            yield table.slice(skip), position + skip, position + table.num_rows
+        position += table.num_rows
+
+def make_checkpointed_chunk(chunk_no, first_row, pieces, sources, end_position, copy_format=None):
+    """
+    読み込んだ行から (ラベル, チャンク, チェックポイント) を作る
+    チェックポイントはチャンクの番号・範囲（開始/終了のファイルと位置、ロード全体での先頭行と行数）と、
+    取り込めない行を探すための元データ（payload）・行ごとの (ファイル名, 位置) を持つ
+    エンコードに失敗した場合はチャンクを None にし、COPY する側で行を絞り込んで取り込めない行を探す
+    """
+    payload = pieces if isinstance(pieces[0], list) else columnar_format.concat_tables(pieces)
+    try:
+        chunk = payload_to_chunk(payload, copy_format)
+    except REJECTABLE_ERRORS:
+        chunk = None
+    checkpoint = {
+        'chunk_no': chunk_no,
+        'start_file': sources[0][0],
+        'start_offset': sources[0][1],
+        'end_file': end_position[0],
+        'end_offset': end_position[1],
+        'first_row': first_row,
+        'row_count': len(sources),
+        'payload': payload,
+        'sources': sources,
+        'copy_format': copy_format,
+    }
+    return f"{sources[0][0]}〜{end_position[0]}#{chunk_no}", chunk, checkpoint
+
+def iter_checkpointed_chunks(merged_files, done_chunks=None, chunk_lines=None, copy_format=None):
+    """
+    結合済みファイル（CSV / Parquet）を順に読み、chunk_lines 行（省略時は COPY_CHUNK_LINES）ずつの (ラベル, チャンク, チェックポイント) を返す
+    行数の少ないファイルは1つのチャンクにまとめる（CSV と Parquet の行は同じチャンクに入れない）
+    ファイルの並びと chunk_lines が同じなら、チャンクの区切りは毎回同じになる
+    done_chunks（チャンク番号 → コミット済みのチェックポイント）に含まれるチャンクは読まずに、その終了位置から続ける
+    位置は CSV ではバイト、Parquet では行で数える
+    """
+    done_chunks = done_chunks or {}
+    chunk_lines = chunk_lines or COPY_CHUNK_LINES
+    file_names = [os.path.basename(file_path) for file_path in merged_files]
+    chunk_no, first_row = 0, 0
+    file_index, offset = 0, 0
+    pieces, sources = [], []
+    end_position = None
+    while True:
+        # コミット済みのチャンクは読み飛ばす
+        while not sources and chunk_no in done_chunks:
+            done = done_chunks[chunk_no]
+            file_index, offset = file_names.index(done['end_file']), done['end_offset']
+            first_row += done['row_count']
+            chunk_no += 1
+        if file_index >= len(merged_files):
+            break
+
+        file_path, file_name = merged_files[file_index], file_names[file_index]
+        is_parquet = columnar_format.is_parquet_file(file_path)
+        if sources and is_parquet != (not isinstance(pieces[0], list)):
+            yield make_checkpointed_chunk(chunk_no, first_row, pieces, sources, end_position, copy_format)
+            chunk_no, first_row, pieces, sources = chunk_no + 1, first_row + len(sources), [], []
+            continue
+
+        records = iter_parquet_records(file_path, offset, chunk_lines) if is_parquet else iter_csv_records(file_path, offset)
+        restart = False
+        for values, record_start, record_end in records:
+            pieces.append(values)
+            if is_parquet:
+                sources.extend((file_name, record_start + index) for index in range(values.num_rows))
+            else:
+                sources.append((file_name, record_start))
+            end_position = (file_name, record_end)
+            if len(sources) >= chunk_lines:
+                yield make_checkpointed_chunk(chunk_no, first_row, pieces, sources, end_position, copy_format)
+                chunk_no, first_row, pieces, sources = chunk_no + 1, first_row + len(sources), [], []
+                if chunk_no in done_chunks:
+                    restart = True
+                    break
+        if not restart:
+            file_index, offset = file_index + 1, 0
+    if sources:
+        yield make_checkpointed_chunk(chunk_no, first_row, pieces, sources, end_position, copy_format)
+
+def copy_data(cur, table_name, chunk):
+    """
+    チャンクを COPY する（bytes: COPY バイナリ形式 / str: ヘッダーなしCSV / list: UTF-8 のヘッダーなしCSVのブロック）
+    取り込んだ行数を返す
+    """
+    if isinstance(chunk, bytes):
+        # バイト列をコピーせずに COPY_READ_SIZE ずつ読み出して送る
+        cur.copy_expert(sql=f"COPY {table_name} FROM STDIN WITH (FORMAT binary)", file=io.BytesIO(chunk), size=COPY_READ_SIZE)
+    elif isinstance(chunk, list):
+        # ブロックを連結せずに順に送る。UTF-8 でエンコード済みのため、接続の文字コードによらず UTF8 として読ませる
+        cur.copy_expert(sql=f"COPY {table_name} FROM STDIN WITH (FORMAT csv, ENCODING 'UTF8')",
+                        file=csv_copy.CopyStream(chunk), size=COPY_READ_SIZE)
+    else:
+        cur.copy_expert(sql=f"COPY {table_name} FROM STDIN WITH CSV", file=io.StringIO(chunk), size=COPY_READ_SIZE)
+    return cur.rowcount
+
+def copy_rejecting_rows(cur, table_name, payload, chunk, rejects, copy_format=None, first_index=0):
+    """
+    チャンクの元データ payload を COPY する（chunk はエンコード済みの payload。None の場合はここでエンコードする）
+    値の問題で失敗した場合は半分ずつに分けて COPY し直し、1行だけでも取り込めない行を
+    rejects に (チャンク内の位置, エラーメッセージ) として追加する。取り込んだ行数を返す
+    取り込めない行が REJECT_MAX_ROWS を超えた場合は、行ではなくファイルの問題とみなして例外を送出する
+    """
+    cur.execute("SAVEPOINT copy_rows;")
+    try:
+        if chunk is None:
+            chunk = payload_to_chunk(payload, copy_format)
+        row_count = copy_data(cur, table_name, chunk)
+        cur.execute("RELEASE SAVEPOINT copy_rows;")
+        return row_count
+    except REJECTABLE_ERRORS as e:
+        cur.execute("ROLLBACK TO SAVEPOINT copy_rows;")
+        length = payload_length(payload)
+        if length == 1:
+            rejects.append((first_index, str(e).strip()))
+            if len(rejects) > REJECT_MAX_ROWS:
+                raise RuntimeError(f"取り込めない行が {REJECT_MAX_ROWS} 行を超えました: {e}") from e
+            return 0
+        half = length // 2
+        return (copy_rejecting_rows(cur, table_name, slice_payload(payload, 0, half), None, rejects, copy_format, first_index)
+                + copy_rejecting_rows(cur, table_name, slice_payload(payload, half, length), None, rejects, copy_format, first_index + half))
+
+def load_checkpointed_chunk(conn, table_name, load_key, chunk, checkpoint):
+    """
+    チャンクを COPY し、取り込めなかった行の記録とチェックポイントの登録を同じトランザクションでコミットする
+    チャンクは「COPY 済みでチェックポイントあり」か「どちらも無し」のどちらかになるため、途中で止まっても二重には取り込まれない
+    既にチェックポイントがある場合（コミット後に接続が切れた場合など）は COPY しない。(取り込んだ行数, 取り込めなかった行数) を返す
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT loaded_rows, rejected_rows FROM {CHECKPOINT_TABLE} WHERE load_key = %s AND chunk_no = %s;",
+                    (load_key, checkpoint['chunk_no']))
+        committed = cur.fetchone()
+        if committed:
+            conn.commit()
+            return committed
+
+        rejects = []
+        loaded_rows = copy_rejecting_rows(cur, table_name, checkpoint['payload'], chunk, rejects, checkpoint['copy_format'])
+        if rejects:
+            psycopg2.extras.execute_values(
+                cur,
+                f"INSERT INTO {REJECT_TABLE} (load_key, chunk_no, row_no, file_name, file_offset, raw_row, error) VALUES %s",
+                [(load_key, checkpoint['chunk_no'], checkpoint['first_row'] + index, *checkpoint['sources'][index],
+                  payload_row_text(checkpoint['payload'], index), error) for index, error in rejects]
+            )
+        cur.execute(
+            f"""
+            INSERT INTO {CHECKPOINT_TABLE}
+                (load_key, chunk_no, start_file, start_offset, end_file, end_offset, first_row, row_count, loaded_rows, rejected_rows)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+            """,
+            (load_key, checkpoint['chunk_no'], checkpoint['start_file'], checkpoint['start_offset'], checkpoint['end_file'],
+             checkpoint['end_offset'], checkpoint['first_row'], checkpoint['row_count'], loaded_rows, len(rejects))
+        )
+    conn.commit()
+    return loaded_rows, len(rejects)
+
+def copy_chunks_in_parallel(chunks, table_name, workers=LOAD_WORKERS, load_key=None):
+    """
+    (ラベル, チャンク) または (ラベル, チャンク, チェックポイント) のチャンクを、workers 本の接続で並列に COPY する
+    チャンクが bytes の場合は COPY バイナリ形式、str の場合はヘッダーなしCSVとして送る
+    チェックポイント付きのチャンクは load_checkpointed_chunk() で取り込めない行を除いて COPY し、チェックポイントを登録する
+    接続はスレッドごとに1本ずつ張り、チャンクごとにコミットする。接続が切れた場合は LOAD_RETRY_COUNT 回まで接続し直す
+    先読みするチャンク数は workers の2倍までに抑え、メモリ使用量を一定に保つ
+    取り込んだ行数を返す。いずれかのチャンクが失敗した場合は例外を送出する
+    """
+    local = threading.local()
+    connections = []
+    connections_lock = threading.Lock()
+
+    def copy_chunk(label, chunk, checkpoint=None):
+        start = time.perf_counter()
+        for attempt in itertools.count():
+            conn = getattr(local, 'conn', None)
+            if conn is None:
+                conn = get_connection()
+                local.conn = conn
+                with connections_lock:
+                    connections.append(conn)
+            committing = False
+            try:
+                if checkpoint is None:
+                    with conn.cursor() as cur:
+                        row_count = copy_data(cur, table_name, chunk)
+                    committing = True
+                    conn.commit()
+                    rejected_rows = 0
+                else:
+                    row_count, rejected_rows = load_checkpointed_chunk(conn, table_name, load_key, chunk, checkpoint)
+                break
+            except RETRY_ERRORS as e:
+                # 接続が切れた場合は接続し直して同じチャンクをやり直す
+                # （チェックポイントの無いチャンクは、コミットの結果が分からない場合は二重に取り込まないようやり直さない）
+                conn.close()
+                local.conn = None
+                if attempt >= LOAD_RETRY_COUNT or committing:
+                    raise RuntimeError(f"チャンク {label} の COPY に失敗しました: {e}") from e
+                wait_seconds = LOAD_RETRY_WAIT_SECONDS * 2 ** attempt
+                print(f"  ⚠️ 警告: チャンク {label} の COPY 中に接続が切れました。{wait_seconds} 秒後に接続し直します"
+                      f"（{attempt + 1}/{LOAD_RETRY_COUNT}）。エラー: {str(e).strip()}")
+                time.sleep(wait_seconds)
+            except Exception as e:
+                if not conn.closed:
+                    conn.rollback()
+                raise RuntimeError(f"チャンク {label} の COPY に失敗しました: {e}") from e
+        if rejected_rows:
+            print(f"  ⚠️ 警告: チャンク {label} の {rejected_rows} 行は取り込めなかったため {REJECT_TABLE} に記録しました。")
+        run_metrics.record_file('copy', label, time.perf_counter() - start)
+        run_metrics.count('copy_rows', row_count)
+        run_metrics.count('rejected_rows', rejected_rows)
+        if isinstance(chunk, list):
+            run_metrics.count('copy_bytes', sum(len(block) for block in chunk))
+        elif chunk is not None:
+            run_metrics.count('copy_bytes' if isinstance(chunk, bytes) else 'copy_chars', len(chunk))
+        return row_count
+
+    loaded_rows = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            # チャンクの作成（読み込み・エンコードなど）はこのスレッドで行い、COPY の待ち時間と分けて 'produce' に記録する
+            for item in run_metrics.timed_iter('produce', chunks):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    loaded_rows += sum(future.result() for future in done)
+                pending.add(executor.submit(copy_chunk, *item))
+            loaded_rows += sum(future.result() for future in pending)
+    finally:
+        for conn in connections:
+            conn.close()
+    return loaded_rows
+
+def file_content_hash(file_path):
+    """ファイル内容の SHA-256 を返す"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_manifest(cur):
+    """管理テーブルから 取り込み済みファイル名 → 内容ハッシュ を読み込む"""
+    cur.execute(MANIFEST_TABLE_DDL)
+    cur.execute(f"SELECT file_name, content_hash FROM {MANIFEST_TABLE};")
+    return dict(cur.fetchall())
+
+def upsert_manifest(cur, manifest_entries):
+    """管理テーブルに (ファイル名, 内容ハッシュ, サイズ) を登録・更新する"""
+    if not manifest_entries:
+        return
+    psycopg2.extras.execute_values(
+        cur,
+        f"""
+        INSERT INTO {MANIFEST_TABLE} (file_name, content_hash, file_size) VALUES %s
+        ON CONFLICT (file_name) DO UPDATE
+        SET content_hash = EXCLUDED.content_hash, file_size = EXCLUDED.file_size, imported_at = now();
+        """,
+        manifest_entries
+    )
+
+def delete_manifest(cur, file_names):
+    """管理テーブルからファイル名の行を削除する"""
+    if not file_names:
+        return
+    cur.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE file_name = ANY(%s);", (list(file_names),))
+
+def merged_file_group(file_name):
+    """グループごとの結合済みファイル名からファイルグループを返す（all_merged.* や結合済みファイル以外の名前は None）"""
+    if file_name in ALL_MERGED_FILE_NAMES:
+        return None
+    for suffix in MERGED_FILE_SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)]
+    return None
+
+def find_removed_groups(imported_hashes, group_files):
+    """
+    管理テーブルにあって group_files に無いファイルグループ（merge_processed_csv.py がファイルを削除したグループ）を探し、
+    (管理テーブルから削除するファイル名のリスト, notes_receivable から削除する ocr_result_id のリスト) を返す
+    結合済みファイルの形式・圧縮形式を切り替えてファイル名が変わったグループは、ファイルが残っているため削除しない
+    """
+    current_groups = {merged_file_group(os.path.basename(file_path)) for file_path in group_files}
+    removed = {name: merged_file_group(name) for name in imported_hashes}
+    removed = {name: group for name, group in removed.items() if group is not None and group not in current_groups}
+    if not removed:
+        return [], []
+
+    ocr_result_ids = master_lookup.read_json(os.path.join(master_lookup.MASTER_DATA_DIR, master_lookup.OCR_ID_MAPPING_FILE_NAME))
+    unknown_groups = sorted({group for group in removed.values() if group not in ocr_result_ids})
+    if unknown_groups:
+        # 管理テーブルの行は残し、マッピングが戻った後の実行で削除する
+        print(f"  ⚠️ 警告: ocr_id_mapping.json に無いため、次のファイルグループの行を削除できません: {unknown_groups}")
+    removed_files = sorted(name for name, group in removed.items() if group in ocr_result_ids)
+    deleted_ids = sorted({ocr_result_ids[group] for group in removed.values() if group in ocr_result_ids})
+    return removed_files, deleted_ids
+
+def notes_partition_layout(cur):
+    """
+    既存の notes_receivable の分割方法を返す（pg_get_partkeydef() の形。例: 'HASH (cif_number)'）
+    分割していないテーブルは ''、テーブルが無い場合は None
+    """
+    cur.execute("SELECT to_regclass('notes_receivable') IS NOT NULL, pg_get_partkeydef(to_regclass('notes_receivable'));")
+    exists, key_definition = cur.fetchone()
+    if not exists:
+        return None
+    return key_definition or ''
+
+def ensure_notes_table(cur):
+    """
+    notes_receivable（主キー付き）とインデックスが無ければ作成する（PARTITION_BY を設定した場合は分割したテーブル）
+    既存のテーブルの分割方法が PARTITION_BY と異なる場合は、UPSERT で移せないためエラーにする
+    """
+    layout = notes_partition_layout(cur)
+    if layout is None:
+        cur.execute(notes_table_ddl(partitioned=bool(PARTITION_BY)))
+        create_partitions(cur, 'notes_receivable')
+    elif layout != (notes_partitions.key_definition(PARTITION_BY) if PARTITION_BY else ''):
+        raise RuntimeError(f"notes_receivable の分割方法（{layout or '分割なし'}）が PARTITION_BY の設定（{PARTITION_BY}）と異なります。"
+                           "--mode full でロードし直してテーブルを作り直してください。")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_jgroupid_string ON notes_receivable(jgroupid_string);")
+
+def replace_notes_from_staging(cur):
+    """notes_receivable を作り直してステージングの全行を移し、主キーとインデックスを最後に1回だけ作成する"""
     cur.execute("DROP INDEX IF EXISTS idx_jgroupid_string;")
     cur.execute("DROP TABLE IF EXISTS notes_receivable;")
+    cur.execute(notes_table_ddl(with_primary_key=False))
+    cur.execute(f"INSERT INTO notes_receivable SELECT * FROM {STAGING_TABLE};")
+    cur.execute(f"ALTER TABLE notes_receivable ADD {notes_primary_key()};")
+    cur.execute("CREATE INDEX idx_jgroupid_string ON notes_receivable(jgroupid_string);")
+    cur.execute(f"TRUNCATE {MANIFEST_TABLE};")
 
-    cur.execute("""
-CREATE TABLE notes_receivable (
-    ocr_result_id CHAR(18) NOT NULL,
-    page_no INTEGER NOT NULL,
-    id INTEGER NOT NULL,
-    jgroupid_string VARCHAR(3),
-    cif_number VARCHAR(7),
-    settlement_at VARCHAR(6),
-    registration_number_original TEXT,
-    registration_number TEXT,
-    maker_name_original TEXT,
-    maker_name TEXT,
-    maker_com_code TEXT,
-    maker_com_code_status_id INTEGER,
-    maker_comcd_relation_source_type_id INTEGER,
-    maker_exist_comcd_relation_history_id INTEGER,
-    issue_date_original TEXT,
-    issue_date TEXT,
-    due_date_original TEXT,
-    due_date TEXT,
-    paying_bank_name_original TEXT,
-    paying_bank_name TEXT,
-    paying_bank_code TEXT,
-    paying_bank_branch_name_original TEXT,
-    paying_bank_branch_name TEXT,
-    balance_original NUMERIC,
-    balance NUMERIC,
-    discount_bank_name_original TEXT,
-    discount_bank_name TEXT,
-    discount_bank_code TEXT,
-    description_original TEXT,
-    description TEXT,
-    conf_registration_number INTEGER,
-    conf_maker_name INTEGER,
-    conf_issue_date INTEGER,
-    conf_due_date INTEGER,
-    conf_balance INTEGER,
-    conf_paying_bank_name INTEGER,
-    conf_paying_bank_branch_name INTEGER,
-    conf_discount_bank_name INTEGER,
-    conf_description INTEGER,
-    coord_x_registration_number NUMERIC,
-    coord_y_registration_number NUMERIC,
-    coord_h_registration_number NUMERIC,
-    coord_w_registration_number NUMERIC,
-    coord_x_maker_name NUMERIC,
-    coord_y_maker_name NUMERIC,
-    coord_h_maker_name NUMERIC,
-    coord_w_maker_name NUMERIC,
-    coord_x_issue_date NUMERIC,
-    coord_y_issue_date NUMERIC,
-    coord_h_issue_date NUMERIC,
-    coord_w_issue_date NUMERIC,
-    coord_x_due_date NUMERIC,
-    coord_y_due_date NUMERIC,
-    coord_h_due_date NUMERIC,
-    coord_w_due_date NUMERIC,
-    coord_x_balance NUMERIC,
-    coord_y_balance NUMERIC,
-    coord_h_balance NUMERIC,
-    coord_w_balance NUMERIC,
-    coord_x_paying_bank_name NUMERIC,
-    coord_y_paying_bank_name NUMERIC,
-    coord_h_paying_bank_name NUMERIC,
-    coord_w_paying_bank_name NUMERIC,
-    coord_x_paying_bank_branch_name NUMERIC,
-    coord_y_paying_bank_branch_name NUMERIC,
-    coord_h_paying_bank_branch_name NUMERIC,
-    coord_w_paying_bank_branch_name NUMERIC,
-    coord_x_discount_bank_name NUMERIC,
-    coord_y_discount_bank_name NUMERIC,
-    coord_h_discount_bank_name NUMERIC,
-    coord_w_discount_bank_name NUMERIC,
-    coord_x_description NUMERIC,
-    coord_y_description NUMERIC,
-    coord_h_description NUMERIC,
-    coord_w_description NUMERIC,
-    row_no SMALLINT,
-    insertdatetime TIMESTAMP,
-    updatedatetime TIMESTAMP,
-    updateuser TEXT,
-    PRIMARY KEY (ocr_result_id, page_no, id)
-);
-""")
+def build_partition_tables(workers=LOAD_WORKERS):
+    """
+    ステージングのパーティションごとに、notes_receivable の新しいパーティションにするテーブル（notes_receivable_p0_new など）を
+    workers 本の接続で並列に作成してコミットする。行を移してから主キー・インデックスを作成し、範囲で分割する場合は
+    パーティションの範囲の CHECK 制約を付ける（ATTACH PARTITION の際に行の検証を省くため。ハッシュ分割では付けられず、
+    ATTACH PARTITION の際に PostgreSQL がパーティションを1回読んで検証する）
+    いずれかのパーティションが失敗した場合は例外を送出する（作成済みのテーブルは drop_partition_tables() で削除する）
+    """
+    def build(suffix, check):
+        start = time.perf_counter()
+        table_name = f"notes_receivable_{suffix}_new"
+        conn = get_connection()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP TABLE IF EXISTS {table_name};")
+                cur.execute(notes_table_ddl(table_name, with_primary_key=False))
+                cur.execute(f"INSERT INTO {table_name} SELECT * FROM {STAGING_TABLE}_{suffix};")
+                row_count = cur.rowcount
+                cur.execute(f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_pkey {notes_primary_key()};")
+                cur.execute(f"CREATE INDEX {table_name}_jgroupid_string_idx ON {table_name}(jgroupid_string);")
+                if check:
+                    cur.execute(f"ALTER TABLE {table_name} ADD CONSTRAINT {table_name}_bound CHECK ({check});")
+            conn.commit()
+        finally:
+            conn.close()
+        run_metrics.record_file('partition', table_name, time.perf_counter() - start)
+        return row_count
 
-    cur.execute("CREATE INDEX idx_jgroupid_string ON notes_receivable(jgroupid_string);")
-    conn.commit()
-    print("✅ テーブルとインデックスの初期化が完了しました。")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(build, suffix, check) for suffix, _, check in notes_partition_specs()]
+        return sum(future.result() for future in futures)
 
-    # ここでログファイルを空にしちゃう
-    clear_imported_files_log()
-    print("🧹 取り込みログファイルをクリアしました。")
+def drop_partition_tables(cur):
+    """build_partition_tables() で作成したテーブル（付け替える前のもの）を削除する"""
+    for suffix, _, _ in notes_partition_specs():
+        cur.execute(f"DROP TABLE IF EXISTS notes_receivable_{suffix}_new;")
 
-    imported_files = load_imported_files()
-    csv_files = glob.glob(os.path.join(MERGED_OUTPUT_DIR, '*_merged.csv'))
+def swap_partitions(cur):
+    """
+    build_partition_tables() で作成したテーブルを notes_receivable のパーティションに付け替える（コミットは呼び出し側で行う）
+    notes_receivable が同じ方法で分割されていれば、親テーブルはそのままに古いパーティションを外して削除し（DETACH PARTITION）、
+    新しいテーブルを付ける（ATTACH PARTITION）。主キー・インデックスは作成済みのものがそのまま親テーブルのものとして使われる
+    分割していない・分割方法が異なる場合は、親テーブルを作り直してから付ける
+    付け替えのトランザクションの間、notes_receivable を読む処理は待たされ、コミット後は新しいデータを読む
+    """
+    if notes_partition_layout(cur) == notes_partitions.key_definition(PARTITION_BY):
+        cur.execute("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = 'notes_receivable'::regclass;")
+        for (old_partition,) in cur.fetchall():
+            cur.execute(f"ALTER TABLE notes_receivable DETACH PARTITION {old_partition};")
+            cur.execute(f"DROP TABLE {old_partition};")
+    else:
+        cur.execute("DROP TABLE IF EXISTS notes_receivable;")
+        cur.execute(notes_table_ddl(partitioned=True))
+        cur.execute("CREATE INDEX idx_jgroupid_string ON notes_receivable(jgroupid_string);")
+    for suffix, bound, check in notes_partition_specs():
+        new_name, partition_name = f"notes_receivable_{suffix}_new", f"notes_receivable_{suffix}"
+        cur.execute(f"ALTER TABLE {new_name} RENAME TO {partition_name};")
+        cur.execute(f"ALTER INDEX {new_name}_pkey RENAME TO {partition_name}_pkey;")
+        cur.execute(f"ALTER INDEX {new_name}_jgroupid_string_idx RENAME TO {partition_name}_jgroupid_string_idx;")
+        cur.execute(f"ALTER TABLE notes_receivable ATTACH PARTITION {partition_name} {bound};")
+        if check:
+            # パーティションの範囲の制約があるため、CHECK 制約は付け替えた後は不要
+            cur.execute(f"ALTER TABLE {partition_name} DROP CONSTRAINT {new_name}_bound;")
+    cur.execute(f"TRUNCATE {MANIFEST_TABLE};")
 
-    if not csv_files:
-        print("📂 マージ済みCSVファイルが見つかりません。")
+def upsert_notes_from_staging(cur):
+    """
+    ステージングの行を (ocr_result_id, page_no, id) をキーに notes_receivable へ UPSERT する
+    取り込み単位は ocr_result_id ごとにまとまっているため、ステージングに含まれる ocr_result_id のうち
+    今回のデータに存在しなくなった行（変更で減った行）は先に削除する
+    """
+    key_columns = ', '.join(notes_key_columns())
+    key_match = ' AND '.join(f"s.{col} = n.{col}" for col in notes_key_columns())
+    update_columns = ',\n        '.join(f"{col} = EXCLUDED.{col}" for col in NOTES_COLUMNS if col not in notes_key_columns())
+
+    cur.execute(f"""
+    DELETE FROM notes_receivable n
+    WHERE n.ocr_result_id IN (SELECT DISTINCT ocr_result_id FROM {STAGING_TABLE})
+      AND NOT EXISTS (SELECT 1 FROM {STAGING_TABLE} s WHERE {key_match});
+    """)
+    deleted_rows = cur.rowcount
+
+    # 同じキーが複数回現れると ON CONFLICT DO UPDATE がエラーになるため、キーごとに1行に絞る
+    cur.execute(f"""
+    INSERT INTO notes_receivable
+    SELECT DISTINCT ON ({key_columns}) * FROM {STAGING_TABLE} ORDER BY {key_columns}
+    ON CONFLICT ({key_columns}) DO UPDATE SET
+        {update_columns};
+    """)
+    return deleted_rows, cur.rowcount
+
+def load_key_for(mode, manifest_entries, copy_format=None):
+    """
+    ロードの対象（ファイル名・内容ハッシュの並び）と方式から、前回中断したロードと同じかを判定するキーを作る
+    キーが同じならチャンクの区切りも同じになるため、コミット済みのチャンクを読み飛ばして再開できる
+    """
+    digest = hashlib.sha256(f"{mode}|{copy_format or COPY_FORMAT}|{COPY_CHUNK_LINES}".encode('utf-8'))
+    if PARTITION_BY:
+        # ステージングの分割方法も同じでなければ再開しない
+        digest.update(f"|{PARTITION_BY}|{PARTITION_COUNT}|{PARTITION_BOUNDS}".encode('utf-8'))
+    for file_name, content_hash, _ in manifest_entries:
+        digest.update(f"|{file_name}:{content_hash}".encode('utf-8'))
+    return digest.hexdigest()
+
+def prepare_staging(cur, load_key=None):
+    """
+    ステージングテーブルを用意し、コミット済みのチャンク（チャンク番号 → チェックポイント）を返す
+    load_key が前回中断したロードと同じで、ステージングの行数がチェックポイントの合計と一致する場合は、
+    ステージングをそのまま使って続きから再開する（UNLOGGED のため DB サーバーの異常終了後は空になっており、作り直す）
+    それ以外はステージングを作り直し、古いチェックポイントを削除する
+    """
+    cur.execute(CHECKPOINT_TABLE_DDL)
+    cur.execute(REJECT_TABLE_DDL)
+    done_chunks = {}
+    if load_key:
+        cur.execute(f"SELECT chunk_no, end_file, end_offset, row_count, loaded_rows FROM {CHECKPOINT_TABLE} WHERE load_key = %s;",
+                    (load_key,))
+        done_chunks = {chunk_no: {'end_file': end_file, 'end_offset': end_offset, 'row_count': row_count, 'loaded_rows': loaded_rows}
+                       for chunk_no, end_file, end_offset, row_count, loaded_rows in cur.fetchall()}
+    if done_chunks:
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (STAGING_TABLE,))
+        staging_rows = None
+        if cur.fetchone()[0]:
+            cur.execute(f"SELECT count(*) FROM {STAGING_TABLE};")
+            staging_rows = cur.fetchone()[0]
+        if staging_rows != sum(done['loaded_rows'] for done in done_chunks.values()):
+            print("  ⚠️ 警告: ステージングテーブルの行数がチェックポイントと一致しないため、最初から読み込み直します。")
+            done_chunks = {}
+    if not done_chunks:
+        cur.execute(f"DELETE FROM {CHECKPOINT_TABLE};")
+        if load_key:
+            cur.execute(f"DELETE FROM {REJECT_TABLE} WHERE load_key = %s;", (load_key,))
+        cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE};")
+        if PARTITION_BY:
+            # notes_receivable と同じ方法で分割し、COPY した行をパーティションごとに振り分ける（パーティションは UNLOGGED）
+            cur.execute(notes_table_ddl(STAGING_TABLE, with_primary_key=False, partitioned=True))
+            create_partitions(cur, STAGING_TABLE, unlogged=True)
+        else:
+            cur.execute(notes_table_ddl(STAGING_TABLE, unlogged=True, with_primary_key=False))
+    return done_chunks
+
+def bulk_load_chunks(chunks, workers=LOAD_WORKERS, mode='full', manifest_entries=(), deleted_ocr_result_ids=(), load_key=None,
+                     removed_files=()):
+    """
+    チャンクを UNLOGGED のステージングテーブルへ並列 COPY し、notes_receivable へ移す
+    mode='full': テーブルを作り直して1つの INSERT ... SELECT で移し、主キーとインデックスは最後に1回だけ作成する
+    （PARTITION_BY を設定した場合は、パーティションごとに並列に作成してから付け替える。swap_partitions() を参照）
+    mode='incremental': 既存の notes_receivable に (ocr_result_id, page_no, id) をキーに UPSERT する
+    deleted_ocr_result_ids を渡した場合（incremental のみ）、その ocr_result_id の行を同じトランザクションで削除する
+    （元データが全て削除されたファイルグループなど、ステージングに1行も無い ocr_result_id 用）
+    removed_files のファイル名は、同じトランザクションで管理テーブルから削除する
+    移し替えと管理テーブルの更新は1トランザクションで行うため、途中で失敗しても既存の notes_receivable は残る
+    load_key を渡した場合、チャンクは iter_checkpointed_chunks() の (ラベル, チャンク, チェックポイント) で、
+    ステージングは prepare_staging(cur, load_key) で用意済みとする。失敗した場合もステージングとチェックポイントを残し、
+    次回同じ load_key で続きから再開できるようにする。取り込んだ行数（再開した場合は前回までの分を含む）を返す
+    """
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(MANIFEST_TABLE_DDL)
+        if mode == 'incremental':
+            ensure_notes_table(cur)
+        if load_key is None:
+            prepare_staging(cur)
+        conn.commit()
+
+        print(f"  ⏳ ステージングテーブル {STAGING_TABLE} へ {workers} 接続で並列 COPY 中...")
+        with run_metrics.stage('copy'):
+            loaded_rows = copy_chunks_in_parallel(chunks, STAGING_TABLE, workers, load_key)
+        if load_key is not None:
+            cur.execute(f"SELECT coalesce(sum(loaded_rows), 0), coalesce(sum(rejected_rows), 0) FROM {CHECKPOINT_TABLE} WHERE load_key = %s;",
+                        (load_key,))
+            loaded_rows, rejected_rows = cur.fetchone()
+            if rejected_rows:
+                print(f"  ⚠️ 警告: 取り込めなかった行が {rejected_rows} 行あります → {REJECT_TABLE}（load_key = '{load_key}'）")
+        print(f"  ✅ ステージングテーブルへの COPY が完了しました: {loaded_rows} 行")
+
+        print("  ⏳ notes_receivable へ移し替え中...")
+        with run_metrics.stage('move'):
+            if mode == 'incremental':
+                if deleted_ocr_result_ids:
+                    cur.execute("DELETE FROM notes_receivable WHERE ocr_result_id = ANY(%s);", (list(deleted_ocr_result_ids),))
+                    print(f"  ℹ️ 元データが無くなったファイルグループの行を削除: {cur.rowcount} 行")
+                deleted_rows, upserted_rows = upsert_notes_from_staging(cur)
+                print(f"  ℹ️ UPSERT: {upserted_rows} 行 / 削除（変更で減った行）: {deleted_rows} 行")
+            elif PARTITION_BY:
+                print(f"  ⏳ パーティションごとに {workers} 接続で並列に作成中...")
+                partition_rows = build_partition_tables(workers)
+                swap_partitions(cur)
+                print(f"  ℹ️ パーティション: {len(notes_partition_specs())} 件 / {partition_rows} 行（{PARTITION_BY}）")
+            else:
+                replace_notes_from_staging(cur)
+            upsert_manifest(cur, list(manifest_entries))
+            delete_manifest(cur, list(removed_files))
+            if load_key is not None:
+                cur.execute(f"DELETE FROM {CHECKPOINT_TABLE} WHERE load_key = %s;", (load_key,))
+            cur.execute(f"DROP TABLE {STAGING_TABLE};")
+            conn.commit()
+        print("  ✅ notes_receivable への移し替えが完了しました。")
+        return loaded_rows
+    except Exception:
+        conn.rollback()
+        if mode != 'incremental' and PARTITION_BY:
+            drop_partition_tables(cur)
+            conn.commit()
+        if load_key is None:
+            cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE};")
+            conn.commit()
+        raise
+    finally:
         cur.close()
         conn.close()
+
+def save_csvs_to_postgres(mode=LOAD_MODE):
+    # merge_processed_csv.py の MERGED_OUTPUT_FORMAT により、結合済みファイルは CSV か Parquet のどちらか
+    csv_files = sorted(file_path for extension in MERGED_FILE_EXTENSIONS
+                       for file_path in glob.glob(os.path.join(MERGED_OUTPUT_DIR, f'*_merged{extension}')))
+    # merge_processed_csv.py はグループごとのファイルと all_merged.csv の両方を出力するため、
+    # 同じ行を二重に取り込まないよう、グループごとのファイルがあればそちらだけを使う
+    group_files = [csv_file for csv_file in csv_files if os.path.basename(csv_file) not in ALL_MERGED_FILE_NAMES]
+    if group_files:
+        csv_files = group_files
+
+    if not csv_files:
+        print("📂 マージ済みCSVファイルが見つかりません。")
         return
 
-    print(f"📥 {len(csv_files)} 件のファイルを確認中...")
+    print(f"📥 {len(csv_files)} 件のファイルを確認中...（ロード方式: {mode}）")
 
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        imported_hashes = load_manifest(cur) if mode == 'incremental' else {}
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+
+    target_files = []
+    manifest_entries = []
     for csv_file in csv_files:
         filename = os.path.basename(csv_file)
-        if filename in imported_files:
-            print(f"  ⏭️ スキップ: {filename}（既に取り込み済み）")
+        content_hash = file_content_hash(csv_file)
+        if imported_hashes.get(filename) == content_hash:
+            run_metrics.file_message('unchanged_file', f"  ⏭️ スキップ: {filename}（既に取り込み済み・変更なし）")
             continue
+        target_files.append(csv_file)
+        manifest_entries.append((filename, content_hash, os.path.getsize(csv_file)))
 
-        try:
-            print(f"  ⏳ インポート中: {filename}")
-            with open(csv_file, 'r', encoding='utf-8-sig') as f:
-                cur.copy_expert(
-                    sql="COPY notes_receivable FROM STDIN WITH CSV",
-                    file=f
-                )
-            conn.commit()
-            print(f"  ✅ インポート成功: {filename}")
-            save_imported_file(filename)
-        except Exception as e:
-            conn.rollback()
-            print(f"  ❌ エラー: {filename} のインポートに失敗しました。エラー内容: {e}")
-
-    cur.close()
-    conn.close()
+    # 元データが全て削除されたファイルグループは、登録済みの行と管理テーブルの行を削除する
+    # （all_merged.csv だけを読み込む場合は、グループごとのファイルが無いため判定しない）
+    removed_files, deleted_ids = [], []
+    if mode == 'incremental' and group_files:
+        removed_files, deleted_ids = find_removed_groups(imported_hashes, csv_files)
+        if deleted_ids:
+            print(f"  🗑️ 結合済みファイルが無くなったファイルグループ: {len(deleted_ids)} 件")
+
+    if not target_files and not deleted_ids:
+        print("✅ 新規・変更されたファイルはありません。")
+        return
+
+    # 前回中断したロードと対象が同じなら、コミット済みのチャンクを読み飛ばして再開する
+    load_key = load_key_for(mode, manifest_entries)
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        done_chunks = prepare_staging(cur, load_key)
+        conn.commit()
+    finally:
+        cur.close()
+        conn.close()
+    if done_chunks:
+        print(f"  ℹ️ 前回中断したロードを再開します（コミット済みのチャンク: {len(done_chunks)} 件 / "
+              f"{sum(done['row_count'] for done in done_chunks.values())} 行）")
+        run_metrics.count('resumed_chunks', len(done_chunks))
+
+    chunks = iter_checkpointed_chunks(target_files, done_chunks)
+    try:
+        loaded_rows = bulk_load_chunks(chunks, mode=mode, manifest_entries=manifest_entries, load_key=load_key,
+                                       deleted_ocr_result_ids=deleted_ids, removed_files=removed_files)
+    except Exception as e:
+        print(f"  ❌ エラー: インポートに失敗しました。notes_receivable は変更されていません。エラー内容: {e}")
+        print("  ℹ️ COPY 済みのチャンクはチェックポイントに記録されているため、次回の実行では続きから再開します。")
+        return
+
+    print(f"  ✅ インポート成功: {len(target_files)} ファイル / {loaded_rows} 行")
     print("🎉 全CSVのインポート処理が完了しました。")
 
-if __name__ == "__main__":
+def main():
+    run_metrics.start_run('insert_to_postgres')
     save_csvs_to_postgres()
+    run_metrics.finish_run()
+
+if __name__ == "__main__":
+    main()
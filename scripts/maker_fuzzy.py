@@ -0,0 +1,127 @@
+import re
+from collections import Counter
+
+import app_config
+
+# 会社名（振出人）のあいまい一致
+# OCR の読み取りでは「(株)」の有無・位置の揺れ、小さい仮名の読み違い、支店・工場名の付加などで、
+# 同じ会社が master.csv と完全には一致しないことがある。master_lookup.py で完全一致しなかった会社名だけをここで引き当てる
+#
+# - 会社名から「(株)」などの種類の表記と末尾の部署名（営業統括本部・工場 など）を除いた「中核名」を比べる
+#   前株・後株が両方とも明記されていて異なる場合は、master_lookup.py と同じく別の会社として扱う
+# - 中核名の文字 n-gram の転置インデックスから、共通の n-gram が多い候補を MAX_CANDIDATES 件だけ選び、
+#   候補とだけ編集距離による類似度（1 - 編集距離 / 長い方の文字数）を計算する（全件との総当たりはしない）
+# - 類似度が MATCH_THRESHOLD 以上の候補のうち最も高いものを一致とする
+
+# 設定項目
+NGRAM_SIZE = 2
+# これ以上の類似度なら同じ会社とみなす（0.8 では「和田工務店」と「合田工務店」のような別の会社も一致してしまう）
+MATCH_THRESHOLD = 0.85
+MAX_CANDIDATES = 20       # 編集距離を計算する候補の上限（共通の n-gram が多い順）
+# この件数より多くの会社に出てくる n-gram（「工業」「建設」など）は候補選びに使わない（全て該当する場合を除く）
+COMMON_NGRAM_LIMIT = 1000
+
+# 会社の種類の表記（master_lookup.COMPANY_TYPE_REPLACEMENTS で略記に揃えた後の形）
+COMPANY_TYPE_MARKS = ['(株)', '(有)', '(同)', '(資)', '(名)']
+# 会社名の末尾に付く部署・拠点名（中核名から除く）
+DIVISION_SUFFIXES = ['営業統括本部', '営業本部', '本社', '本店', '支店', '支社', '営業所', '出張所', '事業所', '事業部', '工場', '本部']
+# 読み違いの多い小さい仮名・長音の揺れを揃える
+KANA_TRANSLATION = str.maketrans('ァィゥェォッャュョヮヵヶぁぃぅぇぉっゃゅょゎ－-', 'アイウエオツヤユヨワカケあいうえおつやゆよわーー')
+# OCR で取り違えやすい、形の似た漢字 → カタカナ（「マ工タ」と「マエタ」を同じ名前とみなす）
+OCR_CONFUSABLES = {'工': 'エ', '力': 'カ', '口': 'ロ', '二': 'ニ', '八': 'ハ', '夕': 'タ', '卜': 'ト', '一': 'ー'}
+
+app_config.apply(globals())
+
+NAME_TRANSLATION = {**KANA_TRANSLATION, **str.maketrans(OCR_CONFUSABLES)}
+MARK_PATTERN = re.compile('|'.join(re.escape(mark) for mark in COMPANY_TYPE_MARKS))
+DIVISION_PATTERN = re.compile(f"(?:{'|'.join(map(re.escape, DIVISION_SUFFIXES))})$")
+
+
+def core_name(key):
+    """
+    正規化済みの会社名から (中核名, 種類の表記の位置) を返す
+    位置は '前(株)' / '後(株)' のような文字列で、種類の表記が無い場合は ''
+    後株の後ろに続く部分（「ナカ工業(株)札幌工場」の「札幌工場」）と、末尾の部署名は除く
+    """
+    match = MARK_PATTERN.search(key)
+    kind = ''
+    if match:
+        if match.start() == 0:
+            kind = '前' + match.group()
+        else:
+            kind = '後' + match.group()
+            key = key[:match.start()]
+    name = MARK_PATTERN.sub('', key)
+    stripped = DIVISION_PATTERN.sub('', name)
+    if len(stripped) >= 2:
+        name = stripped
+    return name.translate(NAME_TRANSLATION), kind
+
+
+def ngrams(name):
+    if len(name) <= NGRAM_SIZE:
+        return {name} if name else set()
+    return {name[i:i + NGRAM_SIZE] for i in range(len(name) - NGRAM_SIZE + 1)}
+
+
+def new_index():
+    """
+    あいまい一致用のインデックス
+    entries: [(中核名, 種類の表記の位置, 値)] / postings: n-gram → entries の位置のリスト
+    """
+    return {'entries': [], 'postings': {}}
+
+
+def add_entry(index, key, value):
+    """正規化済みの会社名 key を、引き当てたときに返す value とともにインデックスに追加する"""
+    name, kind = core_name(key)
+    if not name:
+        return
+    position = len(index['entries'])
+    index['entries'].append((name, kind, value))
+    for gram in ngrams(name):
+        index['postings'].setdefault(gram, []).append(position)
+
+
+def edit_distance(a, b, limit):
+    """a と b の編集距離（レーベンシュタイン距離）。limit を超えることが確定した時点で limit + 1 を返す"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def find_best(index, key):
+    """
+    正規化済みの会社名 key に最も似たインデックスの会社を探し、(値, 類似度) を返す
+    MATCH_THRESHOLD 以上の候補が無い場合は (None, 0.0)
+    """
+    name, kind = core_name(key)
+    grams = ngrams(name)
+    if not grams or not index['entries']:
+        return None, 0.0
+
+    postings = [index['postings'][gram] for gram in grams if gram in index['postings']]
+    selective = [posting for posting in postings if len(posting) <= COMMON_NGRAM_LIMIT]
+    shared = Counter()
+    for posting in selective or postings:
+        shared.update(posting)
+
+    best_value, best_score = None, 0.0
+    for position, _ in sorted(shared.items(), key=lambda item: (-item[1], item[0]))[:MAX_CANDIDATES]:
+        candidate, candidate_kind, value = index['entries'][position]
+        if kind and candidate_kind and kind != candidate_kind:
+            continue  # 前株と後株は別の会社
+        length = max(len(name), len(candidate))
+        limit = int(length * (1 - MATCH_THRESHOLD) + 1e-9)  # 類似度が MATCH_THRESHOLD 以上になる編集距離の上限
+        score = 1 - edit_distance(name, candidate, limit) / length
+        if score >= MATCH_THRESHOLD - 1e-9 and score > best_score:
+            best_value, best_score = value, score
+    return best_value, best_score
@@ -0,0 +1,244 @@
+import os
+import re
+import json
+import threading
+import unicodedata
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+
+import app_config
+import bank_lookup
+import maker_fuzzy
+
+# マスタデータの引き当て
+# master.csv（会社名 → 会社コード）・ocr_id_mapping.json・jgroupid_master.csv・bank_master.csv を1回だけ読み込んでハッシュ表にし、
+# 列単位（ユニーク値ごと）にまとめて引き当てる。マスタに無い会社・ファイルグループへの採番は
+# lock で排他し、採番した時点でファイルに保存する（複数スレッド・実行をまたいでも同じ番号を使う）
+# 会社名が完全には一致しない場合は、採番する前に maker_fuzzy.py で表記ゆれとしてあいまい一致を試す
+
+# 設定項目
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
+MASTER_DATA_DIR = os.path.join(APP_ROOT_DIR, 'master_data')
+
+OCR_ID_MAPPING_FILE_NAME = 'ocr_id_mapping.json'
+MAKER_MASTER_FILE_NAME = 'master.csv'
+# master.csv に無い会社へ自動採番した maker_com_code（正規化した会社名 → コード）
+MAKER_CODE_MAPPING_FILE_NAME = 'maker_com_code_mapping.json'
+JGROUPID_MASTER_FILE_NAME = 'jgroupid_master.csv'
+# 銀行・支店マスタ（無ければ paying_bank_code / discount_bank_code は空のまま。形式は bank_lookup.py を参照）
+BANK_MASTER_FILE_NAME = 'bank_master.csv'
+
+# maker_com_code の自動採番（頭に2を追加した3桁の連番）
+MAKER_COM_CODE_PREFIX = '2'
+# 連番の桁数（固定幅で0埋め）。使い切った場合は警告を表示し、桁数を増やして採番を続ける（2999 の次は 21000）
+# 変更しても採番済みのコードはそのまま使い、新しく採番するコードだけがこの桁数になる
+MAKER_COM_CODE_DIGITS = 3
+# maker_com_code の引き当て方法（lookup_maker_com_codes() が行ごとに返す値）
+MAKER_MATCH_MASTER = 'master'        # master.csv と一致
+MAKER_MATCH_ALLOCATED = 'allocated'  # 自動採番した会社と一致（今回新しく採番した会社を含む）
+MAKER_MATCH_FUZZY = 'fuzzy'          # 表記ゆれとして master.csv・自動採番した会社とあいまい一致
+# ocr_result_id の採番間隔（既存の採番ルールに合わせ、最大値から 10 ずつ加算する）
+OCR_RESULT_ID_STEP = 10
+
+app_config.apply(globals())
+
+# 会社の種類の表記ゆれ（NFKC 正規化の後に置き換える）
+# 「株式会社○○」と「(株)○○」は同じ会社とみなす。前株・後株の違いは別の会社として扱う
+COMPANY_TYPE_REPLACEMENTS = [
+    ('株式会社', '(株)'),
+    ('有限会社', '(有)'),
+    ('合同会社', '(同)'),
+    ('合資会社', '(資)'),
+    ('合名会社', '(名)'),
+]
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=None)
+def normalize_company_name(name):
+    """
+    会社名を引き当て用のキーに正規化する
+    全角英数・記号は半角に、半角カナは全角にし（NFKC）、空白を除去して (株)/株式会社/㈱ などの表記を揃える
+    """
+    if not isinstance(name, str):
+        return ''
+    key = WHITESPACE_PATTERN.sub('', unicodedata.normalize('NFKC', name))
+    for long_form, short_form in COMPANY_TYPE_REPLACEMENTS:
+        key = key.replace(long_form, short_form)
+    return key
+
+
+def normalize_keys(values):
+    """列の値を normalize_company_name() で正規化する（ユニーク値ごとに1回だけ計算する）"""
+    unique_values = pd.unique(values)
+    return values.map({value: normalize_company_name(value) for value in unique_values})
+
+
+def write_json_atomic(file_path, data):
+    """JSON を一時ファイルに書いてから置き換える（書き込み中に中断しても壊れたファイルを残さない）"""
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_file = file_path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_file, file_path)
+
+
+def read_json(file_path):
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_master_data(master_data_dir=MASTER_DATA_DIR):
+    """
+    マスタデータを読み込み、引き当て用のハッシュ表をまとめた dict を返す
+    以降の引き当て・採番はこの dict を渡して行う（ファイルの再読み込みはしない）
+    """
+    maker_master_file = os.path.join(master_data_dir, MAKER_MASTER_FILE_NAME)
+    maker_codes = {}
+    if os.path.exists(maker_master_file):
+        master_df = pd.read_csv(maker_master_file, encoding='utf-8-sig', dtype=str, keep_default_na=False)
+        for name, code in zip(master_df['会社名'], master_df['会社コード'].str.strip()):
+            # 表記ゆれで同じキーになる会社が複数ある場合は、VLOOKUP と同じく先頭の行を優先する
+            maker_codes.setdefault(normalize_company_name(name), code)
+
+    jgroupid_file = os.path.join(master_data_dir, JGROUPID_MASTER_FILE_NAME)
+    jgroupids = set()
+    if os.path.exists(jgroupid_file):
+        jgroupid_df = pd.read_csv(jgroupid_file, encoding='utf-8-sig', dtype=str, header=None, keep_default_na=False)
+        jgroupids = set(jgroupid_df[0].str.strip()) - {''}
+
+    allocated_file = os.path.join(master_data_dir, MAKER_CODE_MAPPING_FILE_NAME)
+    allocated_codes = {normalize_company_name(name): code for name, code in read_json(allocated_file).items()}
+
+    # あいまい一致用のインデックス（値は (maker_com_code, 引き当て方法)）。master.csv の会社を先に入れ、同じ類似度なら優先する
+    maker_index = maker_fuzzy.new_index()
+    for key, code in maker_codes.items():
+        maker_fuzzy.add_entry(maker_index, key, (code, MAKER_MATCH_FUZZY))
+    for key, code in allocated_codes.items():
+        maker_fuzzy.add_entry(maker_index, key, (code, MAKER_MATCH_FUZZY))
+
+    return {
+        'master_data_dir': master_data_dir,
+        'maker_codes': maker_codes,
+        'allocated_maker_codes': allocated_codes,
+        'maker_index': maker_index,
+        'maker_matches': {},
+        'ocr_result_ids': read_json(os.path.join(master_data_dir, OCR_ID_MAPPING_FILE_NAME)),
+        'jgroupids': jgroupids,
+        'banks': bank_lookup.load_bank_master(os.path.join(master_data_dir, BANK_MASTER_FILE_NAME)),
+        'lock': threading.Lock(),
+    }
+
+
+def match_maker_key(master, key):
+    """
+    正規化済みの会社名 1つを (maker_com_code, 引き当て方法) にする（master['lock'] を取得して呼ぶ）
+    master.csv → 自動採番済みのコード → あいまい一致 の順に探し、どれにも無ければ ('', '')
+    あいまい一致の結果は master['maker_matches'] に残し、同じ会社名は2回目から探さない
+    """
+    if not key:
+        return '', ''
+    if key in master['maker_codes']:
+        return master['maker_codes'][key], MAKER_MATCH_MASTER
+    if key in master['allocated_maker_codes']:
+        return master['allocated_maker_codes'][key], MAKER_MATCH_ALLOCATED
+    if key not in master['maker_matches']:
+        value, _ = maker_fuzzy.find_best(master['maker_index'], key)
+        master['maker_matches'][key] = value or ('', '')
+    return master['maker_matches'][key]
+
+
+def lookup_maker_com_codes(master, maker_names, allocate=True):
+    """
+    maker_name の列から maker_com_code の列と、引き当て方法の列を返す（VLOOKUP に相当、maker_name が同じなら maker_com_code も同じ）
+    master.csv を優先し、無ければ自動採番済みのコード、それも無ければ表記ゆれとしてあいまい一致したコードを使う
+    allocate=True の場合、どれにも当たらない会社は新しく採番する
+    引き当て方法は MAKER_MATCH_MASTER / MAKER_MATCH_ALLOCATED / MAKER_MATCH_FUZZY。空の maker_name はコード・引き当て方法とも空
+    """
+    keys = normalize_keys(maker_names.fillna(''))
+    if allocate:
+        allocate_maker_com_codes(master, keys)
+    codes, uniques = pd.factorize(keys)
+    with master['lock']:
+        matches = [match_maker_key(master, key) for key in uniques]
+    maker_com_codes = pd.Series([code for code, _ in matches], dtype=object).to_numpy()
+    match_types = pd.Series([match_type for _, match_type in matches], dtype=object).to_numpy()
+    return (pd.Series(maker_com_codes[codes] if len(codes) else [], index=keys.index, dtype=object),
+            pd.Series(match_types[codes] if len(codes) else [], index=keys.index, dtype=object))
+
+
+def allocate_maker_com_codes(master, keys):
+    """
+    マスタに無く、あいまい一致もしない会社（正規化済みのキー）に「2 + 3桁連番」の maker_com_code を採番して保存する
+    （連番の桁数は MAKER_COM_CODE_DIGITS）
+    採番した会社はすぐにあいまい一致のインデックスに入れるため、同じ列にある同じ会社の表記ゆれには2つ目のコードを採番しない
+    新しく採番した件数を返す。採番は lock で排他するため、複数スレッドから呼び出してもよい
+    連番を使い切った場合は ⚠️ 警告を表示し、桁数を増やして採番を続ける（桁数の違うコードは重ならない）
+    """
+    with master['lock']:
+        allocated_codes = master['allocated_maker_codes']
+        new_keys = [key for key in pd.unique(keys) if key and not match_maker_key(master, key)[0]]
+        if not new_keys:
+            return 0
+        prefix_length = len(MAKER_COM_CODE_PREFIX)
+        next_no = max((int(code[prefix_length:]) for code in allocated_codes.values()), default=0) + 1
+        max_no = 10 ** MAKER_COM_CODE_DIGITS - 1
+        allocated_count = 0
+        for key in new_keys:
+            # 先に採番した会社とあいまい一致する場合は採番しない
+            value, _ = maker_fuzzy.find_best(master['maker_index'], key) if allocated_count else (None, 0.0)
+            if value:
+                master['maker_matches'][key] = value
+                continue
+            if next_no == max_no + 1:
+                print(f"⚠️ maker_com_code の{MAKER_COM_CODE_DIGITS}桁の連番（〜{MAKER_COM_CODE_PREFIX}{max_no}）を使い切ったため、"
+                      f"{MAKER_COM_CODE_PREFIX}{next_no} から桁数を増やして採番します（master_lookup.MAKER_COM_CODE_DIGITS）")
+            allocated_codes[key] = f"{MAKER_COM_CODE_PREFIX}{next_no:0{MAKER_COM_CODE_DIGITS}d}"
+            maker_fuzzy.add_entry(master['maker_index'], key, (allocated_codes[key], MAKER_MATCH_FUZZY))
+            next_no += 1
+            allocated_count += 1
+        # 一致しなかった結果は、今回採番した会社と一致する可能性があるため残さない
+        master['maker_matches'] = {key: value for key, value in master['maker_matches'].items() if value[0]}
+        write_json_atomic(os.path.join(master['master_data_dir'], MAKER_CODE_MAPPING_FILE_NAME), allocated_codes)
+        return allocated_count
+
+
+def allocate_ocr_result_ids(master, file_groups):
+    """
+    マッピングに存在しないファイルグループへ ocr_result_id を採番して保存する
+    既存の採番ルールに合わせ、最大値から 10 ずつ加算する（マッピングが空なら yyyymmddhhmmss + 000 から開始）
+    新しく採番したグループの一覧を返す。採番は lock で排他する
+    """
+    with master['lock']:
+        ocr_result_ids = master['ocr_result_ids']
+        new_groups = [group for group in sorted(set(file_groups)) if group not in ocr_result_ids]
+        if not new_groups:
+            return new_groups
+
+        if ocr_result_ids:
+            next_id = max(int(value) for value in ocr_result_ids.values()) + OCR_RESULT_ID_STEP
+            width = max(len(value) for value in ocr_result_ids.values())
+        else:
+            next_id = int(datetime.now().strftime('%Y%m%d%H%M%S') + '000')
+            width = len(str(next_id))
+
+        for group in new_groups:
+            ocr_result_ids[group] = str(next_id).zfill(width)
+            next_id += OCR_RESULT_ID_STEP
+        write_json_atomic(os.path.join(master['master_data_dir'], OCR_ID_MAPPING_FILE_NAME),
+                          dict(sorted(ocr_result_ids.items())))
+        return new_groups
+
+
+def lookup_ocr_result_ids(master, file_groups):
+    """ファイルグループの列から ocr_result_id の列を引き当てる（未採番のグループは空）"""
+    return file_groups.map(master['ocr_result_ids']).fillna('')
+
+
+def is_valid_jgroupid(master, values):
+    """jgroupid_string の列が jgroupid_master.csv に存在するかのマスクを返す"""
+    return values.isin(master['jgroupids'])
@@ -3,11 +3,20 @@ import os
 import re
 import shutil 
 from datetime import datetime 
-import json 
 import glob # glob モジュールは新しいロジックで必須
+import csv
+import hashlib
+
+import app_config
+import source_cache
+import pipeline_common
+import columnar_format
+import csv_copy
+import notes_schema
+import run_metrics
 
 # 設定項目
-APP_ROOT_DIR = r'C:\Users\User26\yoko\dev\csvRead'
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
 
 # 加工済みファイルがあるフォルダ
 PROCESSED_OUTPUT_BASE_DIR = os.path.join(APP_ROOT_DIR, 'processed_output') 
@@ -15,104 +24,200 @@ PROCESSED_OUTPUT_BASE_DIR = os.path.join(APP_ROOT_DIR, 'processed_output')
 MERGED_OUTPUT_BASE_DIR = os.path.join(APP_ROOT_DIR, 'merged_output') 
 # マスタデータフォルダ（ocr_id_mapping_notesReceivable.json が保存されている場所）    
 MASTER_DATA_DIR = os.path.join(APP_ROOT_DIR, 'master_data')
+# 前回結合したファイルのキャッシュ
+# 加工済みファイルごとに数値チェック済みのヘッダーなしCSV（結合用チャンク）を保存しておき、
+# 変更のないファイルは読み込み・チェックをせずにチャンクをそのまま連結する
+CACHE_FILE = os.path.join(APP_ROOT_DIR, 'cache', 'merge_cache.json')
+MERGE_CHUNK_DIR = os.path.join(APP_ROOT_DIR, 'cache', 'merged_chunks')
+# 一度に読み書きする行数（ファイル数やファイルサイズによらず、メモリ使用量はこの行数分で頭打ちになる）
+MERGE_CHUNK_ROWS = 50000
+# ファイルのチェック・チャンク作成に使うプロセス数（1 にすると1ファイルずつ順番に処理する）
+MERGE_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+# 全グループをまとめたファイルのグループ名
+ALL_GROUP_NAME = 'all'
+# 結合済みファイルの保存形式
+# 'csv': UTF-8 のヘッダーなしCSV（BOM・圧縮は MERGED_CSV_BOM / MERGED_CSV_COMPRESSION）
+# 'parquet': 数値カラムを数値型のまま保存する Parquet（pyarrow が必要。無い場合は CSV で保存する）
+# 加工済みファイルは process_data.py の PROCESSED_OUTPUT_FORMAT によらず、どちらの形式でも読み込める
+MERGED_OUTPUT_FORMAT = 'csv'
+# 結合済みCSVの先頭に BOM を付けるか（COPY では不要。Excel で開いて確認する場合は True にする）
+MERGED_CSV_BOM = False
+# 結合済みCSVの圧縮形式（None: 圧縮しない / 'gzip' / 'zstd'（pyarrow が必要））
+# 圧縮したファイル（*_merged.csv.gz など）も insert_to_postgres.py がそのまま読み込む
+MERGED_CSV_COMPRESSION = None
+
+app_config.apply(globals())
+# 加工済みファイル名のパターン（例: B000001_2.jpg_020_processed.csv → グループ B000001, ページ 2）
+PROCESSED_FILE_PATTERN = re.compile(r'^(B\d+)_(\d+)\..*_processed\.(?:csv|parquet)$', re.IGNORECASE)
+
+# notes_receivable のカラム順（カラム定義は notes_schema.py に一本化している）
+FINAL_POSTGRE_COLUMNS = notes_schema.COLUMN_NAMES
+
+def parse_processed_file_name(filename):
+    """
+    加工済みファイル名からファイルグループとページ番号を取り出す
+    例: B000001_2.jpg_020_processed.csv → ('B000001', 2)
+    パターンに合致しない場合は (None, None) を返す
+    """
+    match = PROCESSED_FILE_PATTERN.match(os.path.basename(filename))
+    if not match:
+        return None, None
+    return match.group(1).upper(), int(match.group(2))
+
+
+def validate_header(file_path):
+    """
+    加工済みファイルのヘッダー行だけを読み、FINAL_POSTGRE_COLUMNS と照合する
+    問題がなければ None、あればその内容（文字列）を返す
+    """
+    if columnar_format.is_parquet_file(file_path):
+        actual_cols = columnar_format.read_column_names(file_path)
+    else:
+        with open(file_path, 'r', encoding='utf-8-sig', newline='') as f:
+            actual_cols = next(csv.reader(f), [])
+    if len(actual_cols) != len(FINAL_POSTGRE_COLUMNS):
+        return f"列数が想定と異なります（{len(actual_cols)}列 vs 期待 {len(FINAL_POSTGRE_COLUMNS)}列）"
+    # 列名に重複がないかチェック（もしあればPandasが自動で.1などを付与するため、ここでチェック）
+    if len(set(actual_cols)) != len(actual_cols):
+        return f"重複する列名が検出されました → {actual_cols}"
+    missing_cols = [col for col in FINAL_POSTGRE_COLUMNS if col not in actual_cols]
+    if missing_cols:
+        return f"想定する列がありません → {missing_cols}"
+    return None
+
+
+def iter_processed_chunks(file_path, invalid_counts=None):
+    """
+    加工済みファイルを MERGE_CHUNK_ROWS 行ずつ、FINAL_POSTGRE_COLUMNS の順に並べて返す
+    CSV は文字列として読み、数値チェック後の DataFrame を返す（数値として無効だった件数は invalid_counts に列ごとに加算する）
+    Parquet は型付きで保存されているため、数値チェックをせずに Arrow テーブルのまま返す
+    """
+    if columnar_format.is_parquet_file(file_path):
+        yield from columnar_format.iter_parquet_tables(file_path, FINAL_POSTGRE_COLUMNS, MERGE_CHUNK_ROWS)
+        return
+    reader = pd.read_csv(file_path, encoding='utf-8-sig', dtype=str, header=0, na_values=['〃'],
+                         keep_default_na=False, chunksize=MERGE_CHUNK_ROWS)
+    for df_chunk in reader:
+        # 列の物理的な順序がずれていても、FINAL_POSTGRE_COLUMNS の順に並べ替える
+        df_chunk = df_chunk.reindex(columns=FINAL_POSTGRE_COLUMNS).fillna('')
+        # balance* / conf_* / coord_* 列の数値チェック（保存前に列単位でまとめて整形）
+        yield pipeline_common.clean_numeric_columns(df_chunk, invalid_counts)
+
+
+def write_merge_chunk(file_path, chunk_path, invalid_counts=None):
+    """
+    加工済みファイルを MERGE_CHUNK_ROWS 行ずつ読み、チャンクファイルへ追記する。書き込んだ行数を返す
+    チャンクファイルの拡張子が .parquet の場合は型付きの Parquet、それ以外はヘッダーなしCSVで保存する
+    """
+    row_count = 0
+    if columnar_format.is_parquet_file(chunk_path) and columnar_format.is_parquet_file(file_path):
+        # 加工済みファイルが既に型付きの Parquet なので、読み込まずにそのままチャンクとして使う
+        # （列の順序は読み込み時に FINAL_POSTGRE_COLUMNS に揃える）
+        shutil.copyfile(file_path, chunk_path)
+        return columnar_format.count_rows(chunk_path)
+    if columnar_format.is_parquet_file(chunk_path):
+        with columnar_format.open_parquet_writer(chunk_path, FINAL_POSTGRE_COLUMNS) as writer:
+            for chunk in iter_processed_chunks(file_path, invalid_counts):
+                if isinstance(chunk, pd.DataFrame):
+                    chunk = columnar_format.to_arrow_table(chunk, FINAL_POSTGRE_COLUMNS)
+                writer.write_table(chunk)
+                row_count += chunk.num_rows
+        return row_count
+
+    with open(chunk_path, 'wb') as out:
+        for chunk in iter_processed_chunks(file_path, invalid_counts):
+            # ヘッダーなしで保存 (PostgreSQL COPYコマンド向け)。改行は to_csv と同じ os.linesep
+            if isinstance(chunk, pd.DataFrame):
+                for block in csv_copy.iter_frame_blocks(chunk, line_terminator=os.linesep):
+                    out.write(block)
+                row_count += len(chunk)
+            else:
+                out.write(columnar_format.table_to_copy_text(chunk).encode('utf-8'))
+                row_count += chunk.num_rows
+    return row_count
+
 
-# このリストは process_data.py の FINAL_POSTGRE_COLUMNS と完全に一致している必要がある
-FINAL_POSTGRE_COLUMNS = [
-    'ocr_result_id',
-    'page_no',
-    'id',
-    'jgroupid_string',
-    'cif_number',
-    'settlement_at',
-    'registration_number_original',
-    'registration_number',
-    'maker_name_original',
-    'maker_name',
-    'maker_com_code',
-    'maker_com_code_status_id',
-    'maker_comcd_relation_source_type_id',
-    'maker_exist_comcd_relation_history_id',
-    'issue_date_original',
-    'issue_date',
-    'due_date_original',
-    'due_date',
-    'paying_bank_name_original',
-    'paying_bank_name',
-    'paying_bank_code',
-    'paying_bank_branch_name_original',
-    'paying_bank_branch_name',
-    'balance_original',
-    'balance',
-    'discount_bank_name_original',
-    'discount_bank_name',
-    'discount_bank_code',
-    'description_original',
-    'description',
-    'conf_registration_number',
-    'conf_maker_name',
-    'conf_issue_date',
-    'conf_due_date',
-    'conf_balance',
-    'conf_paying_bank_name',
-    'conf_paying_bank_branch_name',
-    'conf_discount_bank_name',
-    'conf_description',
-    'coord_x_registration_number',
-    'coord_y_registration_number',
-    'coord_h_registration_number',
-    'coord_w_registration_number',
-    'coord_x_maker_name',
-    'coord_y_maker_name',
-    'coord_h_maker_name',
-    'coord_w_maker_name',
-    'coord_x_issue_date',
-    'coord_y_issue_date',
-    'coord_h_issue_date',
-    'coord_w_issue_date',
-    'coord_x_due_date',
-    'coord_y_due_date',
-    'coord_h_due_date',
-    'coord_w_due_date',
-    'coord_x_balance',
-    'coord_y_balance',
-    'coord_h_balance',
-    'coord_w_balance',
-    'coord_x_paying_bank_name',
-    'coord_y_paying_bank_name',
-    'coord_h_paying_bank_name',
-    'coord_w_paying_bank_name',
-    'coord_x_paying_bank_branch_name',
-    'coord_y_paying_bank_branch_name',
-    'coord_h_paying_bank_branch_name',
-    'coord_w_paying_bank_branch_name',
-    'coord_x_discount_bank_name',
-    'coord_y_discount_bank_name',
-    'coord_h_discount_bank_name',
-    'coord_w_discount_bank_name',
-    'coord_x_description',
-    'coord_y_description',
-    'coord_h_description',
-    'coord_w_description',
-    'row_no',
-    'insertdatetime',
-    'updatedatetime',
-    'updateuser'             
-]
-
-# 金額っぽい値かを判定する関数
-def is_money(value: str) -> bool:
-    """金額っぽい値（数字のみまたはカンマ区切り）かを判定"""
-    if isinstance(value, str):
-        # カンマ、円マークなどを除去してから判定
-        value = value.replace(",", "").replace("¥", "").replace("￥", "").replace("円", "").strip()
-    # 3桁以上の数字、または小数点を含む数字、または符号付き数字を金額と判定
-    return re.fullmatch(r"^[+-]?\d{1,}(\.\d+)?$", str(value)) is not None 
+def build_merge_chunk(item):
+    """
+    (加工済みファイル, チャンクファイル) を受け取り、ヘッダーの確認とチャンクの作成を行う（プロセスプールから呼ばれる）
+    (チャンクファイル, ヘッダーの問題 or None, 行数, 数値として無効だった件数) を返す
+    ヘッダーに問題がある場合や空の場合は、前回のチャンクが残っていれば削除する
+    """
+    file_path, chunk_path = item
+    invalid_counts = {}
+    header_error = validate_header(file_path)
+    row_count = 0 if header_error else write_merge_chunk(file_path, chunk_path, invalid_counts)
+    if row_count == 0 and os.path.exists(chunk_path):
+        os.remove(chunk_path)
+    return chunk_path, header_error, row_count, invalid_counts
+
+
+def write_group_rows(chunk_paths, group_out, all_out):
+    """
+    ファイルグループのチャンクをページ順に1行ずつ読み、id をグループ全体の連番に振り直して
+    グループのファイルと all グループのファイルの両方に追記する。書き込んだ行数を返す
+    """
+    # 行を書き換えるのは id だけなので、pandas を通さず csv モジュールで1行ずつ流す
+    # （csv_copy.py のチャンクも csv.writer と同じ引用符の規則で書いているため、出力は同じになる）
+    id_index = FINAL_POSTGRE_COLUMNS.index('id')
+    group_writer = csv.writer(group_out, lineterminator=os.linesep)
+    all_writer = csv.writer(all_out, lineterminator=os.linesep)
+    next_id = 1
+    for chunk_path in chunk_paths:
+        with open(chunk_path, 'r', encoding='utf-8', newline='') as chunk:
+            for row in csv.reader(chunk):
+                row[id_index] = str(next_id)
+                next_id += 1
+                group_writer.writerow(row)
+                all_writer.writerow(row)
+    return next_id - 1
+
+
+def write_group_table(chunk_paths, group_file_path):
+    """
+    write_group_rows() の Parquet 版。グループのチャンク（Parquet）をページ順に連結し、
+    id をグループ全体の連番に振り直してグループのファイルに保存する。保存したテーブルを返す（all グループ用）
+    """
+    table = columnar_format.concat_tables(
+        [columnar_format.read_table(chunk_path, FINAL_POSTGRE_COLUMNS) for chunk_path in chunk_paths])
+    ids = columnar_format.pa.array(range(1, table.num_rows + 1), type=columnar_format.pa.int32())
+    table = table.set_column(FINAL_POSTGRE_COLUMNS.index('id'), 'id', ids)
+    columnar_format.write_table(table, group_file_path)
+    return table
+
+
+def write_all_group_parquet(group_chunk_paths, dirty_groups, all_output_file_path):
+    """
+    グループごとに、変更があれば作り直し、無ければ前回のファイルを読み込んで all グループのファイルに追記する
+    all グループのファイルには MERGE_CHUNK_ROWS 行ずつまとめて書き込む（ページごとの小さな行グループを作らない）
+    作り直したグループ数を返す
+    """
+    rebuilt_count = 0
+    pending_tables = []
+    pending_rows = 0
+    with columnar_format.open_parquet_writer(all_output_file_path, FINAL_POSTGRE_COLUMNS) as all_writer:
+        for group in sorted(group_chunk_paths):
+            group_file_path = os.path.join(MERGED_OUTPUT_BASE_DIR, f'{group}_merged.parquet')
+            if group in dirty_groups:
+                table = write_group_table(group_chunk_paths[group], group_file_path)
+                rebuilt_count += 1
+            else:
+                table = columnar_format.read_table(group_file_path, FINAL_POSTGRE_COLUMNS)
+            pending_tables.append(table)
+            pending_rows += table.num_rows
+            if pending_rows >= MERGE_CHUNK_ROWS:
+                all_writer.write_table(columnar_format.concat_tables(pending_tables))
+                pending_tables, pending_rows = [], 0
+        if pending_tables:
+            all_writer.write_table(columnar_format.concat_tables(pending_tables))
+    return rebuilt_count
 
 
 def merge_processed_csv_files():
     """
     processed_output フォルダ内の加工済みCSVファイルをファイルグループごとに結合し、
     merged_output フォルダに保存する関数。
+    ファイルは MERGE_CHUNK_ROWS 行ずつ読み書きするため、ファイル数が増えてもメモリ使用量は一定
     """
     print(f"--- ファイルグループごとの結合処理開始 ({datetime.now()}) ---")
     print(f"加工済みファイルフォルダ: {PROCESSED_OUTPUT_BASE_DIR}")
@@ -120,11 +225,9 @@ def merge_processed_csv_files():
 
     os.makedirs(MERGED_OUTPUT_BASE_DIR, exist_ok=True)
 
-    # ★★★ お客様の新しいマージロジックを全面的に採用 ★★★
-    all_data_frames = [] # 各ファイルのデータ部分（ヘッダーなし）を格納するリスト
-
-    # 対象ファイルをすべて取得 (recursive=True でサブディレクトリも検索)
-    csv_files_to_merge = glob.glob(os.path.join(PROCESSED_OUTPUT_BASE_DIR, '**', '*_processed.csv'), recursive=True)
+    # 対象ファイルをすべて取得 (recursive=True でサブディレクトリも検索、CSV・Parquet のどちらも対象)
+    csv_files_to_merge = [file_path for extension in columnar_format.FILE_EXTENSIONS.values()
+                          for file_path in glob.glob(os.path.join(PROCESSED_OUTPUT_BASE_DIR, '**', f'*_processed{extension}'), recursive=True)]
 
     if not csv_files_to_merge:
         print("⚠️ 警告: マージ対象のファイルが見つかりませんでした。")
@@ -132,103 +235,154 @@ def merge_processed_csv_files():
         print(f"🎉 結合されたファイルグループ数: 0 🎉")
         return
 
-    # グループ名は「all」にする（お客様の指示）
-    group_name = 'all'
-    output_file_path = os.path.join(MERGED_OUTPUT_BASE_DIR, f'{group_name}_merged.csv')
-
-    print(f"  → 全てのファイルを結合し、'{group_name}' グループとして保存します。")
-
-    for file_path in sorted(csv_files_to_merge): # ファイルパスをソートして結合順を保証
-        try:
-            # 1行目をヘッダーとしてスキップし、データ部分のみを読み込む
-            # df = pd.read_csv(file, header=None, skiprows=1) # お客様のコード案
-            # pandasのread_csvはheader=0でヘッダーを読み込み、それ以外の行がデータとなる
-            # なので、skiprows=1 を指定すると、実際のヘッダー行をスキップして、次の行をヘッダーとして誤認識してしまう
-            # 正しいヘッダー付きファイルとして読み込み、その後必要に応じて調整する
-            df_current_file = pd.read_csv(file_path, encoding='utf-8-sig', dtype=str, header=0, na_values=['〃'], keep_default_na=False)
-            
-            if df_current_file.empty: 
-                print(f"    ℹ️ {os.path.basename(file_path)} は空のためスキップします。")
-                continue
+    # ファイル名からファイルグループ（例: B000001）とページ番号を取り出し、グループごとにページ順で並べる
+    file_groups = {}
+    for file_path in csv_files_to_merge:
+        group, page = parse_processed_file_name(file_path)
+        if group is None:
+            run_metrics.file_message('unexpected_file_name', f"    ⚠️ 警告: ファイル名からファイルグループを判定できないためスキップします: {os.path.basename(file_path)}")
+            continue
+        file_groups.setdefault(group, []).append((page, file_path))
+    for group in file_groups:
+        file_groups[group].sort()
 
-            # デバッグ情報: 読み込み直後のカラム数と一覧
-            actual_cols = df_current_file.columns.tolist()
-            print(f"    📄 ファイル {os.path.basename(file_path)} 読み込み直後のカラム数: {len(actual_cols)}")
-            print(f"    🧩 ファイル {os.path.basename(file_path)} 読み込み直後のカラム一覧: {actual_cols}")
+    # 結合済みファイル・チャンクの形式（Parquet の場合はチャンクも Parquet にし、文字列に戻さずに結合する）
+    merged_format = columnar_format.resolve_format(MERGED_OUTPUT_FORMAT)
+    # 結合用チャンクは圧縮しない（キャッシュとして読み書きするだけのため）。結合済みCSVは MERGED_CSV_COMPRESSION で圧縮する
+    chunk_extension = columnar_format.FILE_EXTENSIONS[merged_format]
+    compression = csv_copy.resolve_compression(MERGED_CSV_COMPRESSION) if merged_format == columnar_format.CSV_FORMAT else None
+    extension = csv_copy.csv_extension(compression) if merged_format == columnar_format.CSV_FORMAT else chunk_extension
+    # 形式・圧縮形式を切り替えた場合、古い形式の結合済みファイルを残すと DB 登録で二重に読み込まれるため削除する
+    columnar_format.remove_other_format_files(MERGED_OUTPUT_BASE_DIR, '_merged', merged_format)
+    csv_copy.remove_other_csv_files(MERGED_OUTPUT_BASE_DIR, '_merged', extension)
 
-            # 想定される最終カラム数と一致するかを厳密にチェック
-            if len(actual_cols) != len(FINAL_POSTGRE_COLUMNS):
-                print(f"    ⚠️ 警告: ファイル {os.path.basename(file_path)} の列数が想定と異なります（{len(actual_cols)}列 vs 期待 {len(FINAL_POSTGRE_COLUMNS)}列）。このファイルはスキップされます。")
-                continue # 列数が一致しない場合はスキップ
+    # 全グループをまとめたファイル（お客様の指示で「all」グループ）
+    all_output_file_path = os.path.join(MERGED_OUTPUT_BASE_DIR, f'{ALL_GROUP_NAME}_merged{extension}')
 
-            # 列名に重複がないかチェック（もしあればPandasが自動で.1などを付与するため、ここでチェック）
-            if len(set(actual_cols)) != len(actual_cols):
-                print(f"    ⚠️ 警告: ファイル {os.path.basename(file_path)} で重複する列名が検出されました → {actual_cols}。このファイルはスキップされます。")
-                continue # 列名に重複がある場合もスキップ
+    # 削除された加工済みファイルのチャンクは除去し、そのファイルのグループは作り直す
+    os.makedirs(MERGE_CHUNK_DIR, exist_ok=True)
+    cache = source_cache.load_cache(CACHE_FILE)
+    existing_keys = {source_cache.cache_key(path) for path in csv_files_to_merge}
+    dirty_groups = {parse_processed_file_name(key)[0] for key in cache if key not in existing_keys}
+    evicted_count = source_cache.evict_missing(cache, csv_files_to_merge)
 
-            # ここでdf_current_fileのカラム名をFINAL_POSTGRE_COLUMNSに強制的に設定
-            # これにより、df_current_fileの物理的なデータとFINAL_POSTGRE_COLUMNSの名前が正しく紐づきます。
-            # もし物理的な順序がずれていれば、データは正しいカラムに流れ込む
-            df_current_file = df_current_file.reindex(columns=FINAL_POSTGRE_COLUMNS).fillna('')
+    # 1. ファイルごとにヘッダーを確認し、数値チェック済みのチャンクを作る（変更のないファイルは前回のチャンクを再利用）
+    #    変更のあったファイルはプロセスプールで並列に処理し、結果はグループ・ページ順に取り出す
+    changed_items = []
+    for group in sorted(file_groups):
+        for page, file_path in file_groups[group]:
+            cached_chunk_path = source_cache.cached_output(cache, file_path)
+            if (not source_cache.is_unchanged(cache, file_path)
+                    or (cached_chunk_path and not cached_chunk_path.endswith(chunk_extension))):
+                chunk_name = hashlib.sha1(source_cache.cache_key(file_path).encode('utf-8')).hexdigest() + chunk_extension
+                changed_items.append((file_path, os.path.join(MERGE_CHUNK_DIR, chunk_name)))
+                dirty_groups.add(group)
+    changed_count = len(changed_items)
+    with run_metrics.stage('merge_chunk'):
+        chunk_results = dict(zip([file_path for file_path, _ in changed_items],
+                                 pipeline_common.map_in_processes(build_merge_chunk, changed_items, MERGE_WORKERS,
+                                                               timer_stage='merge_chunk')))
 
+    group_chunk_paths = {}
+    invalid_counts = {}
+    for group in sorted(file_groups):
+        chunk_paths = []
+        for page, file_path in file_groups[group]:
+            if file_path not in chunk_results:
+                chunk_path = source_cache.cached_output(cache, file_path)
+                if chunk_path:
+                    chunk_paths.append(chunk_path)
+                continue # 前回スキップしたファイルは今回もスキップ
 
-            # OCR IDやCIFなどのID情報の強制上書きは、process_data.pyで既に処理されているため、ここでは行わない
-            # process_data.py が出力した _processed.csv の ID 情報は信頼する
-            
-            # balance列の金額チェック（保存前に整形）
-            # is_money関数を使用して、金額として有効な値のみを保持する
-            for col in ['balance_original', 'balance']:
-                if col in df_current_file.columns:
-                    df_current_file[col] = df_current_file[col].apply(lambda x: x if is_money(x) else "")
+            result, error = chunk_results[file_path]
+            if error:
+                pipeline_common.print_worker_error(f"  ❌ エラー: ファイル {os.path.basename(file_path)} の読み込み/処理中に問題が発生しました。エラー: {error[0]}", error[1])
+                continue
+            chunk_path, header_error, row_count, file_invalid_counts = result
+            if header_error:
+                run_metrics.file_message('header_error', f"    ⚠️ 警告: ファイル {os.path.basename(file_path)} の{header_error}。このファイルはスキップされます。")
+                source_cache.record_file(cache, file_path)
+                continue
+            if row_count == 0:
+                run_metrics.file_message('empty_file', f"    ℹ️ {os.path.basename(file_path)} は空のためスキップします。")
+                source_cache.record_file(cache, file_path)
+                continue
+            for col, count in file_invalid_counts.items():
+                invalid_counts[col] = invalid_counts.get(col, 0) + count
+            run_metrics.count('merge_chunk_rows', row_count)
+            source_cache.record_file(cache, file_path, chunk_path)
+            chunk_paths.append(chunk_path)
+        if chunk_paths:
+            group_chunk_paths[group] = chunk_paths
 
+    source_cache.save_cache(CACHE_FILE, cache)
 
-            all_data_frames.append(df_current_file)
-            print(f"    - {os.path.basename(file_path)} のデータを結合リストに追加しました。")
+    if invalid_counts:
+        print(f"  ⚠️ 警告: 数値として解釈できないため空にした値があります → {invalid_counts}")
 
-        except Exception as e:
-            print(f"  ❌ エラー: ファイル {os.path.basename(file_path)} の読み込み/処理中に問題が発生しました。エラー: {e}")
-            import traceback 
-            traceback.print_exc() 
+    # 有効なデータがなくなったグループのファイルは削除する
+    for group in dirty_groups - set(group_chunk_paths):
+        stale_file_path = os.path.join(MERGED_OUTPUT_BASE_DIR, f'{group}_merged{extension}')
+        if group and os.path.exists(stale_file_path):
+            os.remove(stale_file_path)
 
-    if not all_data_frames:
+    if not group_chunk_paths:
         print("⚠️ 警告: 結合対象の有効なデータが見つからなかったため、マージは行われません。")
         print(f"\n--- ファイルグループごとの結合処理完了 ({datetime.now()}) ---")
         print(f"🎉 結合されたファイルグループ数: 0 🎉")
         return
 
-    # 全てのデータフレームを結合
-    merged_df = pd.concat(all_data_frames, ignore_index=True)
-    
-    # 最終結合DataFrameのカラムチェック（念のため）
-    if list(merged_df.columns) != FINAL_POSTGRE_COLUMNS:
-        print("❗ 最終結合DataFrameのカラム順が想定と異なります。再インデックスします。")
-        merged_df = merged_df.reindex(columns=FINAL_POSTGRE_COLUMNS).fillna('')
-    
-    # 最終的な金額列のチェックとクリーンアップ（この段階で最後の保証）
-    for col in ['balance_original', 'balance']:
-        if col in merged_df.columns:
-            merged_df[col] = merged_df[col].apply(lambda x: x if is_money(x) else "")
-    print(f"  ℹ️ 最終マージ済みDataFrameの'balance_original'と'balance'カラムの金額チェックとクリーンアップを行いました。")
-
-
-    # 結合されたDataFrameを保存
+    # 出力ファイルが無くなっているグループも作り直す
+    for group in group_chunk_paths:
+        if not os.path.exists(os.path.join(MERGED_OUTPUT_BASE_DIR, f'{group}_merged{extension}')):
+            dirty_groups.add(group)
+
+    if changed_count == 0 and evicted_count == 0 and not dirty_groups and os.path.exists(all_output_file_path):
+        print(f"  ⏭️ 加工済みファイルに変更がないため、結合をスキップしました。→ {all_output_file_path}")
+        return
+
+    print(f"  ℹ️ 読み込み・数値チェックを行ったファイル数: {changed_count} / 前回の結果を再利用したファイル数: {len(csv_files_to_merge) - changed_count}")
+    print(f"  → ファイルグループごとに結合し、全グループをまとめたファイルを '{ALL_GROUP_NAME}' グループとして保存します。")
+
+    # 2. グループごとに、変更があれば作り直し、無ければ前回のファイルをそのまま all グループに連結する
+    #    どちらも行単位で順に書き出すだけなので、全データをメモリに載せることはない
+    rebuilt_count = 0
     try:
-        # header=False で保存 (PostgreSQL COPYコマンド向け)
-        merged_df.to_csv(output_file_path, index=False, header=False, encoding='utf-8-sig')
-        print(f"✅ 全てマージ完了！→ {output_file_path}")
+        with run_metrics.stage('merge'):
+            if merged_format == columnar_format.PARQUET_FORMAT:
+                rebuilt_count = write_all_group_parquet(group_chunk_paths, dirty_groups, all_output_file_path)
+            else:
+                # ヘッダーなしで保存 (PostgreSQL COPYコマンド向け)。BOM・圧縮は MERGED_CSV_BOM / MERGED_CSV_COMPRESSION による
+                with csv_copy.open_text_output(all_output_file_path, compression, MERGED_CSV_BOM) as all_out:
+                    for group in sorted(group_chunk_paths):
+                        group_file_path = os.path.join(MERGED_OUTPUT_BASE_DIR, f'{group}_merged{extension}')
+                        if group in dirty_groups:
+                            with csv_copy.open_text_output(group_file_path, compression, MERGED_CSV_BOM) as group_out:
+                                write_group_rows(group_chunk_paths[group], group_out, all_out)
+                            rebuilt_count += 1
+                        else:
+                            # BOM は読み込み時に除く（all グループのファイルの途中に入れない）
+                            with csv_copy.open_text_input(group_file_path) as group_in:
+                                shutil.copyfileobj(group_in, all_out)
+        print(f"✅ 全てマージ完了！→ {all_output_file_path}")
     except Exception as e:
-        print(f"❌ エラー: マージ済みファイル '{output_file_path}' の保存中に問題が発生しました。エラー: {e}")
+        print(f"❌ エラー: マージ済みファイル '{all_output_file_path}' の保存中に問題が発生しました。エラー: {e}")
         import traceback
         traceback.print_exc()
 
 
     print(f"\n--- ファイルグループごとの結合処理完了 ({datetime.now()}) ---")
-    print(f"🎉 結合されたファイルグループ数: 1 (allグループ) 🎉") # グループはall一つなので常に1
+    print(f"🎉 結合されたファイルグループ数: {len(group_chunk_paths)} (うち作り直したグループ: {rebuilt_count}) + allグループ 🎉")
     print(f"\n🎉 全ての結合処理が完了しました！ ({datetime.now()}) 🎉")
 
 # --- メイン処理 ---
-if __name__ == "__main__":
+def main():
     print(f"--- 結合処理スクリプト開始: {datetime.now()} ---")
+    run_metrics.start_run('merge_processed_csv')
     merge_processed_csv_files()
+    run_metrics.finish_run()
     print(f"\n🎉 全ての結合処理が完了しました！ ({datetime.now()}) 🎉")
+
+if __name__ == "__main__":
+    main()
     
\ No newline at end of file
@@ -0,0 +1,76 @@
+import re
+
+# notes_receivable のパーティション分割（PostgreSQL の宣言的パーティション）の定義
+# insert_to_postgres.py の PARTITION_BY / PARTITION_COUNT / PARTITION_BOUNDS から、パーティションごとの
+# (名前の接尾辞, FOR VALUES 句, ATTACH PARTITION 時の行の検証を省くための CHECK 制約の条件) を作る
+#
+#   'cif_hash':      cif_number のハッシュで PARTITION_COUNT 個に分割（MODULUS = PARTITION_COUNT）
+#   'cif_range':     cif_number の範囲で分割（PARTITION_BOUNDS の境界で区切り、先頭・末尾は MINVALUE・MAXVALUE まで）
+#   'settlement_at': settlement_at（YYYYMM）の範囲で分割（同上）
+#
+# 範囲で分割する場合は、どの範囲にも入らない値（NULL）用のデフォルトパーティションも作る
+# ハッシュ分割の CHECK 制約は書けないため、ATTACH PARTITION の際に PostgreSQL が行を検証する（パーティションを1回読む）
+# パーティションのキーは主キーに含める必要があるため、主キーは (ocr_result_id, page_no, id, キーのカラム) になる
+# （cif_number は ocr_result_id ごとに1つに決まる。settlement_at は登録した月のため、別の月に登録し直した行は
+#   incremental のロードで「今回のデータに無い行」として削除されてから登録される）
+
+# PARTITION_BY → (分割方法, キーのカラム)
+PARTITION_KEYS = {
+    'cif_hash': ('HASH', 'cif_number'),
+    'cif_range': ('RANGE', 'cif_number'),
+    'settlement_at': ('RANGE', 'settlement_at'),
+}
+DEFAULT_PARTITION_SUFFIX = 'pdefault'
+BOUND_PATTERN = re.compile(r'^[0-9A-Za-z]+$')
+
+
+def partition_key(partition_by):
+    """PARTITION_BY の値から (分割方法, キーのカラム) を返す"""
+    if partition_by not in PARTITION_KEYS:
+        raise ValueError(f"PARTITION_BY は None か {list(PARTITION_KEYS)} のいずれかを指定してください: {partition_by!r}")
+    return PARTITION_KEYS[partition_by]
+
+
+def key_definition(partition_by):
+    """PARTITION BY 句の中身（pg_get_partkeydef() と同じ形。例: 'HASH (cif_number)'）"""
+    strategy, column = partition_key(partition_by)
+    return f"{strategy} ({column})"
+
+
+def key_columns(base_columns, partition_by):
+    """主キーのカラム（分割する場合は、base_columns にキーのカラムを加える）"""
+    if not partition_by:
+        return list(base_columns)
+    _, column = partition_key(partition_by)
+    return list(base_columns) + ([column] if column not in base_columns else [])
+
+
+def partition_specs(partition_by, count, bounds):
+    """パーティションごとの (名前の接尾辞, FOR VALUES 句, CHECK 制約の条件（無ければ None）) のリスト"""
+    strategy, column = partition_key(partition_by)
+    if strategy == 'HASH':
+        if count < 1:
+            raise ValueError(f"PARTITION_COUNT は 1 以上を指定してください: {count}")
+        return [(f'p{remainder}', f'FOR VALUES WITH (MODULUS {count}, REMAINDER {remainder})', None)
+                for remainder in range(count)]
+
+    bounds = [str(bound) for bound in bounds]
+    # 境界はパーティション名・SQL の値に使うため、英数字だけを許す
+    invalid = [bound for bound in bounds if not BOUND_PATTERN.match(bound)]
+    if invalid:
+        raise ValueError(f"PARTITION_BOUNDS には英数字だけの値を指定してください: {invalid}")
+    if bounds != sorted(set(bounds)):
+        raise ValueError(f"PARTITION_BOUNDS は重複の無い昇順で指定してください: {bounds}")
+
+    edges = [None, *bounds, None]
+    specs = []
+    for number, (lower, upper) in enumerate(zip(edges, edges[1:])):
+        conditions = [f"{column} IS NOT NULL"]
+        if lower is not None:
+            conditions.append(f"{column} >= '{lower}'")
+        if upper is not None:
+            conditions.append(f"{column} < '{upper}'")
+        bound = f"FOR VALUES FROM ({'MINVALUE' if lower is None else repr(lower)}) TO ({'MAXVALUE' if upper is None else repr(upper)})"
+        specs.append((f'p{number}', bound, ' AND '.join(conditions)))
+    specs.append((DEFAULT_PARTITION_SUFFIX, 'DEFAULT', None))
+    return specs
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+
+# notes_receivable の1行のカラム定義
+# 加工（process_data.py）・結合（merge_processed_csv.py）・Parquet（columnar_format.py）・DB登録（insert_to_postgres.py）は
+# 全てこの定義のカラム順・型を使う（カラムを追加・変更する場合はここだけを直す）
+
+# (カラム名, DB側の型)。並び順がテーブル・加工済みファイル・結合済みファイルのカラム順になる
+NOTES_COLUMN_DEFINITIONS = [
+    ('ocr_result_id',                          'CHAR(18) NOT NULL'),
+    ('page_no',                                'INTEGER NOT NULL'),
+    ('id',                                     'INTEGER NOT NULL'),
+    ('jgroupid_string',                        'VARCHAR(3)'),
+    ('cif_number',                             'VARCHAR(7)'),
+    ('settlement_at',                          'VARCHAR(6)'),
+    ('registration_number_original',           'TEXT'),
+    ('registration_number',                    'TEXT'),
+    ('maker_name_original',                    'TEXT'),
+    ('maker_name',                             'TEXT'),
+    ('maker_com_code',                         'TEXT'),
+    ('maker_com_code_status_id',               'INTEGER'),
+    ('maker_comcd_relation_source_type_id',    'INTEGER'),
+    ('maker_exist_comcd_relation_history_id',  'INTEGER'),
+    ('issue_date_original',                    'TEXT'),
+    ('issue_date',                             'TEXT'),
+    ('due_date_original',                      'TEXT'),
+    ('due_date',                               'TEXT'),
+    ('paying_bank_name_original',              'TEXT'),
+    ('paying_bank_name',                       'TEXT'),
+    ('paying_bank_code',                       'TEXT'),
+    ('paying_bank_branch_name_original',       'TEXT'),
+    ('paying_bank_branch_name',                'TEXT'),
+    ('balance_original',                       'NUMERIC'),
+    ('balance',                                'NUMERIC'),
+    ('discount_bank_name_original',            'TEXT'),
+    ('discount_bank_name',                     'TEXT'),
+    ('discount_bank_code',                     'TEXT'),
+    ('description_original',                   'TEXT'),
+    ('description',                            'TEXT'),
+    ('conf_registration_number',               'INTEGER'),
+    ('conf_maker_name',                        'INTEGER'),
+    ('conf_issue_date',                        'INTEGER'),
+    ('conf_due_date',                          'INTEGER'),
+    ('conf_balance',                           'INTEGER'),
+    ('conf_paying_bank_name',                  'INTEGER'),
+    ('conf_paying_bank_branch_name',           'INTEGER'),
+    ('conf_discount_bank_name',                'INTEGER'),
+    ('conf_description',                       'INTEGER'),
+    ('coord_x_registration_number',            'NUMERIC'),
+    ('coord_y_registration_number',            'NUMERIC'),
+    ('coord_h_registration_number',            'NUMERIC'),
+    ('coord_w_registration_number',            'NUMERIC'),
+    ('coord_x_maker_name',                     'NUMERIC'),
+    ('coord_y_maker_name',                     'NUMERIC'),
+    ('coord_h_maker_name',                     'NUMERIC'),
+    ('coord_w_maker_name',                     'NUMERIC'),
+    ('coord_x_issue_date',                     'NUMERIC'),
+    ('coord_y_issue_date',                     'NUMERIC'),
+    ('coord_h_issue_date',                     'NUMERIC'),
+    ('coord_w_issue_date',                     'NUMERIC'),
+    ('coord_x_due_date',                       'NUMERIC'),
+    ('coord_y_due_date',                       'NUMERIC'),
+    ('coord_h_due_date',                       'NUMERIC'),
+    ('coord_w_due_date',                       'NUMERIC'),
+    ('coord_x_balance',                        'NUMERIC'),
+    ('coord_y_balance',                        'NUMERIC'),
+    ('coord_h_balance',                        'NUMERIC'),
+    ('coord_w_balance',                        'NUMERIC'),
+    ('coord_x_paying_bank_name',               'NUMERIC'),
+    ('coord_y_paying_bank_name',               'NUMERIC'),
+    ('coord_h_paying_bank_name',               'NUMERIC'),
+    ('coord_w_paying_bank_name',               'NUMERIC'),
+    ('coord_x_paying_bank_branch_name',        'NUMERIC'),
+    ('coord_y_paying_bank_branch_name',        'NUMERIC'),
+    ('coord_h_paying_bank_branch_name',        'NUMERIC'),
+    ('coord_w_paying_bank_branch_name',        'NUMERIC'),
+    ('coord_x_discount_bank_name',             'NUMERIC'),
+    ('coord_y_discount_bank_name',             'NUMERIC'),
+    ('coord_h_discount_bank_name',             'NUMERIC'),
+    ('coord_w_discount_bank_name',             'NUMERIC'),
+    ('coord_x_description',                    'NUMERIC'),
+    ('coord_y_description',                    'NUMERIC'),
+    ('coord_h_description',                    'NUMERIC'),
+    ('coord_w_description',                    'NUMERIC'),
+    ('row_no',                                 'SMALLINT'),
+    ('insertdatetime',                         'TIMESTAMP'),
+    ('updatedatetime',                         'TIMESTAMP'),
+    ('updateuser',                             'TEXT'),
+]
+
+COLUMN_NAMES = [name for name, _ in NOTES_COLUMN_DEFINITIONS]
+# DB側の型（NOT NULL などの制約を除いた部分。例: 'CHAR(18)', 'INTEGER'）
+COLUMN_SQL_TYPES = [sql_type.split()[0] for _, sql_type in NOTES_COLUMN_DEFINITIONS]
+
+# メモリ上の DataFrame で使う型
+# 整数カラムは NA を持てる整数型、それ以外は category（同じ値が並ぶカラムが大半のため、値ごとに文字列を1つだけ持つ）
+# NUMERIC（balance* / coord_*）は float にすると DB に入る値の桁数（3000 と 3000.0）が変わるため、整形済みの文字列のまま category にする
+# ocr_result_id などの固定長の ID もファイルグループごとに同じ値が並ぶため category にする
+INTEGER_DTYPES = {'SMALLINT': 'Int16', 'INTEGER': 'Int32', 'BIGINT': 'Int64'}
+TEXT_DTYPE = 'category'
+
+
+def base_type_name(sql_type):
+    """'VARCHAR(7)' → 'VARCHAR'"""
+    return sql_type.split('(')[0].upper()
+
+
+COLUMN_BASE_TYPES = {name: base_type_name(sql_type) for name, sql_type in zip(COLUMN_NAMES, COLUMN_SQL_TYPES)}
+COLUMN_DTYPES = {name: INTEGER_DTYPES.get(base_type, TEXT_DTYPE) for name, base_type in COLUMN_BASE_TYPES.items()}
+
+
+def columns_ddl(indent='    '):
+    """CREATE TABLE 文のカラム定義部分（1行1カラム）"""
+    return ',\n'.join(f"{indent}{name} {sql_type}" for name, sql_type in NOTES_COLUMN_DEFINITIONS)
+
+
+def to_compact_array(values, dtype, row_count):
+    """
+    カラムの値（文字列の Series / 配列、またはスカラー）を dtype の配列にする
+    空文字は整数カラムでは NA、category のカラムでは '' のまま（どちらも CSV では空欄、DB では NULL になる）
+    """
+    if np.ndim(values) == 0:
+        # 固定値のカラムは、値1つと 0 のコードだけを持つ配列にする
+        if dtype == TEXT_DTYPE:
+            return pd.Categorical.from_codes(np.zeros(row_count, dtype=np.int8), [values])
+        return pd.array(np.full(row_count, int(values)) if values != '' else [pd.NA] * row_count, dtype=dtype)
+    if dtype == TEXT_DTYPE:
+        return pd.Categorical(values)
+    values = pd.Series(values)
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        values = pd.to_numeric(values.where(values != ''))
+    return pd.array(values, dtype=dtype)
+
+
+def build_frame(columns, index):
+    """
+    カラム名 → 値（Series / 配列 / スカラー）の dict から、COLUMN_NAMES の順・COLUMN_DTYPES の型の DataFrame を作る
+    dict に無いカラムは空にする
+    """
+    row_count = len(index)
+    data = {name: to_compact_array(columns.get(name, ''), COLUMN_DTYPES[name], row_count) for name in COLUMN_NAMES}
+    return pd.DataFrame(data, index=index)
+
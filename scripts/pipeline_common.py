@@ -0,0 +1,112 @@
+import sys
+import time
+import functools
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import notes_schema
+import run_metrics
+
+# 加工（process_data.py）と結合（merge_processed_csv.py）の両方で使う処理
+# - 数値カラム（balance・conf_*・coord_*）の整形・チェック
+# - プロセスプールでの並列実行と、ワーカーで発生したエラーの表示
+# 結合はこのモジュールだけを読み込み、マスタデータの引き当てなど加工の処理（process_data.py）は読み込まない
+
+# 金額として扱う値のパターン（全角数字・記号を半角にし、カンマ・円マーク等を除去した後で判定）
+MONEY_TRANSLATION = str.maketrans('０１２３４５６７８９＋－−．', '0123456789+--.')
+MONEY_STRIP_PATTERN = r'[,，¥￥円\s]'
+MONEY_PATTERN = r'[+-]?[0-9]+(?:\.[0-9]+)?'
+INTEGER_PATTERN = r'[+-]?[0-9]+'
+
+# 数値として整形・チェックするカラム（DB側が NUMERIC / INTEGER のカラム）
+# conf_* は INTEGER のため小数を含む値は無効とする
+NUMERIC_COLUMNS = [col for col in notes_schema.COLUMN_NAMES if col.startswith(('balance', 'conf_', 'coord_'))]
+INTEGER_COLUMNS = [col for col in NUMERIC_COLUMNS if col.startswith('conf_')]
+
+
+def call_with_traceback(func, item):
+    """
+    func(item) を実行し、(結果, None, 処理時間) を返す
+    例外の場合は (None, (エラーメッセージ, トレースバック文字列), 処理時間) を返す
+    """
+    start = time.perf_counter()
+    try:
+        return func(item), None, time.perf_counter() - start
+    except Exception as e:
+        return None, (str(e), traceback.format_exc()), time.perf_counter() - start
+
+
+def map_in_processes(func, items, workers, timer_stage=None):
+    """
+    items の各要素に func を適用し、(結果, エラー情報) のリストを items と同じ順序で返す
+    workers が 2 以上の場合はプロセスプールで全コアに分散する（結果の順序は逐次実行と同じ）
+    func はプロセス間で受け渡せるよう、モジュールの最上位で定義した関数にすること
+    timer_stage を渡した場合、要素ごとの処理時間を run_metrics にその名前で記録する
+    （要素がタプルの場合は先頭の値（ファイルパス）を名前にする）
+    """
+    items = list(items)
+    call = functools.partial(call_with_traceback, func)
+    if workers <= 1 or len(items) <= 1:
+        results = [call(item) for item in items]
+    else:
+        # 小さなファイルが大量にあるため、プロセス間のやり取りはある程度まとめて行う
+        chunksize = max(1, len(items) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=min(workers, len(items))) as executor:
+            results = list(executor.map(call, items, chunksize=chunksize))
+    if timer_stage is not None:
+        for item, (_, _, seconds) in zip(items, results):
+            run_metrics.record_file(timer_stage, item[0] if isinstance(item, tuple) else item, seconds)
+    return [(result, error) for result, error, _ in results]
+
+
+def print_worker_error(message, error_traceback):
+    """ワーカーで発生したエラーを、メインプロセスで traceback.print_exc() と同じ形式で表示する"""
+    print(message)
+    sys.stderr.write(error_traceback)
+    sys.stderr.flush()
+
+
+def normalize_money(values, integer_only=False):
+    """
+    金額・数値列を列単位でまとめて整形する
+    全角数字を半角にし、カンマ・円マーク等を除去した値と、数値として有効かどうかのマスクを返す
+    無効な値は空文字にする（元が空の値は無効扱い）
+    coord_* や conf_* は同じ値が大量に並ぶため、重複を除いた値だけを整形してから元の並びに展開する
+    """
+    codes, uniques = pd.factorize(values.fillna('').astype(str))
+    unique_values = pd.Series(uniques, dtype=object)
+    cleaned = unique_values.str.translate(MONEY_TRANSLATION).str.replace(MONEY_STRIP_PATTERN, '', regex=True)
+    valid = cleaned.str.fullmatch(INTEGER_PATTERN if integer_only else MONEY_PATTERN).fillna(False).astype(bool)
+    cleaned = cleaned.where(valid, '')
+    return (pd.Series(cleaned.to_numpy(dtype=object)[codes], index=values.index, dtype=object),
+            pd.Series(valid.to_numpy(dtype=bool)[codes], index=values.index))
+
+
+@run_metrics.stage('validate')
+def clean_numeric_columns(df, invalid_counts=None):
+    """
+    NUMERIC_COLUMNS のうち df に存在する列を normalize_money() で整形する
+    列ごとに呼び出すと小さなファイルでは呼び出し回数が多くなるため、対象列をまとめて1本の列にしてから整形する
+    invalid_counts (dict) を渡した場合、空ではないのに数値として無効だった件数を列ごとに加算する
+    """
+    for integer_only in (False, True):
+        # 整数型（Int32 など）で持っている列は数値として作られているため対象外
+        cols = [col for col in NUMERIC_COLUMNS if col in df.columns and (col in INTEGER_COLUMNS) == integer_only
+                and not pd.api.types.is_numeric_dtype(df[col])]
+        if not cols or df.empty:
+            continue
+        values = pd.Series(df[cols].to_numpy(dtype=object).ravel(), dtype=object)
+        cleaned, valid = normalize_money(values, integer_only=integer_only)
+        if invalid_counts is not None:
+            invalid = (~valid & (values.fillna('').astype(str).str.strip() != '')).to_numpy().reshape(len(df), len(cols))
+            for col, count in zip(cols, invalid.sum(axis=0)):
+                if count:
+                    invalid_counts[col] = invalid_counts.get(col, 0) + int(count)
+        categorical_cols = [col for col in cols if isinstance(df[col].dtype, pd.CategoricalDtype)]
+        df[cols] = cleaned.to_numpy(dtype=object).reshape(len(df), len(cols))
+        if categorical_cols:
+            # build_postgre_frame() で作った category 型の列は category 型に戻す（notes_schema.py）
+            df[categorical_cols] = df[categorical_cols].astype(notes_schema.TEXT_DTYPE)
+    return df
@@ -1,230 +1,455 @@
 import pandas as pd
+import numpy as np
 import os
 import re
-import shutil 
 from datetime import datetime 
-import json 
-import glob # glob モジュールは新しいロジックで必須
+import glob
+import unicodedata
+import functools
+
+import app_config
+import source_cache
+import source_reader
+import run_metrics
+import pipeline_common
+import master_lookup
+import bank_lookup
+import columnar_format
+import notes_schema
 
 # 設定項目
-APP_ROOT_DIR = r'C:\Users\User26\yoko\dev\csvRead'
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
 
-# 加工済みファイルがあるフォルダ
+# 絞り込み済み（元データ）ファイルがあるフォルダ
+FILTERED_ORIGINALS_DIR = os.path.join(APP_ROOT_DIR, 'filtered_originals')
+# 加工済みファイルを保存するフォルダ
 PROCESSED_OUTPUT_BASE_DIR = os.path.join(APP_ROOT_DIR, 'processed_output') 
-# マージ済みファイルを保存するフォルダ
-MERGED_OUTPUT_BASE_DIR = os.path.join(APP_ROOT_DIR, 'merged_output') 
-# マスタデータフォルダ（ocr_id_mapping_notesReceivable.json が保存されている場所）    
+# マスタデータフォルダ（ocr_id_mapping.json・master.csv などが保存されている場所、読み込みは master_lookup.py）
 MASTER_DATA_DIR = os.path.join(APP_ROOT_DIR, 'master_data')
+# 前回加工したファイルのキャッシュ（変更のないファイルは加工をスキップする）
+CACHE_FILE = os.path.join(APP_ROOT_DIR, 'cache', 'process_cache.json')
+# ファイルの読み込み・保存に使うプロセス数（1 にすると従来どおり1ファイルずつ順番に処理する）
+PROCESS_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+# 元データを1回の読み込み（1プロセス）でまとめて読むファイル数（source_reader.py）
+READ_BATCH_FILES = 200
+# 加工済みファイルの保存形式
+# 'csv': BOM 付き UTF-8 の CSV（従来どおり）
+# 'parquet': 数値カラムを数値型のまま保存する Parquet（pyarrow が必要。無い場合は CSV で保存する）
+PROCESSED_OUTPUT_FORMAT = 'csv'
+# maker_com_code の引き当て方法（master_lookup.py）→ (maker_com_code_status_id, maker_comcd_relation_source_type_id)
+# 'master': master.csv と完全一致 / 'allocated': 自動採番した会社と完全一致 / 'fuzzy': 表記ゆれとしてあいまい一致 / '': maker_name が空
+# 引き当て方法ごとのコード値はまだ決まっていないため、すべて processed_output の既存データと同じ '30' とする
+# コード値が決まったら、設定ファイルの [process_data] MAKER_MATCH_STATUS_IDS で上書きする
+MAKER_MATCH_STATUS_IDS = {
+    'master': ['30', '30'],
+    'allocated': ['30', '30'],
+    'fuzzy': ['30', '30'],
+    '': ['30', '30'],
+}
+
+app_config.apply(globals())
+
+# 対象ファイル名 (例: B000001_2.jpg_020.csv → グループ B000001, ページ 2)
+SOURCE_FILE_PATTERN = re.compile(r'^(B\d+)_(\d+)\.jpg_020\.csv$', re.IGNORECASE)
+
+# notes_receivable のカラム順（カラム定義は notes_schema.py に一本化している）
+FINAL_POSTGRE_COLUMNS = notes_schema.COLUMN_NAMES
+
 
-# このリストは process_data.py の FINAL_POSTGRE_COLUMNS と完全に一致している必要がある
-FINAL_POSTGRE_COLUMNS = [
-    'ocr_result_id',
-    'page_no',
-    'id',
-    'jgroupid_string',
-    'cif_number',
-    'settlement_at',
-    'registration_number_original',
+# 元データのヘッダー → 加工後のカラム名（_original / 整形後の共通部分）
+# AIRead の出力はファイルによってヘッダーが微妙に異なるため、既知の表記揺れをすべてここで吸収する
+SOURCE_COLUMN_MAP = {
+    '登録番号': 'registration_number',
+    '振出人': 'maker_name',
+    '振出年月日': 'issue_date',
+    '支払期日': 'due_date',
+    '支払銀行名称': 'paying_bank_name',
+    '支払銀行名支店名': 'paying_bank_name',      # 銀行名と支店名が1カラムにまとまっているパターン
+    '支払銀行名称・支店名': 'paying_bank_name',  # 同上
+    '支払銀行支店名': 'paying_bank_branch_name',
+    '金額': 'balance',
+    '割引銀行名及び支店名等': 'discount_bank_name',
+    '摘要': 'description',
+}
+
+# 元データから取り込むカラム（_original と整形後のペアを作る対象）
+SOURCE_VALUE_COLUMNS = [
     'registration_number',
-    'maker_name_original',
     'maker_name',
-    'maker_com_code',
-    'maker_com_code_status_id',
-    'maker_comcd_relation_source_type_id',
-    'maker_exist_comcd_relation_history_id',
-    'issue_date_original',
     'issue_date',
-    'due_date_original',
     'due_date',
-    'paying_bank_name_original',
     'paying_bank_name',
-    'paying_bank_code',
-    'paying_bank_branch_name_original',
     'paying_bank_branch_name',
-    'balance_original',
     'balance',
-    'discount_bank_name_original',
     'discount_bank_name',
-    'discount_bank_code',
-    'description_original',
     'description',
-    'conf_registration_number',
-    'conf_maker_name',
-    'conf_issue_date',
-    'conf_due_date',
-    'conf_balance',
-    'conf_paying_bank_name',
-    'conf_paying_bank_branch_name',
-    'conf_discount_bank_name',
-    'conf_description',
-    'coord_x_registration_number',
-    'coord_y_registration_number',
-    'coord_h_registration_number',
-    'coord_w_registration_number',
-    'coord_x_maker_name',
-    'coord_y_maker_name',
-    'coord_h_maker_name',
-    'coord_w_maker_name',
-    'coord_x_issue_date',
-    'coord_y_issue_date',
-    'coord_h_issue_date',
-    'coord_w_issue_date',
-    'coord_x_due_date',
-    'coord_y_due_date',
-    'coord_h_due_date',
-    'coord_w_due_date',
-    'coord_x_balance',
-    'coord_y_balance',
-    'coord_h_balance',
-    'coord_w_balance',
-    'coord_x_paying_bank_name',
-    'coord_y_paying_bank_name',
-    'coord_h_paying_bank_name',
-    'coord_w_paying_bank_name',
-    'coord_x_paying_bank_branch_name',
-    'coord_y_paying_bank_branch_name',
-    'coord_h_paying_bank_branch_name',
-    'coord_w_paying_bank_branch_name',
-    'coord_x_discount_bank_name',
-    'coord_y_discount_bank_name',
-    'coord_h_discount_bank_name',
-    'coord_w_discount_bank_name',
-    'coord_x_description',
-    'coord_y_description',
-    'coord_h_description',
-    'coord_w_description',
-    'row_no',
-    'insertdatetime',
-    'updatedatetime',
-    'updateuser'             
 ]
 
-# 金額っぽい値かを判定する関数
-def is_money(value: str) -> bool:
-    """金額っぽい値（数字のみまたはカンマ区切り）かを判定"""
-    if isinstance(value, str):
-        # カンマ、円マークなどを除去してから判定
-        value = value.replace(",", "").replace("¥", "").replace("￥", "").replace("円", "").strip()
-    # 3桁以上の数字、または小数点を含む数字、または符号付き数字を金額と判定
-    return re.fullmatch(r"^[+-]?\d{1,}(\.\d+)?$", str(value)) is not None 
+# 加工中のみ使う補助カラム（出力時には落とす）
+SOURCE_FILE_COLUMN = 'source_file'
+FILE_GROUP_COLUMN = 'file_group'
+
+# 「〃」（同上）を表す記号
+DITTO_MARKS = ['〃', '同上']
+
+# 集計行の判定パターン
+# セル全体が「合計」「小計」「計」で終わる（後ろに括弧書きが付いてもよい）場合に集計行とみなす
+# 例: 計 / 小計 / 受取手形計 / (小計(受取手形)) / 計(電子債権)
+# 「東洋計器(株)」のように途中に「計」を含む会社名は対象外
+TOTAL_ROW_PATTERN = r'^[(（]?[^0-9,，]*?(?:合計|小計|計)(?:[(（][^)）]*[)）])?[)）]?$'
+
+# 和暦の日付のパターン（全角数字・記号を NFKC で半角にした後で判定）
+# 例: 5.2.3 / R5・2・3 / R.5.2.3 / 令5-2-3 / 令和5年2月3日 / 平成31.4.30 / H31/4/30 / R05/02/03 / 2023.2.3 / 2023年2月3日
+DATE_PATTERN = re.compile(
+    r'^(?P<era>令和|平成|昭和|令|平|昭|R|H|S)?[\s.]*(?P<year>\d{1,4}|元)\s*[.\-/・年]\s*(?P<month>\d{1,2})\s*[.\-/・月]\s*(?P<day>\d{1,2})\s*日?$',
+    re.IGNORECASE,
+)
+# 元号 → 元年の西暦年 - 1
+ERA_BASE_YEARS = {
+    '令和': 2018, '令': 2018, 'R': 2018,
+    '平成': 1988, '平': 1988, 'H': 1988,
+    '昭和': 1925, '昭': 1925, 'S': 1925,
+}
+# 元号の無い年（5.2.3 など）は令和とみなす。ただしこの値以上の年は平成とみなす（平成20年 = 2008年〜）
+BARE_YEAR_HEISEI_FROM = 20
+# 日付の変換結果を覚えておく件数（日付の種類は行数に比べて少ないため、同じ文字列は2回目から変換しない）
+DATE_CACHE_SIZE = 100000
+# 和暦の日付を ISO 形式（YYYY-MM-DD）に整形するカラム
+DATE_COLUMNS = ['issue_date', 'due_date']
+
+# 固定値
+FIXED_PAGE_NO = '1'          # page_no: 全て1で固定
+FIXED_JGROUPID_STRING = '001'  # jgroupid_string(店番): 全て001で固定
+
+# 元データに存在しないカラムの既定値（processed_output の既存データと同じ値）
+DEFAULT_COLUMN_VALUES = {
+    'maker_exist_comcd_relation_history_id': '20',
+    'updateuser': 'testuser',
+}
+DEFAULT_CONF_VALUE = '100'
+DEFAULT_COORD_VALUE = '3000'
+
+
+def parse_source_file_name(filename):
+    """
+    ファイル名からファイルグループとページ番号を取り出す
+    例: B000001_2.jpg_020.csv → ('B000001', 2)
+    パターンに合致しない場合は (None, None) を返す
+    """
+    match = SOURCE_FILE_PATTERN.match(os.path.basename(filename))
+    if not match:
+        return None, None
+    return match.group(1).upper(), int(match.group(2))
+
+
+def read_source_batch(file_paths):
+    """
+    AIRead が出力した B*_020.csv をまとめて読み込み、ヘッダーを SOURCE_VALUE_COLUMNS の名前に揃える（プロセスプールから呼ばれる）
+    全カラムを文字列として扱い、空欄は '' のまま保持する。戻り値は source_reader.read_files() を参照
+    """
+    return source_reader.read_files(file_paths, SOURCE_COLUMN_MAP, SOURCE_VALUE_COLUMNS)
+
+
+def read_source_files(file_paths, workers=None, failed_files=None):
+    """
+    複数の元データファイルを読み込み、1つの DataFrame に結合する
+    各行には元ファイル名とファイルグループを付与し、以降の加工はファイル単位で区切って列ごとに行う
+    ファイルは READ_BATCH_FILES 件ずつまとめて読み、workers 個（省略時は PROCESS_WORKERS）のプロセスで並列に行う
+    結合順は file_paths の順のままとする
+    failed_files (list) を渡した場合、読み込み中にエラーになったファイルのパスを追加する
+    """
+    target_files = []
+    for file_path in file_paths:
+        filename = os.path.basename(file_path)
+        file_group, _ = parse_source_file_name(filename)
+        if file_group is None:
+            run_metrics.file_message('unexpected_file_name', f"    ⚠️ 警告: {filename} はファイル名の形式が想定と異なるためスキップします。")
+            continue
+        target_files.append((file_path, filename, file_group))
+
+    batches = [target_files[i:i + READ_BATCH_FILES] for i in range(0, len(target_files), READ_BATCH_FILES)]
+    with run_metrics.stage('parse'):
+        results = pipeline_common.map_in_processes(read_source_batch, [[file_path for file_path, _, _ in batch] for batch in batches],
+                                                   PROCESS_WORKERS if workers is None else workers)
+
+    frames = []
+    for batch, (result, batch_error) in zip(batches, results):
+        if batch_error:
+            # バッチ全体が失敗した場合（メモリ不足など）は、バッチ内の全ファイルをエラーとして扱う
+            df, offsets, seconds, unknown_columns = None, [0] * (len(batch) + 1), [0.0] * len(batch), {}
+            errors = dict.fromkeys(range(len(batch)), batch_error)
+        else:
+            df, offsets, seconds, errors, unknown_columns = result
+        row_counts = np.diff(offsets)
+        for index, (file_path, filename, _) in enumerate(batch):
+            run_metrics.record_file('parse', file_path, seconds[index])
+            if index in unknown_columns:
+                run_metrics.file_message('unknown_columns', f"    ⚠️ 警告: {filename} に未知のカラムがあります（無視します）: {unknown_columns[index]}")
+            if index in errors:
+                pipeline_common.print_worker_error(f"  ❌ エラー: ファイル {filename} の読み込み中に問題が発生しました。エラー: {errors[index][0]}", errors[index][1])
+                if failed_files is not None:
+                    failed_files.append(file_path)
+            elif row_counts[index] == 0:
+                run_metrics.file_message('empty_file', f"    ℹ️ {filename} は空のためスキップします。")
+        if df is None or df.empty:
+            continue
+        # 行ごとの元ファイル名・ファイルグループ（offsets の範囲ごとに同じ値）
+        df[SOURCE_FILE_COLUMN] = np.repeat(np.array([filename for _, filename, _ in batch], dtype=object), row_counts)
+        df[FILE_GROUP_COLUMN] = np.repeat(np.array([file_group for _, _, file_group in batch], dtype=object), row_counts)
+        frames.append(df)
+        run_metrics.count('source_files', int((row_counts > 0).sum()))
+
+    if not frames:
+        return pd.DataFrame(columns=SOURCE_VALUE_COLUMNS + [SOURCE_FILE_COLUMN, FILE_GROUP_COLUMN])
+    raw_df = pd.concat(frames, ignore_index=True)
+    run_metrics.count('source_rows', len(raw_df))
+    return raw_df
 
 
-def merge_processed_csv_files():
+def fill_ditto_marks(df):
     """
-    processed_output フォルダ内の加工済みCSVファイルをファイルグループごとに結合し、
-    merged_output フォルダに保存する関数。
+    「〃」（同上）を直上のデータで埋め戻す（元のブランクは維持）
+    埋め戻しはファイルをまたがないよう、ファイル単位で行う
     """
-    print(f"--- ファイルグループごとの結合処理開始 ({datetime.now()}) ---")
-    print(f"加工済みファイルフォルダ: {PROCESSED_OUTPUT_BASE_DIR}")
-    print(f"結合済みファイル出力フォルダ: {MERGED_OUTPUT_BASE_DIR}")
+    values = df[SOURCE_VALUE_COLUMNS]
+    ditto_mask = values.apply(lambda col: col.str.strip().isin(DITTO_MARKS))
+    if not ditto_mask.to_numpy().any():
+        return df
 
-    os.makedirs(MERGED_OUTPUT_BASE_DIR, exist_ok=True)
+    filled = values.mask(ditto_mask).groupby(df[SOURCE_FILE_COLUMN], sort=False).ffill()
+    df[SOURCE_VALUE_COLUMNS] = filled.fillna('')
+    return df
 
-    # ★★★ お客様の新しいマージロジックを全面的に採用 ★★★
-    all_data_frames = [] # 各ファイルのデータ部分（ヘッダーなし）を格納するリスト
 
-    # 対象ファイルをすべて取得 (recursive=True でサブディレクトリも検索)
-    csv_files_to_merge = glob.glob(os.path.join(PROCESSED_OUTPUT_BASE_DIR, '**', '*_processed.csv'), recursive=True)
+def drop_total_rows(df):
+    """「合計」「小計」「計」などの集計行と、全カラムが空の行を削除する"""
+    values = df[SOURCE_VALUE_COLUMNS].apply(lambda col: col.str.strip())
+    is_total_row = values.apply(lambda col: col.str.match(TOTAL_ROW_PATTERN)).any(axis=1)
+    is_blank_row = (values == '').all(axis=1)
+    return df.loc[~(is_total_row | is_blank_row)].reset_index(drop=True)
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_wareki_date(text):
+    """和暦（令和・平成・昭和）または西暦の日付の文字列を ISO 形式（YYYY-MM-DD）にする。解釈できなければ None"""
+    match = DATE_PATTERN.match(unicodedata.normalize('NFKC', text).strip())
+    if not match:
+        return None
+    era = match.group('era')
+    year_text = match.group('year')
+    year = 1 if year_text == '元' else int(year_text)
+    if len(year_text) == 4:
+        if era:
+            return None  # 「R2023.1.1」のような元号付きの西暦は誤りとみなす
+    elif len(year_text) == 3:
+        return None
+    elif era:
+        year += ERA_BASE_YEARS[era.upper()]
+    else:
+        year += ERA_BASE_YEARS['平成' if year >= BARE_YEAR_HEISEI_FROM else '令和']
+    try:
+        return datetime(year, int(match.group('month')), int(match.group('day'))).strftime('%Y-%m-%d')
+    except ValueError:
+        return None  # 2月30日など存在しない日付
+
+
+def normalize_dates(values):
+    """
+    日付の列を列単位でまとめて ISO 形式（YYYY-MM-DD）に整形する
+    ISO 形式にした値と、日付として有効かどうかのマスクを返す（無効・空の値は空文字）
+    変換は重複を除いた値ごとに1回だけ行い、結果は parse_wareki_date() のキャッシュにも残る
+    """
+    codes, uniques = pd.factorize(values.fillna('').astype(str))
+    parsed = [parse_wareki_date(value) if value else None for value in uniques]
+    valid = pd.Series([value is not None for value in parsed], dtype=bool).to_numpy()
+    iso_dates = pd.Series([value or '' for value in parsed], dtype=object).to_numpy()
+    return (pd.Series(iso_dates[codes] if len(codes) else [], index=values.index, dtype=object),
+            pd.Series(valid[codes] if len(codes) else [], index=values.index, dtype=bool))
+
 
-    if not csv_files_to_merge:
-        print("⚠️ 警告: マージ対象のファイルが見つかりませんでした。")
-        print(f"\n--- ファイルグループごとの結合処理完了 ({datetime.now()}) ---")
-        print(f"🎉 結合されたファイルグループ数: 0 🎉")
+@run_metrics.stage('transform')
+def build_postgre_frame(raw_df, master, settlement_at, invalid_counts=None):
+    """
+    元データ（SOURCE_VALUE_COLUMNS + 補助カラム）を FINAL_POSTGRE_COLUMNS の形式に変換する
+    全ての処理は列単位で行い、行ごとの Python ループは使わない
+    各カラムは notes_schema.py の型（整数カラムは Int32 など、それ以外は category）で持つ
+    invalid_counts (dict) を渡した場合、日付として解釈できなかった件数を列ごとに加算する
+    """
+    df = fill_ditto_marks(raw_df.copy())
+    df = drop_total_rows(df)
+
+    # カラム名 → 値（固定値のカラムはスカラーのまま渡し、notes_schema.build_frame() で型に合わせて展開する）
+    columns = {}
+
+    file_groups = df[FILE_GROUP_COLUMN]
+    row_ids = df.groupby(SOURCE_FILE_COLUMN, sort=False).cumcount() + 1
+
+    columns['ocr_result_id'] = master_lookup.lookup_ocr_result_ids(master, file_groups)
+    columns['page_no'] = FIXED_PAGE_NO
+    columns['id'] = row_ids
+    columns['jgroupid_string'] = FIXED_JGROUPID_STRING
+    columns['cif_number'] = file_groups.str[1:]  # B000050 → 000050
+    columns['settlement_at'] = settlement_at
+
+    # _original は元データの値、対になるカラムは前後の空白を除去した値
+    for col in SOURCE_VALUE_COLUMNS:
+        columns[f'{col}_original'] = df[col]
+        columns[col] = df[col].str.strip()
+
+    # balance は NUMERIC 型のため、_original も含めて数値として取り込める形に整形する
+    columns['balance'], _ = pipeline_common.normalize_money(columns['balance'])
+    columns['balance_original'] = columns['balance']
+
+    # issue_date / due_date は和暦の日付を ISO 形式にする（_original は元データのまま）
+    for col in DATE_COLUMNS:
+        non_empty = columns[col] != ''
+        columns[col], valid = normalize_dates(columns[col])
+        if invalid_counts is not None and (non_empty & ~valid).any():
+            invalid_counts[col] = invalid_counts.get(col, 0) + int((non_empty & ~valid).sum())
+
+    # 支払銀行・割引銀行の銀行コードを bank_master.csv から引き当てる（master_lookup.py。マスタが無ければ空のまま）
+    # 支払銀行名に支店名まで入っている場合は銀行名と支店名に分ける（支店名のカラムが空の場合のみ支店名に入れる）
+    paying_banks = bank_lookup.resolve_bank_names(master['banks'], columns['paying_bank_name'], columns['paying_bank_branch_name'])
+    columns['paying_bank_name'] = paying_banks['bank_name']
+    columns['paying_bank_branch_name'] = paying_banks['branch_name']
+    columns['paying_bank_code'] = paying_banks['bank_code']
+    # 割引銀行は支店名のカラムが無いため、discount_bank_name は元の値のまま銀行コードだけを入れる
+    columns['discount_bank_code'] = bank_lookup.resolve_bank_names(master['banks'], columns['discount_bank_name'])['bank_code']
+
+    # maker_com_code は master.csv → 自動採番 → あいまい一致 の順に引き当て、引き当て方法をステータスのカラムに入れる
+    columns['maker_com_code'], maker_matches = master_lookup.lookup_maker_com_codes(master, columns['maker_name'])
+    for position, col in enumerate(['maker_com_code_status_id', 'maker_comcd_relation_source_type_id']):
+        columns[col] = maker_matches.map({match: ids[position] for match, ids in MAKER_MATCH_STATUS_IDS.items()}).fillna('')
+
+    columns.update(DEFAULT_COLUMN_VALUES)
+    columns.update({col: DEFAULT_CONF_VALUE for col in FINAL_POSTGRE_COLUMNS if col.startswith('conf_')})
+    columns.update({col: DEFAULT_COORD_VALUE for col in FINAL_POSTGRE_COLUMNS if col.startswith('coord_')})
+    columns['row_no'] = row_ids
+
+    out = notes_schema.build_frame(columns, df.index)
+    out[SOURCE_FILE_COLUMN] = pd.Categorical(df[SOURCE_FILE_COLUMN])
+    return out
+
+
+def write_processed_file(item):
+    """(出力パス, DataFrame) を受け取り、出力パスの拡張子の形式（.csv / .parquet）で保存する（プロセスプールから呼ばれる）"""
+    output_file_path, file_df = item
+    if columnar_format.is_parquet_file(output_file_path):
+        columnar_format.write_parquet(file_df, output_file_path, FINAL_POSTGRE_COLUMNS)
+    else:
+        file_df.to_csv(output_file_path, index=False, encoding='utf-8-sig')
+    return output_file_path
+
+
+def processed_file_extension():
+    """加工済みファイルの拡張子（PROCESSED_OUTPUT_FORMAT に従い、pyarrow が無い場合は .csv）"""
+    return columnar_format.FILE_EXTENSIONS[columnar_format.resolve_format(PROCESSED_OUTPUT_FORMAT)]
+
+
+@run_metrics.stage('write')
+def save_processed_files(processed_df, workers=None, extension='.csv'):
+    """
+    加工済みの DataFrame を元ファイルごとに _processed.csv（extension が .parquet の場合は _processed.parquet）として保存する
+    保存は workers 個（省略時は PROCESS_WORKERS）のプロセスで並列に行う。保存できたファイルの 元ファイル名 → 出力パス を返す
+    """
+    items = []
+    filenames = []
+    for filename, file_df in processed_df.groupby(SOURCE_FILE_COLUMN, sort=True, observed=True):
+        output_file_path = os.path.join(PROCESSED_OUTPUT_BASE_DIR, filename.replace('.csv', f'_processed{extension}'))
+        items.append((output_file_path, file_df[FINAL_POSTGRE_COLUMNS]))
+        filenames.append(filename)
+
+    saved_files = {}
+    for filename, (output_file_path, _), (_, error) in zip(filenames, items, pipeline_common.map_in_processes(
+            write_processed_file, items, PROCESS_WORKERS if workers is None else workers, timer_stage='write')):
+        if error:
+            pipeline_common.print_worker_error(f"❌ エラー: 加工済みファイル '{output_file_path}' の保存中に問題が発生しました。エラー: {error[0]}", error[1])
+            continue
+        saved_files[filename] = output_file_path
+    return saved_files
+
+
+def process_csv_files():
+    """
+    filtered_originals フォルダ内の B*_020.csv を読み込み、FINAL_POSTGRE_COLUMNS の形式に加工して
+    processed_output フォルダに _processed.csv として保存する関数。
+    """
+    print(f"--- 加工処理開始 ({datetime.now()}) ---")
+    print(f"元データフォルダ: {FILTERED_ORIGINALS_DIR}")
+    print(f"加工済みファイル出力フォルダ: {PROCESSED_OUTPUT_BASE_DIR}")
+
+    os.makedirs(PROCESSED_OUTPUT_BASE_DIR, exist_ok=True)
+
+    source_files = sorted(glob.glob(os.path.join(FILTERED_ORIGINALS_DIR, 'B*020.csv')))
+
+    # 前回加工時から変更のないファイルはスキップし、元データから消えたファイルの加工済みファイルは削除する
+    # 保存形式を切り替えた場合、前回と違う形式で保存されているファイルも加工し直す
+    extension = processed_file_extension()
+    cache = source_cache.load_cache(CACHE_FILE)
+    evicted_count = source_cache.evict_missing(cache, source_files)
+    changed_files = [file_path for file_path in source_files
+                     if not source_cache.is_unchanged(cache, file_path)
+                     or not (source_cache.cached_output(cache, file_path) or extension).endswith(extension)]
+    unchanged_count = len(source_files) - len(changed_files)
+    if unchanged_count or evicted_count:
+        print(f"  ⏭️ 変更がないためスキップ: {unchanged_count} 件 / 🧹 元データから削除されたため除去: {evicted_count} 件")
+
+    if not changed_files:
+        source_cache.save_cache(CACHE_FILE, cache)
+        print("✅ 新しく追加・変更されたファイルはありませんでした。" if source_files else "⚠️ 警告: 加工対象のファイルが見つかりませんでした。")
+        print(f"\n--- 加工処理完了 ({datetime.now()}) ---")
         return
 
-    # グループ名は「all」にする（お客様の指示）
-    group_name = 'all' # BXXXXXX_merged.csv ではなく all_merged.csv にするため
-    output_file_path = os.path.join(MERGED_OUTPUT_BASE_DIR, f'{group_name}_merged.csv')
-
-    print(f"  → 全てのファイルを結合し、'{group_name}' グループとして保存します。")
-
-    for file_path in sorted(csv_files_to_merge): # ファイルパスをソートして結合順を保証
-        try:
-            # _processed.csv を読み込む
-            # header=0 で読み込み、ヘッダーを正しく認識させる。
-            df_current_file = pd.read_csv(file_path, encoding='utf-8-sig', dtype=str, header=0, na_values=['〃'], keep_default_na=False)
-            
-            if df_current_file.empty: 
-                print(f"    ℹ️ {os.path.basename(file_path)} は空のためスキップします。")
-                continue
-
-            # デバッグ情報: 読み込み直後のカラム数と一覧
-            actual_cols = df_current_file.columns.tolist()
-            print(f"    📄 ファイル {os.path.basename(file_path)} 読み込み直後のカラム数: {len(actual_cols)}")
-            print(f"    🧩 ファイル {os.path.basename(file_path)} 読み込み直後のカラム一覧: {actual_cols}")
-
-            # 想定される最終カラム数と一致するかを厳密にチェック
-            if len(actual_cols) != len(FINAL_POSTGRE_COLUMNS):
-                print(f"    ⚠️ 警告: ファイル {os.path.basename(file_path)} の列数が想定と異なります（{len(actual_cols)}列 vs 期待 {len(FINAL_POSTGRE_COLUMNS)}列）。このファイルはスキップされます。")
-                continue # 列数が一致しない場合はスキップ
-
-            # 列名に重複がないかチェック
-            if len(set(actual_cols)) != len(actual_cols):
-                print(f"    ⚠️ 警告: ファイル {os.path.basename(file_path)} で重複する列名が検出されました → {actual_cols}。このファイルはスキップされます。")
-                continue # 列名に重複がある場合もスキップ
-
-            # df_current_file のカラム名を FINAL_POSTGRE_COLUMNS に強制的に設定
-            # これにより、df_current_fileの物理的なデータとFINAL_POSTGRE_COLUMNSの名前が正しく紐づきます。
-            # reindexを使用することで、もし元の_processed.csvの物理的な順序が若干異なっても、
-            # カラム名に基づいてデータを正しく配置し、存在しないカラムはNaN/空で埋めます。
-            df_current_file = df_current_file.reindex(columns=FINAL_POSTGRE_COLUMNS).fillna('')
-            
-            # balance列の金額チェック（保存前に整形）
-            # is_money関数を使用して、金額として有効な値のみを保持する
-            for col in ['balance_original', 'balance']:
-                if col in df_current_file.columns:
-                    df_current_file[col] = df_current_file[col].apply(lambda x: x if is_money(x) else "")
-
-            all_data_frames.append(df_current_file)
-            print(f"    - {os.path.basename(file_path)} のデータを結合リストに追加しました。")
-
-        except Exception as e:
-            print(f"  ❌ エラー: ファイル {os.path.basename(file_path)} の読み込み/処理中に問題が発生しました。エラー: {e}")
-            import traceback 
-            traceback.print_exc() 
-
-    if not all_data_frames:
-        print("⚠️ 警告: 結合対象の有効なデータが見つからなかったため、マージは行われません。")
-        print(f"\n--- ファイルグループごとの結合処理完了 ({datetime.now()}) ---")
-        print(f"🎉 結合されたファイルグループ数: 0 🎉")
+    print(f"  → {len(changed_files)} 件のファイルを読み込みます。")
+    raw_df = read_source_files(changed_files)
+    if raw_df.empty:
+        source_cache.save_cache(CACHE_FILE, cache)
+        print("⚠️ 警告: 加工対象の有効なデータが見つかりませんでした。")
+        print(f"\n--- 加工処理完了 ({datetime.now()}) ---")
         return
 
-    # 全てのデータフレームを結合
-    merged_df = pd.concat(all_data_frames, ignore_index=True)
-    
-    # 最終的なocr_result_id, page_no, id, jgroupid_string, cif_number, settlement_at の設定
-    # combined_dfは all_data_frames の concat なので、すでにこれらのカラムは含まれている
-    # ocr_id_mapping_from_file から expected_ocr_id_for_group を取得する必要があるが、
-    # 'all'グループのファイルには特定のOCR_IDが紐づかない。
-    # ここでは、全データが結合された後、ocr_result_idはそのまま保持され、
-    # その他の ID (page_no, id, jgroupid_string, cif_number) は個々の行の値を信頼する。
-    # ocr_result_idのNoneはmerge_processed_csvs_notesPayable.pyのocr_id_map_filepathの解決で対応済みのはず。
-
-    # 最終的な金額列のチェックとクリーンアップ（この段階で最後の保証）
-    for col in ['balance_original', 'balance']:
-        if col in merged_df.columns:
-            merged_df[col] = merged_df[col].apply(lambda x: x if is_money(x) else "")
-    print(f"  ℹ️ 最終マージ済みDataFrameの'balance_original'と'balance'カラムの金額チェックとクリーンアップを行いました。")
-
-
-    # 結合されたDataFrameを保存
-    try:
-        # header=False で保存 (PostgreSQL COPYコマンド向け)
-        merged_df.to_csv(output_file_path, index=False, header=False, encoding='utf-8-sig')
-        print(f"✅ 全てマージ完了！→ {output_file_path}")
-    except Exception as e:
-        print(f"❌ エラー: マージ済みファイル '{output_file_path}' の保存中に問題が発生しました。エラー: {e}")
-        import traceback
-        traceback.print_exc()
+    # マスタデータは1回だけ読み込み、採番した ocr_result_id / maker_com_code はその場で保存される
+    master = master_lookup.load_master_data(MASTER_DATA_DIR)
+    if master['jgroupids'] and not master_lookup.is_valid_jgroupid(master, pd.Series([FIXED_JGROUPID_STRING])).all():
+        print(f"    ⚠️ 警告: jgroupid_string '{FIXED_JGROUPID_STRING}' が jgroupid_master.csv にありません。")
+    new_groups = master_lookup.allocate_ocr_result_ids(master, raw_df[FILE_GROUP_COLUMN])
+    if new_groups:
+        print(f"  ℹ️ 新しいファイルグループに ocr_result_id を採番しました: {len(new_groups)} 件")
+
+    allocated_before = len(master['allocated_maker_codes'])
+    settlement_at = datetime.now().strftime('%Y%m')
 
+    invalid_counts = {}
+    processed_df = build_postgre_frame(raw_df, master, settlement_at, invalid_counts)
+    if invalid_counts:
+        print(f"  ⚠️ 警告: 日付として解釈できないため空にした値があります → {invalid_counts}")
+    saved_files = save_processed_files(processed_df, extension=extension)
 
-    print(f"\n--- ファイルグループごとの結合処理完了 ({datetime.now()}) ---")
-    print(f"🎉 結合されたファイルグループ数: 1 (allグループ) 🎉") # グループはall一つなので常に1
-    print(f"\n🎉 全ての結合処理が完了しました！ ({datetime.now()}) 🎉")
+    # 読み込めたファイルだけをキャッシュに記録する（集計行のみで出力が無いファイルも記録し、次回はスキップする）
+    read_files = set(raw_df[SOURCE_FILE_COLUMN].unique())
+    for file_path in changed_files:
+        filename = os.path.basename(file_path)
+        if filename in saved_files:
+            previous_output = source_cache.cached_output(cache, file_path)
+            if previous_output and previous_output != saved_files[filename] and os.path.exists(previous_output):
+                os.remove(previous_output)
+            source_cache.record_file(cache, file_path, saved_files[filename])
+        elif filename in read_files:
+            source_cache.record_file(cache, file_path)
+    source_cache.save_cache(CACHE_FILE, cache)
+
+    print(f"\n--- 加工処理完了 ({datetime.now()}) ---")
+    print(f"✅ 読み込んだ行数: {len(raw_df)} / 加工後の行数: {len(processed_df)}")
+    print(f"✅ 新しく採番した maker_com_code: {len(master['allocated_maker_codes']) - allocated_before} 件")
+    print(f"🎉 {len(saved_files)} 個の加工済みファイルを保存しました！🎉")
 
 # --- メイン処理 ---
+def main():
+    print(f"--- 加工処理スクリプト開始: {datetime.now()} ---")
+    run_metrics.start_run('process_data')
+    process_csv_files()
+    run_metrics.finish_run()
+    print(f"\n🎉 全ての加工処理が完了しました！ ({datetime.now()}) 🎉")
+
 if __name__ == "__main__":
-    print(f"--- 結合処理スクリプト開始: {datetime.now()} ---")
-    merge_processed_csv_files()
-    print(f"\n🎉 全ての結合処理が完了しました！ ({datetime.now()}) 🎉")
-    
\ No newline at end of file
+    main()
@@ -0,0 +1,223 @@
+import os
+import sys
+import json
+import time
+import heapq
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import app_config
+
+# 処理時間・件数の計測と、実行ごとのレポート（JSON）の保存
+# 各スクリプトは段階（parse / transform / copy など）ごとの処理時間を stage() で、ファイルごとの処理時間を
+# record_file() で、行数・バイト数を count() で記録する。__main__ から start_run() / finish_run() で囲むと、
+# 終了時に REPORT_DIR へレポートを保存する（囲まない場合も記録は行い、snapshot() で取り出せる）
+#
+# stage() は with 文のほか、関数のデコレータとしても使える（@run_metrics.stage('transform')）
+# map_in_processes() のワーカープロセス内で記録した値は親プロセスに戻らないため、ワーカーの処理時間は
+# map_in_processes(..., timer_stage=...) で親プロセス側に記録する
+#
+# ファイルごとのメッセージ（空のためスキップ・未知のカラムなど）は file_message() で出力する。
+# QUIET = True の場合は表示せず、種類ごとの件数だけをレポートに残す（大量のファイルでは表示そのものに時間がかかる）
+
+# 設定項目
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
+# レポートの保存先（実行ごとに「日時_スクリプト名.json」を保存する）
+REPORT_DIR = os.path.join(APP_ROOT_DIR, 'reports')
+WRITE_REPORT = True
+# True にするとファイルごとのメッセージを表示しない（件数はレポートの messages に残る）
+QUIET = False
+# プロファイラ
+# None: 使わない
+# 'cprofile': 関数ごとの処理時間をレポートと同じ名前の .prof に保存する（python -m pstats や snakeviz で見る）
+# 'tracemalloc': ピークメモリと、終了時点で確保されたままのメモリが多い箇所の上位 PROFILE_TOP_N 件をレポートに残す（処理は数倍遅くなる）
+PROFILE = None
+PROFILE_TOP_N = 20
+# ファイルごとの処理時間のうち、レポートに残す遅いファイルの件数（段階ごと）
+SLOWEST_FILES = 20
+
+app_config.apply(globals())
+
+_lock = threading.Lock()
+
+
+def new_run(name=None):
+    return {
+        'name': name,
+        'started_at': datetime.now().isoformat(),
+        'start': time.perf_counter(),
+        'stages': {},
+        'files': {},
+        'counters': {},
+        'messages': {},
+        'profiler': None,
+    }
+
+
+_run = new_run()
+_END = object()
+
+
+def peak_rss_mb(children=False):
+    """
+    このプロセス（children=True の場合は終了した子プロセスのうち最大のもの）のピークメモリ（RSS, MB）を返す
+    取得できない環境では None
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        # Linux は KB、macOS はバイト単位
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    if children:
+        return None
+    try:
+        import psutil  # Windows では psutil がある場合のみ取得する
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except (ImportError, AttributeError):
+        return None
+
+
+@contextmanager
+def stage(name):
+    """with stage('parse'): ... の処理時間（経過時間・CPU 時間）を段階ごとに加算する"""
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        cpu_seconds = time.process_time() - cpu_start
+        with _lock:
+            entry = _run['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+            entry['calls'] += 1
+            entry['seconds'] += seconds
+            entry['cpu_seconds'] += cpu_seconds
+
+
+def timed_iter(name, iterable):
+    """
+    iterable の要素を順に返し、要素を作るのにかかった時間を段階 name に加算する
+    チャンクを少しずつ作りながら送る処理（エンコード → COPY など）で、作る側の時間だけを取り出すために使う
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
+
+
+def count(name, value=1):
+    """行数・バイト数などの件数を加算する"""
+    with _lock:
+        _run['counters'][name] = _run['counters'].get(name, 0) + value
+
+
+def record_file(stage_name, file_name, seconds):
+    """
+    ファイル（またはチャンク）1つ分の処理時間を記録する
+    件数・合計・最大と、遅い順に SLOWEST_FILES 件のファイル名だけを残す（ファイル数によらずレポートの大きさは一定）
+    """
+    with _lock:
+        entry = _run['files'].setdefault(stage_name, {'files': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'slowest': []})
+        entry['files'] += 1
+        entry['seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
+        item = (seconds, os.path.basename(str(file_name)))
+        if len(entry['slowest']) < SLOWEST_FILES:
+            heapq.heappush(entry['slowest'], item)
+        elif item > entry['slowest'][0]:
+            heapq.heapreplace(entry['slowest'], item)
+
+
+def file_message(category, message):
+    """ファイルごとのメッセージを表示する。QUIET の場合は表示せず、category ごとの件数だけを数える"""
+    with _lock:
+        _run['messages'][category] = _run['messages'].get(category, 0) + 1
+    if not QUIET:
+        print(message)
+
+
+def start_run(name):
+    """計測をやり直し、PROFILE が指定されていればプロファイラを開始する"""
+    global _run
+    _run = new_run(name)
+    if PROFILE == 'cprofile':
+        import cProfile
+        _run['profiler'] = cProfile.Profile()
+        _run['profiler'].enable()
+    elif PROFILE == 'tracemalloc':
+        import tracemalloc
+        tracemalloc.start()
+
+
+def snapshot():
+    """ここまでの計測結果を dict で返す（JSON にそのまま保存できる形）"""
+    with _lock:
+        stages = {name: {'calls': entry['calls'], 'seconds': round(entry['seconds'], 3),
+                         'cpu_seconds': round(entry['cpu_seconds'], 3)}
+                  for name, entry in _run['stages'].items()}
+        files = {}
+        for name, entry in _run['files'].items():
+            files[name] = {
+                'files': entry['files'],
+                'seconds': round(entry['seconds'], 3),
+                'mean_ms': round(entry['seconds'] / entry['files'] * 1000, 2) if entry['files'] else None,
+                'max_ms': round(entry['max_seconds'] * 1000, 2),
+                'slowest': [{'file': file_name, 'ms': round(seconds * 1000, 2)}
+                            for seconds, file_name in sorted(entry['slowest'], reverse=True)],
+            }
+        return {
+            'name': _run['name'],
+            'started_at': _run['started_at'],
+            'seconds': round(time.perf_counter() - _run['start'], 3),
+            'peak_rss_mb': peak_rss_mb(),
+            'peak_rss_children_mb': peak_rss_mb(children=True),
+            'stages': stages,
+            'files': files,
+            'counters': dict(_run['counters']),
+            'messages': dict(_run['messages']),
+        }
+
+
+def finish_run():
+    """プロファイラを止め、レポートを REPORT_DIR に保存する（WRITE_REPORT が False の場合は保存しない）。保存したパスを返す"""
+    import platform  # csvread.py の起動を速くするため、使うときに読み込む
+
+    report = snapshot()
+    report.update({
+        'finished_at': datetime.now().isoformat(),
+        'argv': sys.argv,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'profile': PROFILE,
+    })
+    if not WRITE_REPORT:
+        return None
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    base_path = os.path.join(REPORT_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{_run['name'] or 'run'}")
+    if _run['profiler'] is not None:
+        _run['profiler'].disable()
+        _run['profiler'].dump_stats(base_path + '.prof')
+        report['profile_file'] = base_path + '.prof'
+    elif PROFILE == 'tracemalloc':
+        import tracemalloc
+        _, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')[:PROFILE_TOP_N]
+        tracemalloc.stop()
+        report['tracemalloc'] = {
+            'peak_mb': round(peak / 1024 / 1024, 1),
+            'top': [{'location': str(stat.traceback), 'size_mb': round(stat.size / 1024 / 1024, 2), 'count': stat.count}
+                    for stat in top],
+        }
+
+    with open(base_path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"ℹ️ 実行レポートを保存しました → {base_path}.json")
+    return base_path + '.json'
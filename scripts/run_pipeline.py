@@ -0,0 +1,176 @@
+import os
+import codecs
+import shutil
+from datetime import datetime
+
+import app_config
+import filter_and_copy_csv
+import process_data
+import pipeline_common
+import master_lookup
+import merge_processed_csv
+import insert_to_postgres
+import csv_copy
+import notes_schema
+import source_index
+import run_metrics
+
+# 設定項目
+# 1回の加工・COPYでまとめて扱うファイル数（メモリ使用量の上限を決める）
+BATCH_FILE_COUNT = 500
+
+# デバッグ用の中間ファイル出力（通常運用では False のまま）
+# 絞り込み結果を SEARCH_RESULT_OUTPUT_BASE_DIR にコピーする
+SAVE_FILTERED_COPIES = False
+# 加工済みファイルを processed_output に _processed.csv として保存する
+SAVE_PROCESSED_FILES = False
+# 結合結果を merged_output/all_merged.csv として保存する（BOM・圧縮は merge_processed_csv.py の MERGED_CSV_BOM / MERGED_CSV_COMPRESSION）
+SAVE_MERGED_FILE = False
+
+app_config.apply(globals())
+
+
+def iter_batches(items, batch_size):
+    """リストを batch_size 件ずつに区切って返す"""
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def source_file_sort_key(file_path):
+    """ファイルグループ → ページ番号の順に並べるためのキー（パターンに合致しないファイルは末尾）"""
+    group, page = process_data.parse_source_file_name(file_path)
+    if group is None:
+        return (1, '', 0, file_path)
+    return (0, group, page, file_path)
+
+
+def unique_source_files(source_files):
+    """
+    別のフォルダにある同じ名前のファイルは、同じページとして主キー (ocr_result_id, page_no, id) が重複するため、
+    並びの先のファイル（source_file_sort_key の順ならパスの順）だけを残す
+    """
+    source_files, dropped = source_index.unique_file_names(source_files)
+    for file_path, kept_path in dropped.items():
+        run_metrics.file_message('filename_collision', f"⚠️ 警告: {file_path} は {kept_path} と同じ名前のため読み込みません。")
+    run_metrics.count('collision_files', len(dropped))
+    return source_files
+
+
+def renumber_group_ids(df, group_next_ids):
+    """
+    id をファイルグループ（ocr_result_id）全体の連番に振り直す（merge_processed_csv.py のグループ結合と同じ番号になる）
+    バッチをまたぐグループのために、グループごとの次の番号を group_next_ids に保持する
+    """
+    group_ids = df['ocr_result_id'].astype(object)
+    offsets = group_ids.map(group_next_ids).fillna(1).astype(int)
+    new_ids = group_ids.groupby(group_ids, sort=False).cumcount() + offsets
+    df['id'] = new_ids.astype(notes_schema.COLUMN_DTYPES['id'])
+    group_next_ids.update((new_ids + 1).groupby(group_ids).max().to_dict())
+    return df
+
+
+def iter_pipeline_chunks(source_files, stats, merged_file=None):
+    """
+    元データファイルを BATCH_FILE_COUNT 件ずつ 加工 → 結合 し、COPY 用のチャンクとして返す
+    ジェネレータとして実装しているため、COPY 中のチャンクと次のバッチの加工が並行して進む
+    """
+    # マスタデータは最初に1回だけ読み込み、全バッチで共有する
+    master = master_lookup.load_master_data(process_data.MASTER_DATA_DIR)
+    settlement_at = datetime.now().strftime('%Y%m')
+    group_next_ids = {}
+
+    for batch_no, batch_files in enumerate(iter_batches(source_files, BATCH_FILE_COUNT), start=1):
+        print(f"  ⏳ バッチ {batch_no}: {len(batch_files)} 件のファイルを処理中...")
+
+        if SAVE_FILTERED_COPIES:
+            for src_filepath in batch_files:
+                dest_filepath = os.path.join(filter_and_copy_csv.SEARCH_RESULT_OUTPUT_BASE_DIR, os.path.basename(src_filepath))
+                shutil.copy2(src_filepath, dest_filepath)
+
+        raw_df = process_data.read_source_files(batch_files)
+        if raw_df.empty:
+            print(f"    ℹ️ バッチ {batch_no} には有効なデータがありませんでした。")
+            continue
+
+        # 採番結果はその場で保存され、途中で失敗しても次回の実行で同じ ocr_result_id を使う
+        new_groups = master_lookup.allocate_ocr_result_ids(master, raw_df[process_data.FILE_GROUP_COLUMN])
+        stats['new_groups'] += len(new_groups)
+
+        processed_df = process_data.build_postgre_frame(raw_df, master, settlement_at)
+        if SAVE_PROCESSED_FILES:
+            process_data.save_processed_files(processed_df)
+
+        merged_df = pipeline_common.clean_numeric_columns(processed_df[merge_processed_csv.FINAL_POSTGRE_COLUMNS].copy())
+        merged_df = renumber_group_ids(merged_df, group_next_ids)
+        if merged_file is not None:
+            for block in csv_copy.iter_frame_blocks(merged_df, line_terminator=os.linesep):
+                merged_file.write(block)
+        chunk = insert_to_postgres.frame_to_copy_chunk(merged_df)
+
+        stats['rows'] += len(merged_df)
+        yield f"バッチ{batch_no}", chunk
+
+
+def run_pipeline():
+    """
+    検索元フォルダの B*_020.csv を 検索 → 加工 → 結合 → COPY の順に1プロセスで処理する関数。
+    各段階の結果はメモリ上で次の段階に渡し、中間CSVはデバッグ用の設定が有効な場合のみ保存する。
+    COPY は insert_to_postgres.bulk_load_chunks() でステージングテーブル経由の並列ロードを行う。
+    """
+    print(f"--- 一括処理開始 ({datetime.now()}) ---")
+    print(f"検索元フォルダ: {filter_and_copy_csv.INPUT_BASE_DIR}")
+
+    counter = {'checked': 0}
+    # ファイルグループ・ページ順に並べ、グループ内の id がページ順の連番になるようにする
+    with run_metrics.stage('scan'):
+        source_files = sorted(filter_and_copy_csv.find_target_csv_files(filter_and_copy_csv.INPUT_BASE_DIR, counter), key=source_file_sort_key)
+    source_files = unique_source_files(source_files)
+    print(f"✅ 検索元フォルダ内の合計ファイル数: {counter['checked']} / 対象ファイル数: {len(source_files)}")
+
+    if not source_files:
+        print("⚠️ 警告: 処理対象のファイルが見つかりませんでした。")
+        return
+
+    if SAVE_FILTERED_COPIES:
+        os.makedirs(filter_and_copy_csv.SEARCH_RESULT_OUTPUT_BASE_DIR, exist_ok=True)
+    if SAVE_PROCESSED_FILES:
+        os.makedirs(process_data.PROCESSED_OUTPUT_BASE_DIR, exist_ok=True)
+
+    merged_file = None
+    if SAVE_MERGED_FILE:
+        os.makedirs(merge_processed_csv.MERGED_OUTPUT_BASE_DIR, exist_ok=True)
+        compression = csv_copy.resolve_compression(merge_processed_csv.MERGED_CSV_COMPRESSION)
+        merged_file_path = os.path.join(merge_processed_csv.MERGED_OUTPUT_BASE_DIR, f'all_merged{csv_copy.csv_extension(compression)}')
+        csv_copy.remove_other_csv_files(merge_processed_csv.MERGED_OUTPUT_BASE_DIR, 'all_merged', csv_copy.csv_extension(compression))
+        merged_file = csv_copy.open_output(merged_file_path, compression)
+        if merge_processed_csv.MERGED_CSV_BOM:
+            merged_file.write(codecs.BOM_UTF8)
+
+    stats = {'rows': 0, 'new_groups': 0}
+    try:
+        chunks = iter_pipeline_chunks(source_files, stats, merged_file)
+        loaded_rows = insert_to_postgres.bulk_load_chunks(chunks)
+    except Exception as e:
+        print(f"  ❌ エラー: インポートに失敗しました。notes_receivable は変更されていません。エラー内容: {e}")
+        import traceback
+        traceback.print_exc()
+        return
+    finally:
+        if merged_file is not None:
+            merged_file.close()
+
+    if stats['new_groups']:
+        print(f"  ℹ️ 新しいファイルグループに ocr_result_id を採番しました: {stats['new_groups']} 件")
+
+    print(f"\n--- 一括処理完了 ({datetime.now()}) ---")
+    print(f"✅ 加工した行数: {stats['rows']} / インポートした行数: {loaded_rows}")
+
+# --- メイン処理 ---
+def main():
+    run_metrics.start_run('run_pipeline')
+    run_pipeline()
+    run_metrics.finish_run()
+    print(f"\n🎉 全ての処理が完了しました！ ({datetime.now()}) 🎉")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+
+# ファイル単位の処理結果キャッシュ
+# 元ファイルのパスごとに (サイズ, 更新日時, 内容ハッシュ, 出力ファイル) を保持し、
+# 変更のないファイルはコピー・加工・結合をスキップできるようにする
+#
+# 判定ルール:
+#   1. サイズと更新日時が一致 → 変更なし
+#   2. 更新日時だけ異なる → 内容ハッシュを計算し、一致すれば変更なし（更新日時を更新する）
+#   3. それ以外 → 変更あり
+# 元ファイルが削除された場合は evict_missing() でエントリと出力ファイルを削除する
+
+
+def cache_key(file_path):
+    """キャッシュのキー（正規化した絶対パス）を返す"""
+    return os.path.normcase(os.path.abspath(file_path))
+
+
+def load_cache(cache_file):
+    """キャッシュファイルを読み込む。存在しない・壊れている場合は空のキャッシュを返す"""
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 警告: キャッシュファイル {cache_file} を読み込めなかったため、作り直します。エラー: {e}")
+        return {}
+
+
+def save_cache(cache_file, cache):
+    """キャッシュファイルを保存する（一時ファイルに書いてから置き換える）"""
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+
+
+def file_hash(file_path):
+    """ファイル内容の SHA-256 を返す"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_unchanged(cache, file_path, require_output=True):
+    """
+    前回処理したときからファイルが変わっていなければ True を返す
+    require_output=True の場合、記録された出力ファイルが存在しないときも変更ありとみなす
+    """
+    entry = cache.get(cache_key(file_path))
+    if entry is None:
+        return False
+
+    stat = os.stat(file_path)
+    if entry['size'] != stat.st_size:
+        return False
+    if entry['mtime_ns'] != stat.st_mtime_ns:
+        # 更新日時だけが変わった場合（再コピーなど）は内容ハッシュで判定する
+        if entry['sha256'] != file_hash(file_path):
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+
+    output = entry.get('output')
+    if require_output and output and not os.path.exists(output):
+        return False
+    return True
+
+
+def record_file(cache, file_path, output=None, sha256=None):
+    """
+    処理が完了したファイルをキャッシュに記録する（output は生成した出力ファイルのパス）
+    内容ハッシュを計算済みの場合は sha256 に渡す（ファイルを読み直さない）
+    """
+    stat = os.stat(file_path)
+    cache[cache_key(file_path)] = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': sha256 or file_hash(file_path),
+        'output': output,
+    }
+
+
+def cached_output(cache, file_path):
+    """キャッシュに記録された出力ファイルのパスを返す（無ければ None）"""
+    entry = cache.get(cache_key(file_path))
+    return entry.get('output') if entry else None
+
+
+def cached_hash(cache, file_path):
+    """キャッシュに記録された内容ハッシュを返す（無ければ None）"""
+    entry = cache.get(cache_key(file_path))
+    return entry.get('sha256') if entry else None
+
+
+def evict_missing(cache, existing_paths, delete_outputs=True):
+    """
+    今回の走査で見つからなかった（元ファイルが削除された）エントリをキャッシュから削除する
+    delete_outputs=True の場合は、そのエントリから生成された出力ファイルも削除する
+    削除したエントリ数を返す
+    """
+    existing_keys = {cache_key(path) for path in existing_paths}
+    evicted_keys = [key for key in cache if key not in existing_keys]
+    for key in evicted_keys:
+        output = cache.pop(key).get('output')
+        if delete_outputs and output and os.path.exists(output):
+            try:
+                os.remove(output)
+            except OSError as e:
+                print(f"⚠️ 警告: {output} の削除に失敗しました。エラー: {e}")
+    return len(evicted_keys)
@@ -0,0 +1,197 @@
+import os
+import io
+import csv
+import codecs
+import hashlib
+import unicodedata
+
+import source_cache
+
+# 絞り込み（コピー）段階のファイル名・内容の索引
+# 検索元のサブフォルダ（担当者ごとのフォルダなど）のファイルはコピー先の1つのフォルダにまとめるため、
+# 別のフォルダにある同じ名前のファイルは上書きし合い、同じ内容のページは2回登録されて主キー (ocr_result_id, page_no, id) が重複する。
+# コピーしたファイルごとに ファイル名 → (元ファイル, 内容ハッシュ) を保存しておき、コピーする前に次を判定する（どちらも dict の参照1回）
+#   - 'collision': 同じ名前で内容の異なるファイルが、別のフォルダから既にコピーされている
+#   - 'duplicate': 同じ内容のファイルが既にコピーされている（ファイル名は問わない）
+# 行単位の重複除去（任意）では、コピーしたファイルの行ごとの内容ハッシュも保存し、他のファイルと同じ内容の行を除いてコピーする
+#
+# 索引ファイル（JSON）の形式:
+#   files:   ファイル名のキー → {'source': 元ファイルのキー, 'sha256': 内容ハッシュ, 'rows': [行のハッシュ, ...]}
+#   skipped: 衝突・重複のためコピーしなかった元ファイルのキー → source_cache と同じエントリ + 理由・相手のファイル名のキー
+# 内容ハッシュ・行のハッシュから相手のファイル名を引く表は、読み込み時に作り直す（保存しない）
+
+# 「〃」（同上）を表す記号（process_data.DITTO_MARKS と同じ）
+DITTO_MARKS = ['〃', '同上']
+# 行のハッシュの長さ（バイト）。8 バイトなら 100 万行でも衝突の確率は無視できる
+ROW_DIGEST_SIZE = 8
+# 空でない値がこれより少ない行（「計」「合計」「受取手形」などの集計行・見出し行）は、他のファイルと同じでも除かない
+MIN_ROW_VALUES = 3
+
+
+def name_key(file_path):
+    """ファイル名のキー（コピー先で同じファイルになる名前は同じキー。Windows では大文字小文字を区別しない）"""
+    return os.path.normcase(os.path.basename(file_path))
+
+
+def load_index(index_file):
+    """索引ファイルを読み込み、ハッシュから引く表を作り直して返す（無い・壊れている場合は空の索引）"""
+    saved = source_cache.load_cache(index_file)
+    index = {'files': saved.get('files', {}), 'skipped': saved.get('skipped', {}), 'hashes': {}, 'row_owners': {}}
+    for name, entry in index['files'].items():
+        add_lookups(index, name, entry)
+    return index
+
+
+def save_index(index_file, index):
+    source_cache.save_cache(index_file, {'files': index['files'], 'skipped': index['skipped']})
+
+
+def add_lookups(index, name, entry):
+    index['hashes'].setdefault(entry['sha256'], name)
+    for digest in entry.get('rows', []):
+        index['row_owners'].setdefault(digest, name)
+
+
+def remove_entry(index, name):
+    """ファイル名の索引と、そのファイルのハッシュから引く表のエントリを削除する"""
+    entry = index['files'].pop(name, None)
+    if entry is None:
+        return
+    if index['hashes'].get(entry['sha256']) == name:
+        del index['hashes'][entry['sha256']]
+        # 同じ内容の別のファイル（SKIP_DUPLICATE_FILES = False でコピーしたもの）があれば、そちらを引けるようにする
+        other = next((other for other, other_entry in index['files'].items() if other_entry['sha256'] == entry['sha256']), None)
+        if other is not None:
+            index['hashes'][entry['sha256']] = other
+    for digest in entry.get('rows', []):
+        if index['row_owners'].get(digest) == name:
+            del index['row_owners'][digest]
+
+
+def check_file(index, file_path, sha256):
+    """
+    元ファイルをコピーしてよいか判定し、(理由, 相手のファイル名のキー) を返す
+    理由は None（コピーしてよい。前回コピーしたファイル自身の更新を含む）/ 'collision' / 'duplicate'
+    """
+    name = name_key(file_path)
+    entry = index['files'].get(name)
+    if entry is not None:
+        if entry['source'] == source_cache.cache_key(file_path):
+            return None, None
+        return ('duplicate' if entry['sha256'] == sha256 else 'collision'), name
+    owner = index['hashes'].get(sha256)
+    if owner is not None:
+        return 'duplicate', owner
+    return None, None
+
+
+def record_file(index, file_path, sha256, row_digests=None):
+    """コピーするファイルを索引に記録する（同じ名前の前回のエントリは置き換える）"""
+    name = name_key(file_path)
+    remove_entry(index, name)
+    entry = {'source': source_cache.cache_key(file_path), 'sha256': sha256}
+    if row_digests:
+        entry['rows'] = row_digests
+    index['files'][name] = entry
+    add_lookups(index, name, entry)
+    index['skipped'].pop(source_cache.cache_key(file_path), None)
+
+
+def record_skipped(index, file_path, sha256, reason, owner):
+    """衝突・重複のためコピーしなかった元ファイルを記録する（次回、変更が無ければ読み直さずに同じ判定をする）"""
+    source_cache.record_file(index['skipped'], file_path, sha256=sha256)
+    index['skipped'][source_cache.cache_key(file_path)].update(reason=reason, owner=owner)
+
+
+def skipped_reason(index, file_path):
+    """
+    前回コピーしなかった元ファイルが変わっておらず、相手のファイルも索引に残っていれば、その (理由, 相手) を返す
+    そうでなければ (None, None)（改めて判定する）
+    """
+    entry = index['skipped'].get(source_cache.cache_key(file_path))
+    if entry is None or entry['owner'] not in index['files']:
+        return None, None
+    if not source_cache.is_unchanged(index['skipped'], file_path, require_output=False):
+        return None, None
+    return entry['reason'], entry['owner']
+
+
+def evict_missing(index, existing_paths):
+    """
+    今回の走査で見つからなかった元ファイルのエントリを削除する（コピー先のファイルの削除は source_cache.evict_missing() が行う）
+    削除されたファイルと衝突していたファイルは、次回の実行でコピーされる
+    """
+    existing_keys = {source_cache.cache_key(path) for path in existing_paths}
+    for name in [name for name, entry in index['files'].items() if entry['source'] not in existing_keys]:
+        remove_entry(index, name)
+    source_cache.evict_missing(index['skipped'], existing_paths, delete_outputs=False)
+
+
+def unique_file_names(file_paths):
+    """
+    file_paths を並びの順に見て、同じファイル名（name_key）の2つ目以降を除く
+    (残したパスのリスト, 除いたパス → 残した同じ名前のパス) を返す（コピーせずに元ファイルを直接読む場合の衝突よけ）
+    """
+    kept = {}
+    dropped = {}
+    for file_path in file_paths:
+        name = name_key(file_path)
+        if name in kept:
+            dropped[file_path] = kept[name]
+        else:
+            kept[name] = file_path
+    return list(kept.values()), dropped
+
+
+def parse_rows(data):
+    """
+    元ファイルの内容（バイト列）から (BOM の有無, ヘッダー, データ行のリスト) を返す
+    データ行の「〃」（同上）は直上の行の値で埋め戻す（行を除いても、次の行の値が変わらないようにする）。空行は除く
+    """
+    has_bom = data.startswith(codecs.BOM_UTF8)
+    reader = csv.reader(io.StringIO(codecs.decode(data, 'utf-8-sig'), newline=''))
+    header = next(reader, [])
+    rows = []
+    previous = []
+    for row in reader:
+        if not row:
+            continue
+        row = [previous[i] if value.strip() in DITTO_MARKS and i < len(previous) else value for i, value in enumerate(row)]
+        rows.append(row)
+        previous = row
+    return has_bom, header, rows
+
+
+def row_digest(row):
+    """行の内容ハッシュ（各値を NFKC 正規化して前後の空白を除いたもので計算する）。空でない値が MIN_ROW_VALUES より少ない行は None"""
+    values = [unicodedata.normalize('NFKC', value).strip() for value in row]
+    if sum(1 for value in values if value) < MIN_ROW_VALUES:
+        return None
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=ROW_DIGEST_SIZE).hexdigest()
+
+
+def select_rows(index, file_path, rows):
+    """
+    他のファイル（索引に記録済み）と同じ内容の行を除き、(残す行のリスト, 残す行のハッシュのリスト) を返す
+    同じファイルの中で同じ内容の行は除かない（同じ手形が2行ある場合と区別できないため）
+    """
+    name = name_key(file_path)
+    kept_rows = []
+    digests = []
+    for row in rows:
+        digest = row_digest(row)
+        owner = index['row_owners'].get(digest)
+        if owner is not None and owner != name:
+            continue
+        kept_rows.append(row)
+        if digest is not None:
+            digests.append(digest)
+    return kept_rows, list(dict.fromkeys(digests))
+
+
+def write_rows(file_path, has_bom, header, rows):
+    """ヘッダーと行を CSV として書き出す（元ファイルと同じく BOM の有無を合わせ、改行は CRLF）"""
+    with open(file_path, 'w', encoding='utf-8-sig' if has_bom else 'utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
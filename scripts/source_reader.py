@@ -0,0 +1,106 @@
+import io
+import csv
+import mmap
+import time
+import codecs
+import operator
+import traceback
+
+import numpy as np
+import pandas as pd
+
+# AIRead が出力した元データ（B*_020.csv）の一括読み込み
+# 元データは 1〜3 KB の小さなファイルが大量にあり、pd.read_csv() をファイルごとに呼ぶと
+# データの量よりも呼び出しごとの準備の方が時間がかかる。ここでは複数のファイルを標準の csv モジュールで順に読み、
+# 取り込むカラムだけを1つの DataFrame にまとめて返す（pd.read_csv(dtype=str, keep_default_na=False) と同じ値になる）
+#
+# - 先頭の BOM は除去し、ダブルクォートで囲まれた値（カンマ・改行を含む金額など）はそのまま1つの値として読む
+# - 空行は読み飛ばし、ヘッダーより列の少ない行は足りない列を空文字にする。列の多い行はファイルごとエラーにする
+# - 「〃」（同上）は値のまま残し、process_data.fill_ditto_marks() でファイル単位に埋め戻す
+
+# 設定項目
+# この大きさ以上のファイルはメモリマップで読み込む（通常の元データはこれより小さいため read() で読む）
+MMAP_MIN_BYTES = 1024 * 1024
+
+
+def read_text(file_path):
+    """ファイルを UTF-8（BOM 付きも可）のテキストとして読み込む"""
+    with open(file_path, 'rb') as f:
+        if f.seek(0, io.SEEK_END) < MMAP_MIN_BYTES:
+            f.seek(0)
+            return codecs.decode(f.read(), 'utf-8-sig')
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return codecs.decode(mapped, 'utf-8-sig')
+
+
+def header_names(header):
+    """ヘッダーの列名の前後の空白を除去する。同じ列名が重複する場合は pd.read_csv() と同じく2つ目以降に .1 / .2 を付ける"""
+    names = []
+    seen = {}
+    for name in header:
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        names.append(name.strip())
+    return names
+
+
+def read_rows(file_path, column_map, value_columns):
+    """
+    1つのファイルを読み、value_columns の順に並べた行（タプル）のリストと、column_map に無い列名のリストを返す
+    column_map は ヘッダーの列名 → value_columns の名前（複数の列が同じ名前に割り当たる場合は左の列を優先する）
+    """
+    reader = csv.reader(io.StringIO(read_text(file_path), newline=''))
+    header = next(reader, None)
+    if header is None:
+        raise ValueError("No columns to parse from file")
+    names = header_names(header)
+
+    positions = {}
+    for position, name in enumerate(names):
+        if name in column_map:
+            positions.setdefault(column_map[name], position)
+    unknown_columns = [name for name in names if name not in column_map]
+
+    # 取り込まないカラムは行の末尾に足した空文字の位置から取る
+    width = len(names)
+    pick = operator.itemgetter(*[positions.get(col, width) for col in value_columns])
+    padding = [''] * (width + 1)
+    rows = []
+    for line_no, row in enumerate(reader, start=2):
+        if not row:
+            continue
+        if len(row) > width:
+            raise ValueError(f"Expected {width} fields in line {line_no}, saw {len(row)}")
+        rows.append(pick(row + padding[len(row):]))
+    return rows, unknown_columns
+
+
+def read_files(file_paths, column_map, value_columns):
+    """
+    複数のファイルを順に読み、全ファイルの行を1つの DataFrame（カラムは value_columns、全て文字列）にまとめる
+    ファイルごとの行の範囲は offsets で返す（i 番目のファイルの行は offsets[i]〜offsets[i + 1] - 1）
+    読み込めなかったファイルは行数 0 とし、errors に 位置 → (エラーメッセージ, トレースバック文字列) を入れる
+    (DataFrame, offsets, 処理時間のリスト, errors, 位置 → 未知の列名のリスト) を返す（プロセスプールから呼ばれる）
+    """
+    rows = []
+    offsets = [0]
+    seconds = []
+    errors = {}
+    unknown_columns = {}
+    for index, file_path in enumerate(file_paths):
+        start = time.perf_counter()
+        try:
+            file_rows, unknown = read_rows(file_path, column_map, value_columns)
+            rows.extend(file_rows)
+            if unknown:
+                unknown_columns[index] = unknown
+        except Exception as e:
+            errors[index] = (str(e), traceback.format_exc())
+        offsets.append(len(rows))
+        seconds.append(time.perf_counter() - start)
+
+    values = np.array(rows, dtype=object).reshape(len(rows), len(value_columns))
+    return pd.DataFrame(values, columns=value_columns, dtype=str), offsets, seconds, errors, unknown_columns
@@ -0,0 +1,298 @@
+import os
+import re
+import time
+import queue
+import traceback
+from datetime import datetime
+
+import app_config
+import filter_and_copy_csv
+import process_data
+import pipeline_common
+import master_lookup
+import insert_to_postgres
+import run_pipeline
+import source_cache
+import run_metrics
+
+# 検索元フォルダを監視し、追加・変更された B*_020.csv をその場で 加工 → 結合 → DB登録 する常駐プロセス
+# pandas の読み込み・マスタデータの読み込みは起動時に1回だけ行い、以降は書き込みの終わったファイルを
+# 数秒分まとめて1回の COPY（insert_to_postgres.py の incremental ロード）で登録する
+#
+# 変更の検知:
+#   watchdog がインストールされていれば OS のファイル変更通知（Linux は inotify、Windows は ReadDirectoryChangesW）を使い、
+#   無い場合（または WATCH_METHOD = 'poll'）は POLL_INTERVAL_SECONDS ごとに検索元フォルダを走査して、
+#   前回の走査結果（パス → サイズ・更新日時）と比べる
+#
+# 使い方:
+#   python watch_pipeline.py   （Ctrl+C で終了）
+
+# watchdog は任意（pip install watchdog）。無ければポーリングで監視する
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+# 設定項目
+APP_ROOT_DIR = app_config.get('APP_ROOT_DIR', r'C:\Users\User26\yoko\dev\csvRead')
+# 登録済みファイルのキャッシュ（再起動時、前回から変更のないファイルは登録し直さない）
+CACHE_FILE = os.path.join(APP_ROOT_DIR, 'cache', 'watch_cache.json')
+# 変更の検知方法
+# 'auto': watchdog があればファイル変更通知、無ければポーリング
+# 'poll': 常にポーリング（共有ドライブなど、変更通知が届かないフォルダを監視する場合）
+WATCH_METHOD = 'auto'
+POLL_INTERVAL_SECONDS = 5       # ポーリングの間隔
+RESCAN_INTERVAL_SECONDS = 600   # 変更通知を使う場合も、通知の取りこぼしに備えてこの間隔でフォルダ全体を走査する
+SETTLE_SECONDS = 2              # サイズ・更新日時がこの秒数変わらなければ書き込みが終わったとみなす
+BATCH_WINDOW_SECONDS = 2        # 書き込みの終わったファイルをこの秒数待ってまとめ、1回の COPY で登録する
+MAX_BATCH_FILES = run_pipeline.BATCH_FILE_COUNT  # 1回の COPY にまとめるファイル数の上限
+RETRY_SECONDS = 60              # 登録に失敗した場合に再試行するまでの秒数
+TICK_SECONDS = 0.5              # 監視ループの間隔
+# 1回に読み込むファイルは少ないため、プロセスプールは使わず常駐プロセスで読み込む（プロセスの起動のほうが遅い）
+READ_WORKERS = 1
+
+app_config.apply(globals())
+
+
+class SourceEventHandler:
+    """watchdog のイベントのうち、検索パターンに合致するファイルのパスを changed_paths に入れる（Observer のスレッドから呼ばれる）"""
+
+    def __init__(self, changed_paths):
+        self.changed_paths = changed_paths
+        self.regex = re.compile(filter_and_copy_csv.SEARCH_PATTERN, re.IGNORECASE)
+
+    def dispatch(self, event):
+        if event.is_directory:
+            return
+        # 移動（名前の変更）は移動元・移動先の両方を確認する
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            path = os.fsdecode(path)
+            if path and self.regex.match(os.path.basename(path)):
+                self.changed_paths.put(path)
+
+
+def file_signature(file_path):
+    """(サイズ, 更新日時) を返す。ファイルが無ければ None"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def file_group(file_path):
+    return process_data.parse_source_file_name(file_path)[0]
+
+
+def new_watch_state():
+    """
+    監視の状態
+    known: 検索元フォルダにあるファイルの パス → (サイズ, 更新日時)（書き込み中のファイルは pending にだけ入る）
+    pending: 書き込みの終わりを待っているファイルの パス → ((サイズ, 更新日時), その値になった時刻)
+    ready: 書き込みが終わり、登録を待っているファイルの パス → 書き込みが終わった時刻
+    deleted: 削除されたファイルのパス（ファイルグループごと登録し直す）
+    """
+    return {'known': {}, 'pending': {}, 'ready': {}, 'deleted': set(), 'retry_at': 0.0}
+
+
+def mark_changed(state, file_path, signature, now):
+    """ファイルの追加・変更・削除を状態に反映する（signature が None の場合は削除）"""
+    if signature is None:
+        state['pending'].pop(file_path, None)
+        state['ready'].pop(file_path, None)
+        if state['known'].pop(file_path, None) is not None:
+            state['deleted'].add(file_path)
+        return
+    if state['known'].get(file_path) == signature and file_path not in state['pending']:
+        return  # 変更なし（変更通知が重複して届いた場合など）
+    previous = state['pending'].get(file_path)
+    if previous is None or previous[0] != signature:
+        state['pending'][file_path] = (signature, now)
+    state['ready'].pop(file_path, None)
+
+
+def apply_scan(state, signatures, now):
+    """フォルダ全体の走査結果（パス → (サイズ, 更新日時)）と比べ、追加・変更・削除されたファイルを反映する"""
+    for file_path, signature in signatures.items():
+        mark_changed(state, file_path, signature, now)
+    for file_path in list(state['known']) + list(state['pending']):
+        if file_path not in signatures:
+            mark_changed(state, file_path, None, now)
+
+
+def settle_pending(state, now):
+    """SETTLE_SECONDS の間サイズ・更新日時が変わらなかったファイルを、書き込みが終わったものとして ready に移す"""
+    for file_path, (signature, since) in list(state['pending'].items()):
+        current = file_signature(file_path)
+        if current != signature:
+            mark_changed(state, file_path, current, now)
+        elif now - since >= SETTLE_SECONDS:
+            del state['pending'][file_path]
+            state['known'][file_path] = signature
+            if file_group(file_path) is None:
+                print(f"    ⚠️ 警告: {os.path.basename(file_path)} はファイル名の形式が想定と異なるためスキップします。")
+                continue
+            state['ready'][file_path] = now
+
+
+def is_batch_due(state, now):
+    """登録を始めるか（最初に揃ったファイルから BATCH_WINDOW_SECONDS 経ったか、MAX_BATCH_FILES 件揃った）"""
+    if now < state['retry_at'] or not (state['ready'] or state['deleted']):
+        return False
+    if len(state['ready']) >= MAX_BATCH_FILES or not state['ready']:
+        return True
+    return now - min(state['ready'].values()) >= BATCH_WINDOW_SECONDS
+
+
+def load_batch(state, master, cache):
+    """
+    ready / deleted のファイルのファイルグループを 加工 → 結合 し、1回の COPY で notes_receivable に UPSERT する
+    id はファイルグループ全体の連番のため、変更のあったファイルだけでなく、同じグループの全ページを読み直して登録する
+    （書き込み中のページは含めない。書き込みが終わった時点で、そのグループをもう一度登録し直す）
+    """
+    ready_paths = sorted(state['ready'], key=state['ready'].get)[:MAX_BATCH_FILES]
+    groups = {file_group(file_path) for file_path in ready_paths + sorted(state['deleted'])} - {None}
+    candidate_files = sorted((file_path for file_path in state['known']
+                              if file_group(file_path) in groups and file_path not in state['pending']),
+                             key=run_pipeline.source_file_sort_key)
+    # 別のフォルダにある同じ名前のファイルは読み込まない（登録済みとして扱い、何度も登録し直さない）
+    group_files = run_pipeline.unique_source_files(candidate_files)
+    print(f"  ⏳ {len(ready_paths)} 件の追加・変更 / {len(state['deleted'])} 件の削除 → "
+          f"{len(groups)} ファイルグループ（{len(group_files)} ファイル）を登録します。")
+
+    failed_files = []
+    raw_df = process_data.read_source_files(group_files, workers=READ_WORKERS, failed_files=failed_files)
+    # 読み込めなかったファイルのグループは、一部のページだけで登録すると他のページの行が消えるため、今回は登録しない
+    failed_groups = {file_group(file_path) for file_path in failed_files}
+    if failed_groups and not raw_df.empty:
+        raw_df = raw_df[~raw_df[process_data.FILE_GROUP_COLUMN].isin(failed_groups)].reset_index(drop=True)
+
+    chunks = []
+    loaded_ids = set()
+    if not raw_df.empty:
+        master_lookup.allocate_ocr_result_ids(master, raw_df[process_data.FILE_GROUP_COLUMN])
+        processed_df = process_data.build_postgre_frame(raw_df, master, datetime.now().strftime('%Y%m'))
+        merged_df = pipeline_common.clean_numeric_columns(processed_df[process_data.FINAL_POSTGRE_COLUMNS].copy())
+        merged_df = run_pipeline.renumber_group_ids(merged_df, {})
+        if not merged_df.empty:
+            chunks.append((f"{len(group_files)} ファイル", insert_to_postgres.frame_to_copy_chunk(merged_df)))
+            loaded_ids = set(merged_df['ocr_result_id'].astype(str))
+
+    # 有効な行が1行も無くなったグループ（全ページの削除・集計行だけになったページなど）は、登録済みの行を削除する
+    emptied_ids = [master['ocr_result_ids'][group] for group in groups - failed_groups
+                   if group in master['ocr_result_ids'] and master['ocr_result_ids'][group] not in loaded_ids]
+
+    insert_to_postgres.bulk_load_chunks(chunks, mode='incremental', deleted_ocr_result_ids=emptied_ids)
+
+    # 登録できたファイルだけを ready / deleted から外し、キャッシュに記録する
+    done_groups = groups - failed_groups
+    for file_path in candidate_files:
+        if file_group(file_path) in done_groups:
+            state['ready'].pop(file_path, None)
+            if file_signature(file_path) is not None:  # 登録中に削除された場合は次の走査で削除として扱う
+                source_cache.record_file(cache, file_path)
+    state['deleted'] = {file_path for file_path in state['deleted'] if file_group(file_path) not in done_groups}
+    source_cache.evict_missing(cache, state['known'], delete_outputs=False)
+    source_cache.save_cache(CACHE_FILE, cache)
+    if failed_groups:
+        print(f"  ⚠️ 警告: 読み込めなかったファイルのあるグループは {RETRY_SECONDS} 秒後に再試行します: {sorted(failed_groups)}")
+        state['retry_at'] = time.monotonic() + RETRY_SECONDS
+
+
+def master_files_signature(master_data_dir):
+    """master.csv / jgroupid_master.csv / bank_master.csv の更新日時（変更されたらマスタデータを読み込み直す）"""
+    return tuple(file_signature(os.path.join(master_data_dir, file_name))
+                 for file_name in (master_lookup.MAKER_MASTER_FILE_NAME, master_lookup.JGROUPID_MASTER_FILE_NAME,
+                                   master_lookup.BANK_MASTER_FILE_NAME))
+
+
+def watch_source_files():
+    """
+    検索元フォルダを監視し、書き込みの終わった B*_020.csv を BATCH_WINDOW_SECONDS ごとにまとめて DB に登録し続ける関数。
+    起動時は、前回登録したときから変更のあるファイル・前回以降に削除されたファイルを登録し直す。
+    """
+    input_base_dir = filter_and_copy_csv.INPUT_BASE_DIR
+    print(f"--- 監視開始 ({datetime.now()}) ---")
+    print(f"検索元フォルダ: {input_base_dir}")
+
+    master_data_dir = process_data.MASTER_DATA_DIR
+    master = master_lookup.load_master_data(master_data_dir)
+    master_signature = master_files_signature(master_data_dir)
+
+    # 起動時の走査：前回登録したときから変更のないファイルは登録済みとして扱う
+    state = new_watch_state()
+    cache = source_cache.load_cache(CACHE_FILE)
+    now = time.monotonic()
+    signatures = dict(filter_and_copy_csv.find_target_csv_files(input_base_dir, with_stat=True))
+    for file_path, signature in signatures.items():
+        if source_cache.is_unchanged(cache, file_path, require_output=False):
+            state['known'][file_path] = signature
+        else:
+            state['pending'][file_path] = (signature, now)
+    existing_keys = {source_cache.cache_key(file_path) for file_path in signatures}
+    state['deleted'] = {key for key in cache if key not in existing_keys}
+    print(f"✅ 対象ファイル数: {len(signatures)} / 登録待ち: {len(state['pending'])} / 削除されたファイル: {len(state['deleted'])}")
+
+    changed_paths = queue.Queue()
+    observer = None
+    if WATCH_METHOD == 'auto' and Observer is not None:
+        observer = Observer()
+        observer.schedule(SourceEventHandler(changed_paths), input_base_dir, recursive=True)
+        observer.start()
+        print("✅ ファイル変更通知で監視します。")
+    else:
+        if WATCH_METHOD == 'auto':
+            print("ℹ️ watchdog がインストールされていないため、ポーリングで監視します（pip install watchdog で変更通知を使えます）。")
+        print(f"✅ {POLL_INTERVAL_SECONDS} 秒ごとの走査で監視します。")
+    scan_interval = POLL_INTERVAL_SECONDS if observer is None else RESCAN_INTERVAL_SECONDS
+    next_scan = now + scan_interval
+
+    try:
+        while True:
+            # 変更通知は届き次第処理し、無ければ TICK_SECONDS 待つ
+            try:
+                changed = [changed_paths.get(timeout=TICK_SECONDS)]
+            except queue.Empty:
+                changed = []
+            while not changed_paths.empty():
+                changed.append(changed_paths.get_nowait())
+            now = time.monotonic()
+            for file_path in set(changed):
+                mark_changed(state, file_path, file_signature(file_path), now)
+            if now >= next_scan:
+                apply_scan(state, dict(filter_and_copy_csv.find_target_csv_files(input_base_dir, with_stat=True)), now)
+                next_scan = now + scan_interval
+            settle_pending(state, now)
+
+            if not is_batch_due(state, now):
+                continue
+            if master_files_signature(master_data_dir) != master_signature:
+                print("  ℹ️ マスタデータが更新されたため読み込み直します。")
+                master = master_lookup.load_master_data(master_data_dir)
+                master_signature = master_files_signature(master_data_dir)
+            start = time.perf_counter()
+            try:
+                load_batch(state, master, cache)
+                print(f"  ✅ 登録が完了しました（{time.perf_counter() - start:.2f} 秒） ({datetime.now()})")
+            except Exception as e:
+                print(f"  ❌ エラー: 登録に失敗しました。{RETRY_SECONDS} 秒後に再試行します。notes_receivable は変更されていません。エラー内容: {e}")
+                traceback.print_exc()
+                state['retry_at'] = time.monotonic() + RETRY_SECONDS
+    except KeyboardInterrupt:
+        print("\nℹ️ 監視を終了します。")
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        source_cache.save_cache(CACHE_FILE, cache)
+
+    print(f"\n--- 監視終了 ({datetime.now()}) ---")
+
+# --- メイン処理 ---
+def main():
+    run_metrics.start_run('watch_pipeline')
+    watch_source_files()
+    run_metrics.finish_run()
+
+if __name__ == "__main__":
+    main()
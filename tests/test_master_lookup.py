@@ -0,0 +1,36 @@
+import hashlib
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+
+import master_lookup  # noqa: E402
+
+
+def company_keys(count):
+    """互いにあいまい一致しない会社名（正規化済みのキー）を count 件作る"""
+    return pd.Series([master_lookup.normalize_company_name(hashlib.md5(str(no).encode()).hexdigest()[:16].upper())
+                      for no in range(count)], dtype=object)
+
+
+def test_allocate_maker_com_codes_widens_past_999(tmp_path, capsys):
+    master = master_lookup.load_master_data(str(tmp_path))
+    keys = company_keys(1005)
+
+    assert master_lookup.allocate_maker_com_codes(master, keys) == 1005
+
+    codes = master['allocated_maker_codes']
+    assert len(set(codes.values())) == 1005
+    assert codes[keys[0]] == '2001'
+    assert codes[keys[998]] == '2999'
+    assert codes[keys[999]] == '21000'
+    assert codes[keys[1004]] == '21005'
+    assert '⚠️' in capsys.readouterr().out
+
+    # 保存したマッピングを読み直しても、続きの番号から採番する
+    reloaded = master_lookup.load_master_data(str(tmp_path))
+    assert reloaded['allocated_maker_codes'] == codes
+    assert master_lookup.allocate_maker_com_codes(reloaded, pd.Series(['新規テスト商事'], dtype=object)) == 1
+    assert reloaded['allocated_maker_codes']['新規テスト商事'] == '21006'